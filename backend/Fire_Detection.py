@@ -1,18 +1,511 @@
 #Fire_Detection.py
 import cv2
 import numpy as np
+import os
 import time
+import threading
 from ultralytics import YOLO
-from collections import defaultdict
+from collections import defaultdict, deque
 import requests
-import base64
 import logging
+from frame_protocol import pack_frame, producer_control, CONTENT_TYPE as FRAME_CONTENT_TYPE
+from shm_frame_store import SharedFrameStore, DoorbellRinger
+from fire_prefilter import FirePrefilter, PREFILTER_MODE
+from cascade import CascadeDetector, CASCADE
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("Fire_Detection")
 
 # توجه: پورت ws_server.py به 8010 تغییر کرد
 WS_SERVER_URL = 'http://localhost:8010/push_image'
+# Binary ingest endpoint (frame_protocol header + raw JPEG), used over a keep-alive session
+WS_SERVER_FRAME_URL = 'http://localhost:8010/push_frame'
+# "shm": write frames straight into the relay's shared-memory store when ws_server.py runs on
+# this host with RELAY_SHARED_STORE=1; "http" (default, and the fallback) posts to WS_SERVER_FRAME_URL
+FRAME_TRANSPORT = os.environ.get("FRAME_TRANSPORT", "http")
+# Detection metadata (boxes, classes, confidences, track ids) per processed frame, as JSON
+WS_SERVER_DETECTIONS_URL = 'http://localhost:8010/push_detections'
+# Video sent to the relay: "annotated" (boxes burned in), "raw" (clients draw overlays from
+# /ws/detections, no plot() cost) or "none" (detections only)
+PUBLISH_VIDEO = os.environ.get("PUBLISH_VIDEO", "annotated")
+PUBLISH_DETECTIONS = os.environ.get("PUBLISH_DETECTIONS", "1") == "1"
+# Polled for the relay's control message while no previews are being sent
+WS_SERVER_CONTROL_URL = 'http://localhost:8010/control'
+# How often the control message is refreshed when it does not arrive with a push (seconds)
+CONTROL_REFRESH_INTERVAL = 1.0
+# Keep publishing frames with detections while nobody watches, so /fire_status, /last_image
+# and the relay's history still show the alarm
+PUBLISH_DETECTIONS_WHEN_IDLE = os.environ.get("PUBLISH_DETECTIONS_WHEN_IDLE", "1") == "1"
+
+# Multi-source mode (inference_multi): comma separated camera indexes, files or stream URLs,
+# e.g. "0,1,rtsp://cam3/stream", and the relay channel of each (defaults to cam0, cam1, ...)
+VIDEO_SOURCES = os.environ.get("VIDEO_SOURCES", "")
+CAMERA_IDS = os.environ.get("CAMERA_IDS", "")
+# Longest the batcher waits for the other sources once the first frame of a batch is ready (seconds)
+BATCH_MAX_WAIT = float(os.environ.get("BATCH_MAX_WAIT", 0.02))
+
+# Motion gate (optional): skip inference on frames that barely differ from the last inferred one
+MOTION_GATE = os.environ.get("MOTION_GATE", "0") == "1"
+MOTION_THRESHOLD = float(os.environ.get("MOTION_THRESHOLD", 0.01))  # share of pixels that must change
+MOTION_PIXEL_DELTA = int(os.environ.get("MOTION_PIXEL_DELTA", 25))  # grey-level difference that counts as a change
+MOTION_FORCE_INTERVAL = float(os.environ.get("MOTION_FORCE_INTERVAL", 2.0))  # seconds between forced inferences
+
+# Adaptive operating point (optional): input size, frame skip and target fps follow the measured
+# inference latency to stay within ADAPTIVE_LATENCY_SLO (see AdaptiveController)
+ADAPTIVE = os.environ.get("ADAPTIVE", "0") == "1"
+ADAPTIVE_LATENCY_SLO = float(os.environ.get("ADAPTIVE_LATENCY_SLO", 0.15))  # seconds per inferred frame (or batch)
+ADAPTIVE_IMGSZ = os.environ.get("ADAPTIVE_IMGSZ", "192,256,320,416,512,640")  # input sizes the controller may pick
+ADAPTIVE_MAX_SKIP = int(os.environ.get("ADAPTIVE_MAX_SKIP", 3))  # most frames dropped between two inferred ones
+ADAPTIVE_MIN_FPS = float(os.environ.get("ADAPTIVE_MIN_FPS", 2))  # lowest target fps
+ADAPTIVE_INTERVAL = float(os.environ.get("ADAPTIVE_INTERVAL", 2.0))  # seconds between adjustments
+
+# Interval (seconds) between pipeline stats log lines
+STATS_LOG_INTERVAL = 5.0
+
+
+class LatestFrameQueue:
+    """Bounded hand-off queue between pipeline stages; when full the oldest item is dropped (latest frame wins)."""
+
+    def __init__(self, maxsize=1, ready=None):
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        # Optional threading.Event shared by several queues, set on every put (see inference_multi)
+        self._ready = ready
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+        if self._ready is not None:
+            self._ready.set()
+
+    def get(self, timeout=None):
+        """Returns the next item, or None on timeout or once the queue is closed and drained."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._items or self._closed, timeout)
+            if not self._items:
+                return None
+            return self._items.popleft()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._ready is not None:
+            self._ready.set()
+
+    @property
+    def closed(self):
+        return self._closed and not self._items
+
+    def qsize(self):
+        return len(self._items)
+
+
+class StageStats:
+    """Frame counter and FPS meter for one pipeline stage."""
+
+    def __init__(self, name, queue=None):
+        self.name = name
+        self.queue = queue  # input queue of the stage, reported as queue depth
+        self.frames = 0
+        self.fps = 0.0
+        self.last_latency = 0.0
+        self._window_start = time.time()
+        self._window_frames = 0
+
+    def tick(self, latency=None):
+        self.frames += 1
+        self._window_frames += 1
+        if latency is not None:
+            self.last_latency = latency
+        now = time.time()
+        elapsed = now - self._window_start
+        if elapsed >= 1.0:
+            self.fps = self._window_frames / elapsed
+            self._window_start = now
+            self._window_frames = 0
+
+    def snapshot(self):
+        stats = {
+            "frames": self.frames,
+            "fps": round(self.fps, 2),
+            "latency_ms": round(self.last_latency * 1000, 1),
+        }
+        if self.queue is not None:
+            stats["queue_depth"] = self.queue.qsize()
+            stats["dropped"] = self.queue.dropped
+        return stats
+
+
+def pipeline_snapshot(stages):
+    """Per-stage FPS / queue depth of the running pipeline as a dict."""
+    return {stage.name: stage.snapshot() for stage in stages}
+
+
+class MotionGate:
+    """
+    Cheap change detector in front of the model: compares a small blurred grayscale copy of
+    each frame with the last frame that was inferred and lets the frame through only when
+    enough pixels changed. Slow drift accumulates against that reference, and a forced
+    inference every force_interval seconds is the safety net.
+    """
+
+    def __init__(self, threshold=MOTION_THRESHOLD, pixel_delta=MOTION_PIXEL_DELTA, force_interval=MOTION_FORCE_INTERVAL, size=(64, 48)):
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.force_interval = force_interval
+        self.size = size
+        self.reference = None
+        self.last_inferred = 0.0
+        self.last_change = None
+        self.checked = 0
+        self.skipped = 0
+        self.forced = 0
+
+    def should_infer(self, frame):
+        self.checked += 1
+        small = cv2.GaussianBlur(cv2.cvtColor(cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        now = time.time()
+        if self.reference is not None:
+            self.last_change = np.count_nonzero(cv2.absdiff(small, self.reference) > self.pixel_delta) / small.size
+            if self.last_change < self.threshold:
+                if now - self.last_inferred < self.force_interval:
+                    self.skipped += 1
+                    return False
+                self.forced += 1
+        self.reference = small
+        self.last_inferred = now
+        return True
+
+    def snapshot(self):
+        return {
+            "checked": self.checked,
+            "skipped": self.skipped,
+            "forced": self.forced,
+            "skip_ratio": round(self.skipped / self.checked, 3) if self.checked else 0.0,
+            "last_change": round(self.last_change, 4) if self.last_change is not None else None,
+        }
+
+
+class AdaptiveController:
+    """
+    Closed loop over the inference latency. Every interval seconds the median latency of the
+    frames inferred at the current input size is compared with the SLO: above it the
+    controller steps the input size down, then raises the frame skip, then lowers the target
+    fps; below headroom * SLO it undoes those steps in reverse order (fps, skip, input size).
+    One step per interval, so the effect of a change is measured before the next one.
+    """
+
+    def __init__(self, imgsz=320, max_fps=30, slo=ADAPTIVE_LATENCY_SLO, sizes=ADAPTIVE_IMGSZ, max_skip=ADAPTIVE_MAX_SKIP,
+                 min_fps=ADAPTIVE_MIN_FPS, interval=ADAPTIVE_INTERVAL, headroom=0.6):
+        if isinstance(sizes, str):
+            sizes = [int(size) for size in sizes.split(",") if size.strip()]
+        self.sizes = sorted(set(sizes) | {imgsz})
+        self.slo = slo
+        self.max_skip = max_skip
+        self.max_fps = max_fps
+        self.min_fps = min(min_fps, max_fps)
+        self.interval = interval
+        self.headroom = headroom
+        self.imgsz = imgsz
+        self.skip = 0
+        self.fps = max_fps
+        self.latency = None  # median of the last window
+        self.adjustments = 0
+        self.skipped = 0
+        self._samples = []
+        self._since_inferred = 0
+        self._window_start = time.time()
+
+    @property
+    def min_frame_time(self):
+        return 1.0 / self.fps
+
+    def should_infer(self):
+        """False for the frames dropped by the current frame skip."""
+        if self._since_inferred < self.skip:
+            self._since_inferred += 1
+            self.skipped += 1
+            return False
+        self._since_inferred = 0
+        return True
+
+    def record(self, latency):
+        """Latency of one inference at self.imgsz; adjusts the operating point once a window is complete."""
+        self._samples.append(latency)
+        now = time.time()
+        if now - self._window_start < self.interval or len(self._samples) < 3:
+            return
+        self.latency = float(np.median(self._samples))
+        self._samples = []
+        self._window_start = now
+        index = self.sizes.index(self.imgsz)
+        if self.latency > self.slo:
+            if index > 0:
+                self.imgsz = self.sizes[index - 1]
+            elif self.skip < self.max_skip:
+                self.skip += 1
+            elif self.fps > self.min_fps:
+                self.fps = max(self.min_fps, self.fps * 0.75)
+            else:
+                return
+        elif self.latency < self.slo * self.headroom:
+            if self.fps < self.max_fps:
+                self.fps = min(self.max_fps, self.fps * 1.25)
+            elif self.skip > 0:
+                self.skip -= 1
+            elif index < len(self.sizes) - 1:
+                self.imgsz = self.sizes[index + 1]
+            else:
+                return
+        else:
+            return
+        self.adjustments += 1
+        logger.info(f"Adaptive controller: median latency {self.latency * 1000:.0f} ms (SLO {self.slo * 1000:.0f} ms) -> {self.snapshot()}")
+
+    def operating_point(self):
+        """Current settings, sent with every detection message so the relay can report them."""
+        return {
+            "imgsz": self.imgsz,
+            "frame_skip": self.skip,
+            "target_fps": round(self.fps, 2),
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+        }
+
+    def snapshot(self):
+        return {
+            "imgsz": self.imgsz,
+            "frame_skip": self.skip,
+            "target_fps": round(self.fps, 2),
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "slo_ms": round(self.slo * 1000, 1),
+            "adjustments": self.adjustments,
+            "skipped": self.skipped,
+        }
+
+
+class PublishControl:
+    """
+    Producer side of the relay's backpressure: the latest control message (viewers, JPEG
+    quality, scale, max publish fps, preview on/off). Written by the publish thread and read
+    by the inference thread; each field is replaced atomically.
+    """
+
+    def __init__(self, max_fps=30):
+        self.preview = True  # until the relay says otherwise
+        self.viewers = None
+        self.congestion = 0.0
+        self.jpeg_quality = 80
+        self.scale = 1.0
+        self.max_fps = max_fps
+        self.limit_fps = max_fps
+        self.updated = 0.0
+        self.skipped = 0
+        self._last_publish = 0.0
+
+    def update(self, control):
+        if not control:
+            return
+        self.viewers = control.get("viewers", self.viewers)
+        self.congestion = control.get("congestion", self.congestion)
+        self.preview = control.get("preview", self.preview)
+        self.jpeg_quality = control.get("jpeg_quality", self.jpeg_quality)
+        self.scale = control.get("scale", self.scale)
+        self.max_fps = min(control.get("max_fps", self.limit_fps), self.limit_fps)
+        self.updated = time.time()
+
+    def stale(self):
+        return time.time() - self.updated >= CONTROL_REFRESH_INTERVAL
+
+    def should_publish(self, detections):
+        """Whether the inference thread should annotate and hand this frame to the publisher."""
+        now = time.time()
+        wanted = self.preview or (PUBLISH_DETECTIONS_WHEN_IDLE and detections > 0)
+        if not wanted or now - self._last_publish < 1.0 / self.max_fps:
+            self.skipped += 1
+            return False
+        self._last_publish = now
+        return True
+
+    def snapshot(self):
+        return {
+            "preview": self.preview,
+            "viewers": self.viewers,
+            "jpeg_quality": self.jpeg_quality,
+            "scale": self.scale,
+            "max_fps": self.max_fps,
+            "skipped": self.skipped,
+        }
+
+
+def capture_loop(cap, frame_queue, stats, stop_event):
+    """Capture stage: reads the camera as fast as it delivers so its buffer never holds stale frames."""
+    seq = 0
+    while not stop_event.is_set() and cap.isOpened():
+        success, frame = cap.read()
+        if not success:
+            print("Failed to read frame or end of video")
+            break
+        seq += 1
+        frame_queue.put((seq, time.time(), frame))
+        stats.tick()
+    stop_event.set()
+    frame_queue.close()
+
+
+def publish_loop(publish_queue, stats, stop_event, control, camera_id="default", transport=FRAME_TRANSPORT):
+    """
+    Publish stage: encodes annotated frames with the relay's suggested quality and scale and
+    pushes them to ws_server.py, either into the shared-memory store (same host) or over one
+    keep-alive HTTP session. The relay's control message comes back with every HTTP push,
+    is read from the shared store, or is polled while no frames are sent.
+    """
+    session = requests.Session()
+    session.headers["Content-Type"] = FRAME_CONTENT_TYPE
+    store = ringer = None
+    if transport == "shm":
+        store = SharedFrameStore(camera_id)
+        ringer = DoorbellRinger()
+        logger.info(f"Publishing frames through shared memory segment {store.name}")
+    while not stop_event.is_set():
+        if control.stale():
+            refresh_control(control, session, camera_id, store)
+        item = publish_queue.get(timeout=min(0.5, CONTROL_REFRESH_INTERVAL))
+        if item is None:
+            continue
+        seq, capture_time, annotated_frame, detections = item
+
+        # ارسال تصویر پردازش‌شده به ws_server.py (بدون base64 و JSON)
+        try:
+            if control.scale < 1.0:
+                annotated_frame = cv2.resize(annotated_frame, None, fx=control.scale, fy=control.scale, interpolation=cv2.INTER_AREA)
+            _, buffer = cv2.imencode('.jpg', annotated_frame, [int(cv2.IMWRITE_JPEG_QUALITY), control.jpeg_quality])
+            # Same host: the JPEG is copied once into the ring and the relay workers are woken up.
+            # Fall back to HTTP while no relay listens or the frame does not fit a slot.
+            if store is not None and ringer.targets():
+                if store.write(buffer, detections, capture_time, time.time(), seq) is not None:
+                    ringer.ring(camera_id)
+                    stats.tick(time.time() - capture_time)
+                    continue
+            response = session.post(WS_SERVER_FRAME_URL, data=pack_frame(camera_id, seq, capture_time, buffer, detections), timeout=0.5)
+            if response.status_code != 200:
+                logger.error(f"Failed to send image via POST: {response.status_code} - {response.text}")
+            else:
+                control.update(response.json().get("control"))
+                logger.debug("Image sent to ws_server via POST.")
+        except requests.exceptions.Timeout:
+            logger.warning("Timeout sending image to ws_server (skip frame)")
+        except requests.exceptions.ConnectionError as e:
+            logger.error(f"Connection error sending image via POST: {e}. Is ws_server.py running?")
+        except Exception as e:
+            logger.error(f"HTTP POST error sending image: {e}")
+
+        stats.tick(time.time() - capture_time)
+    session.close()
+    if store is not None:
+        ringer.close()
+        store.close()
+
+
+def downgraded_imgsz(imgsz):
+    """Input size for frames the prefilter found no fire-like content in (prefilter_mode "downgrade")."""
+    return max(160, imgsz // 2 // 32 * 32)
+
+
+def empty_result(model, frame):
+    """A detection-free Results for a frame the prefilter ruled out, so the rest of the pipeline runs unchanged."""
+    import torch
+    from ultralytics.engine.results import Results
+
+    return Results(frame, path="", names=model.names, boxes=torch.zeros((0, 6)))
+
+
+def detection_message(result, seq, capture_time, operating_point=None):
+    """
+    Boxes (xyxy pixels), classes, confidences and track ids of one result, as sent to
+    /push_detections, plus the AdaptiveController operating point when there is one.
+    """
+    detections = []
+    boxes = result.boxes
+    if boxes is not None and len(boxes):
+        class_ids = boxes.cls.int().cpu().tolist()
+        track_ids = boxes.id.int().cpu().tolist() if boxes.id is not None else [None] * len(class_ids)
+        for box, cls_id, confidence, track_id in zip(boxes.xyxy.cpu().tolist(), class_ids, boxes.conf.cpu().tolist(), track_ids):
+            detections.append({
+                "box": [round(v, 1) for v in box],
+                "class_id": cls_id,
+                "class": result.names[cls_id],
+                "confidence": round(confidence, 3),
+                "track_id": track_id,
+            })
+    height, width = result.orig_shape
+    message = {"seq": seq, "capture_time": capture_time, "width": width, "height": height, "detections": detections}
+    if operating_point is not None:
+        message["operating_point"] = operating_point
+    return message
+
+
+def republish(seq, capture_time, frame, last_result, video, control, publish_queue, annotate=False):
+    """
+    Hands a frame that skipped the model (motion gate or adaptive frame skip) to the publisher,
+    with the boxes of the last inferred frame drawn on it when the video is annotated, so
+    skipping inference does not lower the preview frame rate. With annotate (the frame is also
+    shown or saved) the annotated frame is returned.
+    """
+    detections = len(last_result.boxes) if last_result is not None and last_result.boxes is not None else 0
+    publish = video != "none" and control.should_publish(detections)
+    annotated_frame = None
+    if (publish and video == "annotated") or annotate:
+        annotated_frame = last_result.plot(img=frame) if last_result is not None else frame
+    if publish:
+        publish_queue.put((seq, capture_time, annotated_frame if video == "annotated" else frame, detections))
+    return annotated_frame
+
+
+def detections_loop(detections_queue, stats, stop_event, camera_id="default"):
+    """Detection stage: posts one small JSON message per processed frame, independent of the video."""
+    session = requests.Session()
+    url = f"{WS_SERVER_DETECTIONS_URL}/{camera_id}"
+    while not stop_event.is_set():
+        message = detections_queue.get(timeout=0.5)
+        if message is None:
+            continue
+        try:
+            response = session.post(url, json=message, timeout=0.5)
+            if response.status_code != 200:
+                logger.error(f"Failed to send detections: {response.status_code} - {response.text}")
+        except requests.exceptions.RequestException as e:
+            logger.debug(f"Error sending detections: {e}")
+        stats.tick(time.time() - message["capture_time"])
+    session.close()
+
+
+def refresh_control(control, session, camera_id, store=None):
+    """Fetches the relay's control message from the shared store or GET /control."""
+    if store is not None:
+        viewers, congestion, workers = store.read_control()
+        if workers:
+            control.update(producer_control(viewers, congestion))
+            return
+    try:
+        response = session.get(f"{WS_SERVER_CONTROL_URL}/{camera_id}", timeout=0.5)
+        if response.status_code == 200:
+            control.update(response.json())
+            return
+        if response.status_code == 404:
+            # The relay does not know this camera (e.g. it restarted); the next push registers it
+            control.preview = True
+    except requests.exceptions.RequestException as e:
+        logger.debug(f"Could not fetch relay control: {e}")
+    control.updated = time.time()  # relay unreachable: keep the current settings, retry later
+
 
 def inference(
     model,
@@ -26,7 +519,33 @@ def inference(
     show_tracks=False,
     imgsz=320,  # Image size 320x320
     max_fps=30,  # Maximum FPS
+    camera_id="default",  # Channel id sent in the frame header
+    video=PUBLISH_VIDEO,  # "annotated", "raw" or "none"
+    publish_detections=PUBLISH_DETECTIONS,  # detection metadata to /push_detections
+    motion_gate=MOTION_GATE,  # skip inference on unchanged frames (see MotionGate)
+    prefilter_mode=PREFILTER_MODE,  # "off", "skip" or "downgrade" frames without fire colours (see fire_prefilter)
+    adaptive=ADAPTIVE,  # imgsz, frame skip and fps follow ADAPTIVE_LATENCY_SLO (see AdaptiveController)
+    cascade=CASCADE,  # coarse pass at imgsz, fine pass on crops around weak candidates (see cascade.py)
 ):
+    """
+    Runs detection as a three stage pipeline: a capture thread, the inference worker
+    (this thread, which also owns the preview window and video writer) and a publisher
+    thread. Stages are joined by single-slot LatestFrameQueue hand-offs, so a slow
+    inference or a slow POST drops frames instead of queueing them up. The relay's control
+    message (PublishControl) sets the publish rate, JPEG quality and scale, and stops preview
+    frames while nobody is watching. Detection metadata goes out on its own thread and queue,
+    so alerting keeps working whatever happens to the video. With motion_gate, frames that
+    did not change since the last inferred one skip the model; they are still published, with
+    the last inferred boxes drawn on them when the video is annotated.
+    With a prefilter_mode, frames without fire-like colours skip the model (published with no
+    detections) or run at a smaller input size. With adaptive, imgsz and max_fps are the
+    starting point of an AdaptiveController that trades input size, frame skip and fps for
+    the inference latency SLO. With cascade, imgsz is the coarse pass and low-confidence
+    candidates are re-checked on high-resolution crops (tracking then uses a standalone tracker).
+    """
+    if cascade and task not in ("detect", "track"):
+        raise ValueError("Invalid task. Use 'detect' or 'track'.")
+
     # Initialize video capture based on mode
     if mode == "cam":
         cap = cv2.VideoCapture(0)
@@ -53,136 +572,479 @@ def inference(
     input_fps = cap.get(cv2.CAP_PROP_FPS) or 30  # Default to 30 FPS if not specified
     out = None
 
+    def show_and_save(annotated_frame):
+        """Writes a frame to the output video and the preview window; False once 'q' was pressed."""
+        nonlocal out
+        if save_output:
+            if out is None:
+                height, width = annotated_frame.shape[:2]
+                out = cv2.VideoWriter(output_path, fourcc, min(input_fps, max_fps), (width, height))
+            out.write(annotated_frame)
+        if show_output:
+            cv2.imshow("Fire Inference", annotated_frame)
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                return False
+        return True
+
     # Minimum frame time for desired FPS
     min_frame_time = 1.0 / max_fps
 
-    while cap.isOpened():
-        frame_start_time = time.time()  # Start time for the frame
+    # Pipeline stages
+    frame_queue = LatestFrameQueue(maxsize=1)
+    publish_queue = LatestFrameQueue(maxsize=1)
+    detections_queue = LatestFrameQueue(maxsize=8)
+    capture_stats = StageStats("capture")
+    inference_stats = StageStats("inference", frame_queue)
+    publish_stats = StageStats("publish", publish_queue)
+    detections_stats = StageStats("detections", detections_queue)
+    stages = [capture_stats, inference_stats, publish_stats, detections_stats]
+    stop_event = threading.Event()
+    control = PublishControl(max_fps)
+    gate = MotionGate() if motion_gate else None
+    prefilter = FirePrefilter() if prefilter_mode != "off" else None
+    controller = AdaptiveController(imgsz, max_fps) if adaptive else None
+    cascade_detector = CascadeDetector(model) if cascade else None
+    tracker = make_tracker(frame_rate=input_fps) if cascade and task == "track" else None
+    last_result = None  # redrawn on the frames that skip the model (motion gate, adaptive frame skip)
 
-        success, frame = cap.read()
-        if not success:
-            print("Failed to read frame or end of video")
-            break
+    capture_thread = threading.Thread(target=capture_loop, args=(cap, frame_queue, capture_stats, stop_event), name="capture", daemon=True)
+    publish_thread = threading.Thread(target=publish_loop, args=(publish_queue, publish_stats, stop_event, control, camera_id), name="publish", daemon=True)
+    detections_thread = threading.Thread(target=detections_loop, args=(detections_queue, detections_stats, stop_event, camera_id), name="detections", daemon=True)
+    capture_thread.start()
+    publish_thread.start()
+    if publish_detections:
+        detections_thread.start()
+    last_stats_log = time.time()
 
-        # Resize the webcam frame to 320x320 before processing
-        # frame = cv2.resize(frame, (320, 320))
+    try:
+        while not stop_event.is_set():
+            frame_start_time = time.time()  # Start time for the frame
 
-        start_time = time.time()
-        class_counts = defaultdict(int)
+            item = frame_queue.get(timeout=1.0)
+            if item is None:
+                continue
+            seq, capture_time, frame = item
 
-        # Perform inference
-        try:
-            if task == "track":
-                results = model.track(frame, conf=0.3, persist=True, tracker="bytetrack.yaml", imgsz=imgsz, device="cpu")
-            elif task == "detect":
-                results = model.predict(frame, conf=0.5, imgsz=imgsz, device="cpu")
-            else:
-                raise ValueError("Invalid task. Use 'detect' or 'track'.")
-        except Exception as e:
-            print(f"Inference failed with error: {e}")
-            break
+            if (controller is not None and not controller.should_infer()) or (gate is not None and not gate.should_infer(frame)):
+                annotated_frame = republish(seq, capture_time, frame, last_result, video, control, publish_queue, save_output or show_output)
+                # The saved video and the window keep every frame, not only the inferred ones
+                if (save_output or show_output) and not show_and_save(annotated_frame):
+                    break
+                continue
 
-        end_time = time.time()
-        annotated_frame = results[0].plot()
+            # Resize the webcam frame to 320x320 before processing
+            # frame = cv2.resize(frame, (320, 320))
 
-        # Process results
-        if results[0].boxes and results[0].boxes.cls is not None:
-            boxes = results[0].boxes.xywh.cpu()
-            class_ids = results[0].boxes.cls.int().cpu().tolist()
-            names = results[0].names
+            start_time = time.time()
+            class_counts = defaultdict(int)
 
-            if task == "track" and results[0].boxes.id is not None:
-                track_ids = results[0].boxes.id.int().cpu().tolist()
+            # Colour prefilter: no fire-like content means no model call, or a cheaper one
+            full_imgsz = controller.imgsz if controller is not None else imgsz
+            run_imgsz = full_imgsz
+            fire_like = prefilter is None or prefilter.analyse(frame)["fire_like"]
+            if not fire_like and prefilter_mode == "downgrade":
+                run_imgsz = downgraded_imgsz(full_imgsz)
 
-                for box, cls_id, track_id in zip(boxes, class_ids, track_ids):
-                    x, y, w, h = box
-                    class_name = names[cls_id]
+            # Perform inference
+            model_start = time.time()  # the controller sees the model call only, not the prefilter
+            try:
+                if not fire_like and prefilter_mode == "skip":
+                    results = [empty_result(model, frame)]
+                elif cascade_detector is not None:
+                    results = cascade_detector.detect([frame], 0.3 if task == "track" else 0.5, run_imgsz)
+                    if tracker is not None:
+                        results = [apply_tracker(tracker, results[0])]
+                elif task == "track":
+                    results = model.track(frame, conf=0.3, persist=True, tracker="bytetrack.yaml", imgsz=run_imgsz, device="cpu")
+                elif task == "detect":
+                    results = model.predict(frame, conf=0.5, imgsz=run_imgsz, device="cpu")
+                else:
+                    raise ValueError("Invalid task. Use 'detect' or 'track'.")
+            except Exception as e:
+                print(f"Inference failed with error: {e}")
+                break
 
-                    if count:
-                        seen_ids_per_class[class_name].add(track_id)
+            end_time = time.time()
+            if controller is not None and fire_like:
+                controller.record(end_time - model_start)
+            last_result = results[0]
+            detections = len(results[0].boxes) if results[0].boxes is not None else 0
+            if publish_detections:
+                operating_point = controller.operating_point() if controller is not None else None
+                detections_queue.put(detection_message(results[0], seq, capture_time, operating_point))
+            # Annotate only when the frame is shown, saved or published annotated to someone watching
+            publish = video != "none" and control.should_publish(detections)
+            annotate = (publish and video == "annotated") or save_output or show_output
+            annotated_frame = results[0].plot() if annotate else None
 
-                    if show_tracks:
-                        track = track_history[track_id]
-                        track.append((float(x), float(y)))
-                        if len(track) > 30:
-                            track.pop(0)
-                        points = np.hstack(track).astype(np.int32).reshape((-1, 1, 2))
-                        cv2.polylines(annotated_frame, [points], isClosed=False, color=(230, 230, 230), thickness=10)
+            # Process results
+            if results[0].boxes and results[0].boxes.cls is not None:
+                boxes = results[0].boxes.xywh.cpu()
+                class_ids = results[0].boxes.cls.int().cpu().tolist()
+                names = results[0].names
 
-            elif task == "detect" and count:
-                for cls_id in class_ids:
-                    class_counts[names[cls_id]] += 1
+                if task == "track" and results[0].boxes.id is not None:
+                    track_ids = results[0].boxes.id.int().cpu().tolist()
 
-        # ارسال تصویر پردازش‌شده به ws_server.py از طریق POST (بدون تاخیر)
-        try:
-            _, buffer = cv2.imencode('.jpg', annotated_frame, [int(cv2.IMWRITE_JPEG_QUALITY), 80])  # کیفیت مناسب برای سرعت
-            jpg_as_text = base64.b64encode(buffer).decode('utf-8')
-            response = requests.post(WS_SERVER_URL, json={"image_b64": jpg_as_text}, timeout=0.5)
-            if response.status_code != 200:
-                logger.error(f"Failed to send image via POST: {response.status_code} - {response.text}")
-            else:
-                logger.debug("Image sent to ws_server via POST.")
-        except requests.exceptions.Timeout:
-            logger.warning("Timeout sending image to ws_server (skip frame)")
-        except requests.exceptions.ConnectionError as e:
-            logger.error(f"Connection error sending image via POST: {e}. Is ws_server.py running?")
-        except Exception as e:
-            logger.error(f"HTTP POST error sending image: {e}")
+                    for box, cls_id, track_id in zip(boxes, class_ids, track_ids):
+                        x, y, w, h = box
+                        class_name = names[cls_id]
 
-        # Commenting out class count display as it's not needed
-        # if count:
-        #     x0, y0 = 10, annotated_frame.shape[0] - 80
-        #     if task == "track":
-        #         for i, (cls_name, ids) in enumerate(seen_ids_per_class.items()):
-        #             label = f"{cls_name}: {len(ids)}"
-        #             y = y0 + i * 25
-        #             cv2.putText(annotated_frame, label, (x0, y), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
-        #     elif task == "detect":
-        #         for i, (cls_name, total) in enumerate(class_counts.items()):
-        #             label = f"{cls_name}: {total}"
-        #             y = y0 + i * 25
-        #             cv2.putText(annotated_frame, label, (x0, y), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
-
-        # Calculate and display FPS
-        processing_time = end_time - start_time
-        fps = 1 / processing_time if processing_time > 0 else float('inf')
-        cv2.putText(annotated_frame, f"FPS: {min(fps, max_fps):.2f}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-
-        # Save output video
-        if save_output:
-            if out is None:
-                height, width = annotated_frame.shape[:2]
-                out = cv2.VideoWriter(output_path, fourcc, min(input_fps, max_fps), (width, height))
-            out.write(annotated_frame)
+                        if count:
+                            seen_ids_per_class[class_name].add(track_id)
 
-        # Show output in a window
-        if show_output:
-            cv2.imshow("Fire Inference", annotated_frame)
-            if cv2.waitKey(1) & 0xFF == ord("q"):
+                        if show_tracks:
+                            track = track_history[track_id]
+                            track.append((float(x), float(y)))
+                            if len(track) > 30:
+                                track.pop(0)
+                            points = np.hstack(track).astype(np.int32).reshape((-1, 1, 2))
+                            if annotated_frame is not None:
+                                cv2.polylines(annotated_frame, [points], isClosed=False, color=(230, 230, 230), thickness=10)
+
+                elif task == "detect" and count:
+                    for cls_id in class_ids:
+                        class_counts[names[cls_id]] += 1
+
+            # Commenting out class count display as it's not needed
+            # if count:
+            #     x0, y0 = 10, annotated_frame.shape[0] - 80
+            #     if task == "track":
+            #         for i, (cls_name, ids) in enumerate(seen_ids_per_class.items()):
+            #             label = f"{cls_name}: {len(ids)}"
+            #             y = y0 + i * 25
+            #             cv2.putText(annotated_frame, label, (x0, y), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+            #     elif task == "detect":
+            #         for i, (cls_name, total) in enumerate(class_counts.items()):
+            #             label = f"{cls_name}: {total}"
+            #             y = y0 + i * 25
+            #             cv2.putText(annotated_frame, label, (x0, y), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+
+            # Calculate and display FPS
+            processing_time = end_time - start_time
+            fps = 1 / processing_time if processing_time > 0 else float('inf')
+            if annotated_frame is not None:
+                cv2.putText(annotated_frame, f"FPS: {min(fps, max_fps):.2f}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+
+            # Hand the frame to the publisher; it is not modified after this point
+            if publish:
+                publish_queue.put((seq, capture_time, annotated_frame if video == "annotated" else frame, detections))
+            inference_stats.tick(processing_time)
+
+            # Save output video and show it in a window
+            if (save_output or show_output) and not show_and_save(annotated_frame):
                 break
 
-        # Frame rate control
-        elapsed_time = time.time() - frame_start_time
-        if elapsed_time < min_frame_time:
-            time.sleep(min_frame_time - elapsed_time)
+            if time.time() - last_stats_log >= STATS_LOG_INTERVAL:
+                logger.info(f"Pipeline stats: {pipeline_snapshot(stages)} control={control.snapshot()}"
+                            + (f" motion_gate={gate.snapshot()}" if gate is not None else "")
+                            + (f" prefilter={prefilter.snapshot()}" if prefilter is not None else "")
+                            + (f" adaptive={controller.snapshot()}" if controller is not None else "")
+                            + (f" cascade={cascade_detector.snapshot()}" if cascade_detector is not None else ""))
+                last_stats_log = time.time()
 
-    # Release resources
-    cap.release()
-    if out is not None:
-        out.release()
-    cv2.destroyAllWindows()
+            # Frame rate control
+            if controller is not None:
+                min_frame_time = controller.min_frame_time
+            elapsed_time = time.time() - frame_start_time
+            if elapsed_time < min_frame_time:
+                time.sleep(min_frame_time - elapsed_time)
+    finally:
+        stop_event.set()
+        frame_queue.close()
+        publish_queue.close()
+        detections_queue.close()
+        capture_thread.join(timeout=2.0)
+        publish_thread.join(timeout=2.0)
+        if publish_detections:
+            detections_thread.join(timeout=2.0)
 
-# Example usage
-model = YOLO("./runs/detect/best.pt", task="track")
+        # Release resources
+        cap.release()
+        if out is not None:
+            out.release()
+        cv2.destroyAllWindows()
 
-inference(
+
+def open_source(source):
+    """cv2.VideoCapture for a camera index ("0") or a file / stream URL."""
+    source = str(source).strip()
+    return cv2.VideoCapture(int(source) if source.isdigit() else source)
+
+
+def make_tracker(tracker="bytetrack.yaml", frame_rate=30):
+    """A standalone tracker (BYTETrack, BoT-SORT, ... per the yaml), so every source keeps its own track ids."""
+    # Imported here: only the multi-source and cascade modes drive trackers directly
+    import inspect
+    from ultralytics.trackers.track import TRACKER_MAP
+    from ultralytics.utils import IterableSimpleNamespace
+    from ultralytics.utils.checks import check_yaml
+    try:
+        from ultralytics.utils import YAML
+        load_yaml = YAML.load
+    except ImportError:  # older ultralytics releases
+        from ultralytics.utils import yaml_load as load_yaml
+
+    cfg = IterableSimpleNamespace(**load_yaml(check_yaml(tracker)))
+    tracker_class = TRACKER_MAP[cfg.tracker_type]
+    if "frame_rate" in inspect.signature(tracker_class.__init__).parameters:
+        return tracker_class(args=cfg, frame_rate=frame_rate)
+    # Newer trackers take no frame rate and count track_buffer in frames; scale it as the older ones did
+    cfg.track_buffer = int(frame_rate / 30.0 * cfg.track_buffer)
+    return tracker_class(args=cfg)
+
+
+def apply_tracker(tracker, result):
+    """Updates one source's tracker with a predict result and returns the result with track ids (as model.track() does)."""
+    import torch
+
+    tracks = tracker.update(result.boxes.cpu().numpy(), result.orig_img)
+    if len(tracks) == 0:
+        return result
+    result = result[tracks[:, -1].astype(int)]
+    result.update(boxes=torch.as_tensor(tracks[:, :-1]))
+    return result
+
+
+class Source:
+    """One input of inference_multi: capture thread, tracker, publisher and detection threads, and relay channel."""
+
+    def __init__(self, source, camera_id, ready, task, max_fps, publish_detections, motion_gate=False, prefilter_mode="off"):
+        self.source = source
+        self.camera_id = camera_id
+        self.cap = open_source(source)
+        self.stop_event = threading.Event()
+        self.frame_queue = LatestFrameQueue(maxsize=1, ready=ready)
+        self.publish_queue = LatestFrameQueue(maxsize=1)
+        self.detections_queue = LatestFrameQueue(maxsize=8)
+        self.control = PublishControl(max_fps)
+        self.gate = MotionGate() if motion_gate else None
+        self.prefilter = FirePrefilter() if prefilter_mode != "off" else None
+        self.tracker = make_tracker(frame_rate=self.cap.get(cv2.CAP_PROP_FPS) or 30) if task == "track" else None
+        self.last_result = None
+        self.capture_stats = StageStats(f"{camera_id}/capture")
+        self.publish_stats = StageStats(f"{camera_id}/publish", self.publish_queue)
+        self.detections_stats = StageStats(f"{camera_id}/detections", self.detections_queue)
+        self.threads = [
+            threading.Thread(target=capture_loop, args=(self.cap, self.frame_queue, self.capture_stats, self.stop_event), name=f"capture-{camera_id}", daemon=True),
+            threading.Thread(target=publish_loop, args=(self.publish_queue, self.publish_stats, self.stop_event, self.control, camera_id), name=f"publish-{camera_id}", daemon=True),
+        ]
+        if publish_detections:
+            self.threads.append(threading.Thread(target=detections_loop, args=(self.detections_queue, self.detections_stats, self.stop_event, camera_id), name=f"detections-{camera_id}", daemon=True))
+
+    def stages(self):
+        return [self.capture_stats, self.publish_stats, self.detections_stats]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def handle_result(self, result, seq, capture_time, frame, video, publish_detections, show_output, operating_point=None):
+        """Routes one batched result back to this source's detection channel, publisher and window."""
+        self.last_result = result
+        detections = len(result.boxes) if result.boxes is not None else 0
+        if publish_detections:
+            self.detections_queue.put(detection_message(result, seq, capture_time, operating_point))
+        publish = video != "none" and self.control.should_publish(detections)
+        annotated_frame = result.plot() if (publish and video == "annotated") or show_output else None
+        if publish:
+            self.publish_queue.put((seq, capture_time, annotated_frame if video == "annotated" else frame, detections))
+        if show_output:
+            cv2.imshow(f"Fire Inference {self.camera_id}", annotated_frame)
+
+    def publish_skipped(self, seq, capture_time, frame, video, show_output):
+        """Publishes (and shows) a frame that skipped the model, with the last result's boxes when annotated."""
+        annotated_frame = republish(seq, capture_time, frame, self.last_result, video, self.control, self.publish_queue, show_output)
+        if show_output:
+            cv2.imshow(f"Fire Inference {self.camera_id}", annotated_frame)
+
+    def stop(self):
+        self.stop_event.set()
+        for queue in (self.frame_queue, self.publish_queue, self.detections_queue):
+            queue.close()
+        for thread in self.threads:
+            if thread.is_alive():
+                thread.join(timeout=2.0)
+        self.cap.release()
+
+
+def gather_batch(sources, ready, max_wait):
+    """Latest frame of every source that has one, waiting up to max_wait for the rest once the first is ready."""
+    batch = {}
+    ready.wait(1.0)
+    deadline = time.time() + max_wait
+    while True:
+        ready.clear()
+        for source in sources:
+            if source not in batch:
+                item = source.frame_queue.get(timeout=0)
+                if item is not None:
+                    batch[source] = item
+        remaining = deadline - time.time()
+        if len(batch) == len(sources) or remaining <= 0:
+            return list(batch.items())
+        ready.wait(remaining)
+
+
+def inference_multi(
     model,
-    mode="cam",
+    sources,
     task="track",
-    save_output=True,
-    show_output=True,
-    count=True,
-    show_tracks=False,
+    camera_ids=None,
+    show_output=False,
     imgsz=320,
-    max_fps=30,  # Maximum 30 FPS
-)
\ No newline at end of file
+    max_fps=30,
+    max_wait=BATCH_MAX_WAIT,
+    video=PUBLISH_VIDEO,
+    publish_detections=PUBLISH_DETECTIONS,
+    motion_gate=MOTION_GATE,
+    prefilter_mode=PREFILTER_MODE,
+    adaptive=ADAPTIVE,
+    cascade=CASCADE,
+):
+    """
+    Multi-source pipeline: a capture thread per source feeds one batched model.predict() over
+    the latest frame of every ready source (a batch closes max_wait seconds after its first
+    frame). Results are routed back per source: each has its own tracker, publisher,
+    detection stream, motion gate, prefilter and relay channel (camera_ids, default cam0, cam1, ...).
+    With adaptive, one AdaptiveController holds the batch latency (what every frame in it
+    waits for) to the SLO. With cascade, every group runs as a CascadeDetector batch (coarse
+    pass over the frames, one fine pass over all their candidate crops).
+    """
+    camera_ids = list(camera_ids or [f"cam{i}" for i in range(len(sources))])
+    if len(camera_ids) != len(sources):
+        raise ValueError("camera_ids must name every source")
+    if task not in ("detect", "track"):
+        raise ValueError("Invalid task. Use 'detect' or 'track'.")
+    ready = threading.Event()
+    all_sources = []
+    for source, camera_id in zip(sources, camera_ids):
+        src = Source(source, camera_id, ready, task, max_fps, publish_detections, motion_gate, prefilter_mode)
+        if not src.cap.isOpened():
+            logger.error(f"Could not open video source {source!r} ({camera_id})")
+            continue
+        src.start()
+        all_sources.append(src)
+    if not all_sources:
+        print("Error: Could not open any video source")
+        return
+
+    batch_stats = StageStats("batch")
+    batch_sizes = defaultdict(int)
+    min_frame_time = 1.0 / max_fps
+    conf = 0.3 if task == "track" else 0.5
+    controller = AdaptiveController(imgsz, max_fps) if adaptive else None
+    cascade_detector = CascadeDetector(model) if cascade else None
+    last_stats_log = time.time()
+    active = list(all_sources)
+
+    try:
+        while active:
+            loop_start = time.time()
+            batch = gather_batch(active, ready, max_wait)
+            active = [src for src in active if not src.frame_queue.closed]
+            # Frames dropped by the adaptive frame skip, and unchanged frames, leave the batch before
+            # the model but are still published
+            infer = controller is None or controller.should_infer()
+            changed = []
+            for src, item in batch:
+                if infer and (src.gate is None or src.gate.should_infer(item[2])):
+                    changed.append((src, item))
+                else:
+                    src.publish_skipped(*item, video, show_output)
+            batch = changed
+            if not batch:
+                if show_output and cv2.waitKey(1) & 0xFF == ord("q"):
+                    break
+                continue
+
+            # Prefilter: frames without fire-like content skip the model or join a smaller-input batch
+            full, reduced, skipped = [], [], []
+            for src, item in batch:
+                if src.prefilter is None or src.prefilter.analyse(item[2])["fire_like"]:
+                    full.append((src, item))
+                else:
+                    (skipped if prefilter_mode == "skip" else reduced).append((src, item))
+
+            full_imgsz = controller.imgsz if controller is not None else imgsz
+            start_time = time.time()
+            results = []
+            try:
+                for group, group_imgsz in ((full, full_imgsz), (reduced, downgraded_imgsz(full_imgsz))):
+                    if not group:
+                        continue
+                    frames = [item[2] for _, item in group]
+                    if cascade_detector is not None:
+                        results += cascade_detector.detect(frames, conf, group_imgsz)
+                    else:
+                        results += model.predict(frames, conf=conf, imgsz=group_imgsz, device="cpu", verbose=False)
+                    if controller is not None and group is full:
+                        controller.record(time.time() - start_time)
+            except Exception as e:
+                print(f"Inference failed with error: {e}")
+                break
+            results += [empty_result(model, item[2]) for _, item in skipped]
+            batch_stats.tick(time.time() - start_time)
+            batch_sizes[len(full) + len(reduced)] += 1
+
+            operating_point = controller.operating_point() if controller is not None else None
+            for (src, (seq, capture_time, frame)), result in zip(full + reduced + skipped, results):
+                if src.tracker is not None:
+                    result = apply_tracker(src.tracker, result)
+                src.handle_result(result, seq, capture_time, frame, video, publish_detections, show_output, operating_point)
+
+            if show_output and cv2.waitKey(1) & 0xFF == ord("q"):
+                break
+
+            if time.time() - last_stats_log >= STATS_LOG_INTERVAL:
+                stages = [batch_stats] + [stage for src in all_sources for stage in src.stages()]
+                gates = {src.camera_id: src.gate.snapshot() for src in all_sources if src.gate is not None}
+                prefilters = {src.camera_id: src.prefilter.snapshot() for src in all_sources if src.prefilter is not None}
+                logger.info(f"Pipeline stats: {pipeline_snapshot(stages)} batch_sizes={dict(sorted(batch_sizes.items()))}"
+                            + (f" motion_gate={gates}" if gates else "")
+                            + (f" prefilter={prefilters}" if prefilters else "")
+                            + (f" adaptive={controller.snapshot()}" if controller is not None else "")
+                            + (f" cascade={cascade_detector.snapshot()}" if cascade_detector is not None else ""))
+                last_stats_log = time.time()
+
+            # Frame rate control (per batch, i.e. per source)
+            if controller is not None:
+                min_frame_time = controller.min_frame_time
+            elapsed_time = time.time() - loop_start
+            if elapsed_time < min_frame_time:
+                time.sleep(min_frame_time - elapsed_time)
+    finally:
+        for src in all_sources:
+            src.stop()
+        cv2.destroyAllWindows()
+
+
+if __name__ == "__main__":
+    # Example usage
+    model = YOLO("./runs/detect/best.pt", task="track")
+
+    if VIDEO_SOURCES:
+        # Several cameras/files through one batched model, e.g. VIDEO_SOURCES=0,1 CAMERA_IDS=gate,yard
+        inference_multi(
+            model,
+            VIDEO_SOURCES.split(","),
+            task="track",
+            camera_ids=CAMERA_IDS.split(",") if CAMERA_IDS else None,
+            show_output=True,
+            imgsz=320,
+            max_fps=30,
+        )
+        raise SystemExit
+
+    inference(
+        model,
+        mode="cam",
+        task="track",
+        save_output=True,
+        show_output=True,
+        count=True,
+        show_tracks=False,
+        imgsz=320,
+        max_fps=30,  # Maximum 30 FPS
+        camera_id=os.environ.get("CAMERA_ID", "default"),
+    )
@@ -1,26 +1,61 @@
 # backend/api/processing.py
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context, send_from_directory, url_for
 import os
+import json
+import time
+import uuid
+import threading
 import cv2 # اضافه کردن ایمپورت OpenCV
 import numpy as np # اضافه کردن ایمپورت NumPy
 import base64 # اضافه کردن ایمپورت base64
 from werkzeug.utils import secure_filename
 from model_config import get_config, get_detection_order # اضافه کردن get_detection_order
-# from image_processing import process_fire_detection # استفاده از تابع پردازش موجود
-# from video_processing import process_video
-from model_config import yolo_models, model_lock
+from image_processing import process_fire_detection # استفاده از تابع پردازش موجود
+from video_jobs import VideoJobManager, JobQueueFull, FINISHED_STATES
+from model_config import yolo_models, get_model_pool
+from model_server import ModelClient
+from batching import MicroBatcher, MICROBATCH
+from fire_prefilter import FirePrefilter, PREFILTER_MODE
 import logging
 
 # تنظیم لاگر
 logger = logging.getLogger(__name__)
 
+# Sections of concurrent /image and /webcam_frame requests share batched model calls
+# (with a model server, the batching happens there)
+batcher = None
+batcher_lock = threading.Lock() # gthread workers call get_batcher() from several request threads
+
+
+# Colour prefilter in front of the models (PREFILTER_MODE=skip|downgrade); uploads and webcam
+# frames are scored as still images, so one instance serves every request thread
+prefilter = FirePrefilter() if PREFILTER_MODE != "off" else None
+
+
+def get_batcher():
+    """MicroBatcher over the local model pool; None when disabled or when the models live in model_server.py."""
+    global batcher
+    if batcher is None and MICROBATCH and not isinstance(get_model_pool(), ModelClient):
+        with batcher_lock:
+            if batcher is None: # a second instance would start worker threads of its own
+                batcher = MicroBatcher(get_model_pool())
+    return batcher
+
 # ایجاد Blueprint
 processing_bp = Blueprint('processing', __name__)
 
+# صف پردازش ویدیو در پس‌زمینه (فقط با اولین ویدیو thread می‌سازد)
+video_jobs = VideoJobManager(get_config()["RESULTS_FOLDER"])
+# Seconds between keep-alive comments on an idle progress stream
+JOB_EVENTS_HEARTBEAT = 15.0
+
 # --- Image Processing Routes ---
 @processing_bp.route('/image', methods=['POST'])
 def process_image():
     """API برای پردازش تصویر آپلود شده"""
+    too_large = check_image_length()
+    if too_large is not None:
+        return too_large
     if 'image' not in request.files:
         return jsonify({"error": "No image file provided"}), 400
     
@@ -48,17 +83,18 @@ def process_image():
     try:
         detection_order = get_detection_order()
         # پردازش تصویر با تابع موجود
-        # processed_image, results = process_fire_detection(image, detection_order, yolo_models, model_lock)
+        processed_image, results = process_fire_detection(image, detection_order, yolo_models, get_model_pool(),
+                                                          prefilter=prefilter, batcher=get_batcher())
         
         # انکود تصویر پردازش شده به base64
-        # _, buffer = cv2.imencode('.jpg', processed_image)
-        # jpg_as_text = base64.b64encode(buffer).decode('utf-8')
+        _, buffer = cv2.imencode('.jpg', processed_image)
+        jpg_as_text = base64.b64encode(buffer).decode('utf-8')
 
         return jsonify({
             "message": "Image processed successfully",
             "status": "success",
-            # "annotated_image": 'data:image/jpeg;base64,' + jpg_as_text,
-            # "detections": results # ارسال نتایج تشخیص
+            "annotated_image": 'data:image/jpeg;base64,' + jpg_as_text,
+            "detections": results # ارسال نتایج تشخیص
         }), 200
     except Exception as e:
         logger.exception(f"Error processing image: {e}")
@@ -81,27 +117,27 @@ def process_video_api():
     if not file.filename.lower().endswith(tuple(f'.{ext}' for ext in allowed_extensions if ext in ['mp4', 'mkv'])):
         return jsonify({"error": f"File type not allowed. Allowed types: {', '.join(['mp4', 'mkv'])}"}), 400
     
-    # ذخیره فایل
+    # ذخیره فایل (پیشوند یکتا تا آپلودهای هم‌نام روی هم نوشته نشوند)
     filename = secure_filename(file.filename)
     upload_folder = config["UPLOAD_FOLDER"]
     os.makedirs(upload_folder, exist_ok=True)
-    file_path = os.path.join(upload_folder, filename)
+    file_path = os.path.join(upload_folder, f"{uuid.uuid4().hex[:8]}_{filename}")
     file.save(file_path)
     
     try:
-        result_message, output_filename, status_code, results = process_video(file_path, config["RESULTS_FOLDER"])
-        
-        if status_code == 200:
-            # TODO: شاید بخواهید مسیر فایل خروجی را برگردانید یا کار دیگری انجام دهید
-            return jsonify({
-                "message": result_message,
-                "status": "success",
-                "output_filename": output_filename # نام فایل ویدئوی پردازش شده
-                # "detections": results # نتایج خام ممکن است خیلی بزرگ باشد
-            }), 200
-        else:
-            return jsonify({"error": result_message}), status_code
+        # پردازش در صف پس‌زمینه؛ پیشرفت از /jobs/<job_id> و /jobs/<job_id>/events
+        job = video_jobs.submit(file_path, filename)
+        return jsonify({
+            "message": "Video queued for processing",
+            "status": "queued",
+            "job_id": job.id,
+            "status_url": url_for('processing.video_job_status_api', job_id=job.id),
+            "events_url": url_for('processing.video_job_events_api', job_id=job.id),
+        }), 202
 
+    except JobQueueFull as e:
+        os.remove(file_path)
+        return jsonify({"error": f"Too many videos in progress, try again later ({e})"}), 503
     except Exception as e:
         logger.exception(f"Error processing video: {e}")
         # پاک کردن فایل آپلود شده در صورت خطا
@@ -112,53 +148,222 @@ def process_video_api():
                  logger.error(f"Error removing uploaded file {file_path} after error: {remove_error}")
         return jsonify({"error": f"Error processing video: {str(e)}"}), 500
 
+# --- Video Job Routes ---
+@processing_bp.route('/jobs/<job_id>', methods=['GET'])
+def video_job_status_api(job_id):
+    """وضعیت یک کار ویدیو: frames_done، total_frames، fps و eta_seconds"""
+    status = video_jobs.status(job_id)
+    if status is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(status), 200
+
+@processing_bp.route('/jobs/<job_id>/events', methods=['GET'])
+def video_job_events_api(job_id):
+    """Server-Sent Events: one 'data:' message per status change, until the job finishes"""
+    status = video_jobs.status(job_id)
+    if status is None:
+        return jsonify({"error": "Job not found"}), 404
+    if not request.environ.get('wsgi.multithread'):
+        # A sync worker would be blocked (and killed at --timeout) for the whole job; see gunicorn.conf.py
+        return jsonify({"error": "Progress streaming needs threaded workers; poll /jobs/<job_id> instead",
+                        "status_url": url_for('processing.video_job_status_api', job_id=job_id)}), 501
+
+    def generate(status):
+        last_sent = time.time()
+        while True:
+            yield f"data: {json.dumps(status)}\n\n"
+            last_sent = time.time()
+            if status["status"] in FINISHED_STATES:
+                return
+            previous = status
+            while status == previous:
+                time.sleep(0.5)
+                status = video_jobs.status(job_id) or previous
+                if status == previous and time.time() - last_sent >= JOB_EVENTS_HEARTBEAT:
+                    yield ": keep-alive\n\n"
+                    last_sent = time.time()
+
+    return Response(stream_with_context(generate(status)), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@processing_bp.route('/jobs/<job_id>/cancel', methods=['POST'])
+def video_job_cancel_api(job_id):
+    """لغو یک کار در صف یا در حال اجرا"""
+    status = video_jobs.cancel(job_id)
+    if status is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(status), 202 if status.get("cancel_requested") else 200
+
+@processing_bp.route('/jobs/<job_id>/result', methods=['GET'])
+def video_job_result_api(job_id):
+    """دانلود ویدیوی پردازش شده"""
+    status = video_jobs.status(job_id)
+    if status is None:
+        return jsonify({"error": "Job not found"}), 404
+    if status["status"] != "done":
+        return jsonify({"error": f"Job is {status['status']}", "status": status["status"]}), 409
+    return send_from_directory(os.path.abspath(video_jobs.results_folder), status["output_filename"], as_attachment=True)
+
 # --- Webcam Frame Processing Route --- New Route
+# Raw image bodies (Content-Type: image/jpeg, image/png or application/octet-stream)
+RAW_IMAGE_TYPES = ('image/jpeg', 'image/png', 'application/octet-stream')
+# Largest request body accepted by /image and /webcam_frame (bytes); checked before anything is read.
+# Not MAX_CONTENT_LENGTH: that would cap /video uploads as well
+MAX_IMAGE_BYTES = int(os.environ.get("MAX_IMAGE_BYTES", 16 * 1024 * 1024))
+
+
+class ImageTooLarge(ValueError):
+    """The image body is larger than MAX_IMAGE_BYTES."""
+
+
+def image_too_large_response():
+    return jsonify({"error": f"Image larger than {MAX_IMAGE_BYTES} bytes"}), 413
+
+def check_image_length():
+    """413 response when the declared body size is over MAX_IMAGE_BYTES, else None."""
+    if request.content_length is not None and request.content_length > MAX_IMAGE_BYTES:
+        return image_too_large_response()
+    return None
+
+def decode_image_stream(stream, length=None):
+    """
+    Reads an encoded image from stream into a NumPy buffer and decodes it (None when it cannot).
+    length is the Content-Length, already checked against MAX_IMAGE_BYTES; without one (chunked
+    bodies) at most MAX_IMAGE_BYTES are read and ImageTooLarge is raised past that.
+    """
+    if length and hasattr(stream, 'readinto'):
+        buffer = np.empty(length, np.uint8)
+        view = memoryview(buffer)
+        received = 0
+        while received < length:
+            count = stream.readinto(view[received:])
+            if not count:
+                break
+            received += count
+        buffer = buffer[:received]
+    else:
+        data = stream.read(MAX_IMAGE_BYTES + 1)
+        if len(data) > MAX_IMAGE_BYTES:
+            raise ImageTooLarge()
+        buffer = np.frombuffer(data, np.uint8)
+    if buffer.size == 0:
+        return None
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+def scale_detections(results, frame):
+    """Boxes from the 640x640 processing space to frame pixels"""
+    height, width = frame.shape[:2]
+    scale_x, scale_y = width / 640.0, height / 640.0
+    return [dict(res, box=[round(res['box'][0] * scale_x), round(res['box'][1] * scale_y),
+                           round(res['box'][2] * scale_x), round(res['box'][3] * scale_y)]) for res in results]
+
 @processing_bp.route('/webcam_frame', methods=['POST'])
 def process_webcam_frame_api():
-    """API برای پردازش یک فریم از وبکم"""
-    data = request.get_json()
-    if not data or 'frame' not in data:
-        return jsonify({"error": "No frame data provided"}), 400
+    """
+    API برای پردازش یک فریم از وبکم. The frame can be sent as
+    - a raw body (Content-Type: image/jpeg / image/png),
+    - multipart/form-data with a 'frame' (or 'image') file,
+    - JSON {"frame": "data:image/jpeg;base64,..."} (the original format).
+    With ?response=detections (or "response": "detections" in the JSON) only the detections
+    are returned, with boxes in frame pixels and no re-encoded image.
+    """
+    response_mode = request.args.get('response', 'annotated')
+    too_large = check_image_length()
+    if too_large is not None:
+        return too_large
+    if request.mimetype in RAW_IMAGE_TYPES:
+        try:
+            frame = decode_image_stream(request.stream, request.content_length)
+        except ImageTooLarge:
+            return image_too_large_response()
+        if frame is None:
+            return jsonify({"error": "Could not decode image body"}), 400
+    elif request.mimetype == 'multipart/form-data':
+        file = request.files.get('frame') or request.files.get('image')
+        if file is None:
+            return jsonify({"error": "No frame file provided"}), 400
+        try:
+            frame = decode_image_stream(file.stream)
+        except ImageTooLarge:
+            return image_too_large_response()
+        if frame is None:
+            return jsonify({"error": "Could not decode frame file"}), 400
+    else:
+        data = request.get_json(silent=True)
+        if not data or 'frame' not in data:
+            return jsonify({"error": "No frame data provided"}), 400
+        response_mode = data.get('response', response_mode)
 
-    frame_b64 = data['frame']
-    # حذف پیشوند 'data:image/jpeg;base64,' اگر وجود دارد
-    if ',' in frame_b64:
-        frame_b64 = frame_b64.split(',')[1]
+        frame_b64 = data['frame']
+        # حذف پیشوند 'data:image/jpeg;base64,' اگر وجود دارد
+        if ',' in frame_b64:
+            frame_b64 = frame_b64.split(',')[1]
 
-    try:
-        # دیکود کردن base64 به تصویر OpenCV
-        img_bytes = base64.b64decode(frame_b64)
-        np_arr = np.frombuffer(img_bytes, np.uint8)
-        frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        if frame is None:
-            raise ValueError("Could not decode frame from base64")
-            
-    except Exception as decode_err:
-        logger.error(f"Error decoding base64 frame: {decode_err}")
-        return jsonify({"error": "Could not decode base64 frame"}), 400
+        try:
+            # دیکود کردن base64 به تصویر OpenCV
+            img_bytes = base64.b64decode(frame_b64)
+            np_arr = np.frombuffer(img_bytes, np.uint8)
+            frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+            if frame is None:
+                raise ValueError("Could not decode frame from base64")
+                
+        except Exception as decode_err:
+            logger.error(f"Error decoding base64 frame: {decode_err}")
+            return jsonify({"error": "Could not decode base64 frame"}), 400
+
+    if response_mode not in ('annotated', 'detections'):
+        return jsonify({"error": "response must be 'annotated' or 'detections'"}), 400
+    detections_only = response_mode == 'detections'
 
     try:
         detection_order = get_detection_order() # گرفتن ترتیب مدل‌ها
         # استفاده از تابع process_fire_detection موجود برای پردازش فریم
         # این تابع هم تصویر پردازش شده و هم لیست نتایج را برمی‌گرداند
-        # processed_frame, results = process_fire_detection(
-        #     frame, 
-        #     detection_order, 
-        #     yolo_models, 
-        #     model_lock
-        # )
+        processed_frame, results = process_fire_detection(
+            frame, 
+            detection_order, 
+            yolo_models, 
+            get_model_pool(),
+            prefilter=prefilter,
+            batcher=get_batcher(),
+            annotate=not detections_only
+        )
+
+        if detections_only:
+            height, width = frame.shape[:2]
+            return jsonify({
+                "status": "success",
+                "width": width,
+                "height": height,
+                "detections": scale_detections(results, frame)
+            }), 200
 
         # انکود کردن فریم پردازش شده به base64
-        # _, buffer = cv2.imencode('.jpg', processed_frame)
-        # jpg_as_text = base64.b64encode(buffer).decode('utf-8')
+        _, buffer = cv2.imencode('.jpg', processed_frame)
+        jpg_as_text = base64.b64encode(buffer).decode('utf-8')
 
         # برگرداندن فریم پردازش شده و نتایج تشخیص
         return jsonify({
             "status": "success",
-            # "annotated_frame": 'data:image/jpeg;base64,' + jpg_as_text,
-            # "detections": results
+            "annotated_frame": 'data:image/jpeg;base64,' + jpg_as_text,
+            "detections": results
         }), 200
 
     except Exception as e:
         logger.exception(f"Error processing webcam frame: {e}")
         return jsonify({"error": f"Error processing webcam frame: {str(e)}"}), 500
+
+# --- Inference Stats Route ---
+@processing_bp.route('/stats', methods=['GET'])
+def inference_stats_api():
+    """Micro-batching (batch-size histogram, queue wait) and model pool counters"""
+    model_pool = get_model_pool()
+    if isinstance(model_pool, ModelClient):
+        stats = model_pool.stats() # counters of the model server
+    else:
+        stats = {
+            "micro_batching": get_batcher().stats() if get_batcher() is not None else None,
+            "model_pool": model_pool.stats(),
+        }
+    stats["prefilter"] = dict(prefilter.snapshot(), mode=PREFILTER_MODE) if prefilter is not None else None
+    return jsonify(stats), 200
@@ -6,7 +6,7 @@ from flask_login import LoginManager, login_user, logout_user, login_required, c
 import os # اضافه کردن import os
 
 # Import تنظیمات و مدل‌ها
-from model_config import load_yolo_models, get_config
+from model_config import load_yolo_models, connect_model_server, get_config, MODEL_SERVER_SOCKET
 from db_config import db
 from user import User
 # from create_initial_user import create_initial_user
@@ -16,7 +16,11 @@ from api.auth import auth_bp
 from api.processing import processing_bp
 
 # --- Initialization ---
-load_yolo_models()
+# با MODEL_SERVER_SOCKET مدل‌ها فقط در model_server.py بارگیری می‌شوند (مشترک بین workerهای gunicorn)
+if MODEL_SERVER_SOCKET:
+    connect_model_server(MODEL_SERVER_SOCKET)
+else:
+    load_yolo_models()
 config = get_config()
 # create_initial_user() # ساخت کاربر اولیه اگر وجود نداشته باشد
 
@@ -0,0 +1,146 @@
+# batching.py
+# Dynamic micro-batching for the Flask API. Request threads submit preprocessed images; one
+# worker per model replica takes up to MICROBATCH_MAX_SIZE of them (waiting at most
+# MICROBATCH_MAX_WAIT after the first), runs one batched model call and hands every
+# request its own result.
+import os
+import queue
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+logger = logging.getLogger(__name__)
+
+MICROBATCH = os.environ.get("MICROBATCH", "1") == "1"
+MICROBATCH_MAX_SIZE = int(os.environ.get("MICROBATCH_MAX_SIZE", 8))
+# Longest the first request of a batch waits for others to join (seconds)
+MICROBATCH_MAX_WAIT = float(os.environ.get("MICROBATCH_MAX_WAIT", 0.01))
+# Longest a request waits for its result, queueing included (seconds)
+MICROBATCH_TIMEOUT = float(os.environ.get("MICROBATCH_TIMEOUT", 30))
+WAIT_SAMPLES = 1000  # queue waits kept for the percentiles in stats()
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class MicroBatcher:
+    """
+    One request queue per model name, served by as many workers as the model pool has
+    replicas. submit() blocks the calling (request) thread until its batch has run.
+    """
+
+    def __init__(self, model_pool, max_batch_size=MICROBATCH_MAX_SIZE, max_wait=MICROBATCH_MAX_WAIT, timeout=MICROBATCH_TIMEOUT):
+        self.model_pool = model_pool
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self._queues = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.cancelled = 0  # requests that timed out before a worker took them
+        self.batch_sizes = defaultdict(int)
+        self.inference_seconds = 0.0
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+
+    def submit(self, model_name, image, timeout=None):
+        """ultralytics Results for one image, computed as part of a batch."""
+        return self.result(self.enqueue(model_name, image), timeout)
+
+    def enqueue(self, model_name, image):
+        """Queues one image; the Future completes when its batch has run."""
+        future = Future()
+        self._queue(model_name).put((image, future, time.time()))
+        return future
+
+    def result(self, future, timeout=None):
+        """Waits for an enqueued image; on timeout it is cancelled if no batch has taken it yet."""
+        try:
+            return future.result(timeout=self.timeout if timeout is None else timeout)
+        except FutureTimeout:
+            # Still queued: cancelled, so the workers drop it instead of running it for nobody
+            if future.cancel():
+                with self._lock:
+                    self.cancelled += 1
+            raise
+
+    def _queue(self, model_name):
+        with self._lock:
+            if model_name not in self._queues:
+                if model_name not in self.model_pool:
+                    raise KeyError(f"Model '{model_name}' is not loaded")
+                requests = queue.Queue()
+                self._queues[model_name] = requests
+                for i in range(self.model_pool.replicas):
+                    threading.Thread(target=self._worker, args=(model_name, requests), name=f"microbatch-{model_name}-{i}", daemon=True).start()
+            return self._queues[model_name]
+
+    @staticmethod
+    def _claim(request):
+        # False for a request whose caller gave up (timed out) while it waited; otherwise it can no longer be cancelled
+        return request[1].set_running_or_notify_cancel()
+
+    def _gather(self, requests):
+        request = requests.get()
+        while not self._claim(request):
+            request = requests.get()
+        batch = [request]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            try:
+                request = requests.get(timeout=remaining) if remaining > 0 else requests.get_nowait()
+            except queue.Empty:
+                break
+            if self._claim(request):
+                batch.append(request)
+        return batch
+
+    def _worker(self, model_name, requests):
+        while True:
+            batch = self._gather(requests)
+            started = time.time()
+            try:
+                with self.model_pool.replica(model_name) as model:
+                    results = model([image for image, _, _ in batch], verbose=False)
+            except Exception as e:
+                logger.error(f"Batched inference ({model_name}, {len(batch)} images) failed: {e}")
+                with self._lock:
+                    self.failed_batches += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finished = time.time()
+            with self._lock:
+                self.requests += len(batch)
+                self.batches += 1
+                self.batch_sizes[len(batch)] += 1
+                self.inference_seconds += finished - started
+                self._waits.extend(started - submitted for _, _, submitted in batch)
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": round(self.max_wait * 1000, 1),
+                "requests": self.requests,
+                "batches": self.batches,
+                "failed_batches": self.failed_batches,
+                "cancelled": self.cancelled,
+                "mean_batch_size": round(self.requests / self.batches, 2) if self.batches else None,
+                "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+                "queue_wait_ms": {
+                    "p50": round(_percentile(waits, 0.5) * 1000, 2) if waits else None,
+                    "p95": round(_percentile(waits, 0.95) * 1000, 2) if waits else None,
+                    "max": round(waits[-1] * 1000, 2) if waits else None,
+                },
+                "mean_batch_ms": round(self.inference_seconds / self.batches * 1000, 2) if self.batches else None,
+                "queue_depth": {name: requests.qsize() for name, requests in self._queues.items()},
+            }
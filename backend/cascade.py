@@ -0,0 +1,115 @@
+# cascade.py
+# Coarse-to-fine detection: one low-resolution pass over the whole frame, then a
+# high-resolution pass over crops around the low-confidence candidates only. Small, distant
+# fires that score under the threshold at imgsz=320 get a second look at CASCADE_FINE_IMGSZ,
+# and the crop results are merged back into full-frame coordinates.
+import os
+import time
+
+import torch
+from torchvision.ops import batched_nms
+
+CASCADE = os.environ.get("CASCADE", "0") == "1"
+CASCADE_FINE_IMGSZ = int(os.environ.get("CASCADE_FINE_IMGSZ", 640))
+# Coarse boxes from this confidence up to the detection threshold are re-checked on a crop
+CASCADE_CANDIDATE_CONF = float(os.environ.get("CASCADE_CANDIDATE_CONF", 0.05))
+CASCADE_MAX_CROPS = int(os.environ.get("CASCADE_MAX_CROPS", 4))  # per frame, most confident candidates first
+CASCADE_CROP_SIZE = int(os.environ.get("CASCADE_CROP_SIZE", 320))  # smallest crop side, in frame pixels
+CASCADE_CONTEXT = float(os.environ.get("CASCADE_CONTEXT", 3.0))  # crop side as a multiple of the candidate box
+CASCADE_NMS_IOU = 0.5
+
+
+def crop_window(box, frame_width, frame_height, crop_size=CASCADE_CROP_SIZE, context=CASCADE_CONTEXT):
+    """Square crop (left, top, right, bottom) centred on a candidate box, shifted to stay inside the frame."""
+    x1, y1, x2, y2 = box
+    side = max(crop_size, context * max(x2 - x1, y2 - y1))
+    crop_width, crop_height = min(int(side), frame_width), min(int(side), frame_height)
+    left = int(min(max(0, (x1 + x2 - crop_width) / 2), frame_width - crop_width))
+    top = int(min(max(0, (y1 + y2 - crop_height) / 2), frame_height - crop_height))
+    return left, top, left + crop_width, top + crop_height
+
+
+def merge_windows(windows):
+    """Replaces overlapping crop windows by their union, so neighbouring candidates cost one crop."""
+    merged = []
+    for window in windows:
+        for i, other in enumerate(merged):
+            if window[0] < other[2] and other[0] < window[2] and window[1] < other[3] and other[1] < window[3]:
+                merged[i] = (min(window[0], other[0]), min(window[1], other[1]), max(window[2], other[2]), max(window[3], other[3]))
+                break
+        else:
+            merged.append(window)
+    return merged
+
+
+class CascadeDetector:
+    """
+    Runs the cascade for a list of frames with two batched model calls: the coarse pass over
+    every frame and the fine pass over every crop. Boxes at or above conf from the coarse
+    pass are kept as they are; the fine boxes are shifted into frame coordinates and both
+    sets go through a per-class NMS. Returns ultralytics Results, like model.predict().
+    """
+
+    def __init__(self, model, fine_imgsz=CASCADE_FINE_IMGSZ, candidate_conf=CASCADE_CANDIDATE_CONF,
+                 max_crops=CASCADE_MAX_CROPS, crop_size=CASCADE_CROP_SIZE, context=CASCADE_CONTEXT):
+        self.model = model
+        self.fine_imgsz = fine_imgsz
+        self.candidate_conf = candidate_conf
+        self.max_crops = max_crops
+        self.crop_size = crop_size
+        self.context = context
+        self.frames = 0
+        self.candidates = 0
+        self.crops = 0
+        self.promoted = 0  # fine-pass boxes that survived the merge
+        self.fine_seconds = 0.0
+
+    def detect(self, frames, conf, imgsz):
+        coarse = self.model.predict(frames, conf=min(self.candidate_conf, conf), imgsz=imgsz, device="cpu", verbose=False)
+        parts = []
+        crops, owners = [], []
+        for index, (frame, result) in enumerate(zip(frames, coarse)):
+            data = result.boxes.data.cpu()  # x1, y1, x2, y2, conf, cls
+            parts.append([data[data[:, 4] >= conf]])
+            candidates = data[data[:, 4] < conf]
+            self.frames += 1
+            self.candidates += len(candidates)
+            if not len(candidates):
+                continue
+            height, width = frame.shape[:2]
+            strongest = candidates[candidates[:, 4].argsort(descending=True)][:self.max_crops]
+            windows = merge_windows([crop_window(box[:4].tolist(), width, height, self.crop_size, self.context) for box in strongest])
+            for left, top, right, bottom in windows:
+                crops.append(frame[top:bottom, left:right].copy())
+                owners.append((index, left, top))
+
+        if crops:
+            start = time.perf_counter()
+            fine = self.model.predict(crops, conf=conf, imgsz=self.fine_imgsz, device="cpu", verbose=False)
+            self.fine_seconds += time.perf_counter() - start
+            self.crops += len(crops)
+            for (index, left, top), result in zip(owners, fine):
+                data = result.boxes.data.cpu().clone()
+                if len(data):
+                    data[:, [0, 2]] += left
+                    data[:, [1, 3]] += top
+                    parts[index].append(data)
+
+        for result, frame_parts in zip(coarse, parts):
+            data = torch.cat(frame_parts)
+            if len(frame_parts) > 1 and len(data):
+                keep = batched_nms(data[:, :4], data[:, 4], data[:, 5].int(), CASCADE_NMS_IOU)
+                self.promoted += int((keep >= len(frame_parts[0])).sum())
+                data = data[keep]
+            result.update(boxes=data)
+        return coarse
+
+    def snapshot(self):
+        return {
+            "frames": self.frames,
+            "candidates": self.candidates,
+            "crops": self.crops,
+            "promoted": self.promoted,
+            "crops_per_frame": round(self.crops / self.frames, 3) if self.frames else 0.0,
+            "fine_ms_per_frame": round(self.fine_seconds / self.frames * 1000, 2) if self.frames else None,
+        }
@@ -8,22 +8,27 @@ import websockets
 import requests
 import base64
 from datetime import datetime
+from frame_protocol import unpack_stream_frame
 
 def print_colored(text, color_code):
     """Print text with specific color"""
     print(f"\033[{color_code}m{text}\033[0m")
 
-async def test_websocket_connection(hostname="localhost", port=8010, timeout=30):
-    """Test WebSocket connection and image reception"""
+async def test_websocket_connection(hostname="localhost", port=8010, timeout=30, binary=False):
+    """Test WebSocket connection and image reception (base64 text mode, or binary mode with binary=True)"""
     url = f"ws://{hostname}:{port}/ws/video_stream"
+    if binary:
+        url += "?format=binary"
+    mode = "binary" if binary else "text"
     
-    print_colored(f"[{datetime.now().strftime('%H:%M:%S')}] Testing WebSocket connection to: {url}", "36")
-    print_colored("Waiting for images for up to 30 seconds...", "33")
+    print_colored(f"[{datetime.now().strftime('%H:%M:%S')}] Testing WebSocket connection ({mode} mode) to: {url}", "36")
+    print_colored(f"Waiting for images for up to {timeout} seconds...", "33")
     
+    images_received = 0
+    bytes_received = 0
+    latencies = []
+    start_time = time.time()
     try:
-        images_received = 0
-        start_time = time.time()
-        
         async with websockets.connect(url, ping_interval=None) as websocket:
             print_colored(f"[{datetime.now().strftime('%H:%M:%S')}] WebSocket connection established", "32")
             
@@ -33,14 +38,23 @@ async def test_websocket_connection(hostname="localhost", port=8010, timeout=30)
                     image_data = await asyncio.wait_for(websocket.recv(), timeout=5.0)
                     
                     # Check if we got valid image data
-                    if len(image_data) > 1000:  # Assuming valid base64 image is longer
+                    if len(image_data) > 1000:  # Assuming valid image is longer
                         images_received += 1
-                        print_colored(f"[{datetime.now().strftime('%H:%M:%S')}] ✓ Received image #{images_received} (size: {len(image_data)} bytes)", "32")
+                        bytes_received += len(image_data)
+                        if binary:
+                            seq, capture_time, detections, img_data = unpack_stream_frame(image_data)
+                            if capture_time:
+                                latencies.append((time.time() - capture_time) * 1000)
+                            print_colored(f"[{datetime.now().strftime('%H:%M:%S')}] ✓ Received frame #{seq} (size: {len(image_data)} bytes, detections: {detections})", "32")
+                        else:
+                            img_data = None
+                            print_colored(f"[{datetime.now().strftime('%H:%M:%S')}] ✓ Received image #{images_received} (size: {len(image_data)} bytes)", "32")
                         
                         # Try to save the first image for verification
                         if images_received == 1:
                             try:
-                                img_data = base64.b64decode(image_data)
+                                if img_data is None:
+                                    img_data = base64.b64decode(image_data)
                                 with open("test_received_image.jpg", "wb") as f:
                                     f.write(img_data)
                                 print_colored(f"Saved first received image to 'test_received_image.jpg'", "32")
@@ -64,6 +78,30 @@ async def test_websocket_connection(hostname="localhost", port=8010, timeout=30)
         print_colored(f"\n✗ CONNECTION ERROR: {e}", "31")
         print_colored("The ws_server.py may not be running or there's a network issue.", "31")
 
+    elapsed = max(time.time() - start_time, 1e-6)
+    return {
+        "mode": mode,
+        "images": images_received,
+        "bytes": bytes_received,
+        "avg_frame_bytes": bytes_received / images_received if images_received else 0,
+        "fps": images_received / elapsed,
+        "avg_latency_ms": sum(latencies) / len(latencies) if latencies else None,
+    }
+
+async def compare_stream_modes(hostname="localhost", port=8010, duration=10):
+    """Measures text (base64) vs binary WebSocket egress for the same stream"""
+    print_colored("\n===== Text vs Binary WebSocket Frames =====", "36")
+    text_stats = await test_websocket_connection(hostname, port, timeout=duration)
+    binary_stats = await test_websocket_connection(hostname, port, timeout=duration, binary=True)
+    for stats in (text_stats, binary_stats):
+        latency = f"{stats['avg_latency_ms']:.1f} ms" if stats['avg_latency_ms'] is not None else "n/a"
+        print_colored(f"{stats['mode']:>6}: {stats['images']} frames, {stats['fps']:.1f} fps, "
+                      f"{stats['avg_frame_bytes'] / 1024:.1f} KiB/frame, capture-to-receive latency {latency}", "36")
+    if text_stats["avg_frame_bytes"] and binary_stats["avg_frame_bytes"]:
+        saving = 1 - binary_stats["avg_frame_bytes"] / text_stats["avg_frame_bytes"]
+        print_colored(f"Binary mode uses {saving:.0%} fewer bytes per frame", "32")
+    return text_stats, binary_stats
+
 def check_server_status(hostname="localhost", port=8010):
     """Check if the server is running and its current status"""
     print_colored(f"[{datetime.now().strftime('%H:%M:%S')}] Checking server status...", "36")
@@ -95,21 +133,33 @@ def check_server_status(hostname="localhost", port=8010):
         print_colored(f"✗ ERROR: {e}", "31")
         return None
 
+# ETag of the last frame fetched by check_last_image(), so repeated checks skip unchanged frames
+_last_image_etag = None
+
 def check_last_image(hostname="localhost", port=8010):
-    """Try to get the last image directly"""
+    """Try to get the last image directly (raw JPEG, conditional on the previous fetch)"""
+    global _last_image_etag
     print_colored(f"[{datetime.now().strftime('%H:%M:%S')}] Checking last image...", "36")
     
     try:
-        response = requests.get(f"http://{hostname}:{port}/last_image", timeout=2)
+        headers = {"If-None-Match": _last_image_etag} if _last_image_etag else {}
+        response = requests.get(f"http://{hostname}:{port}/last_image", params={"format": "jpeg"}, headers=headers, timeout=2)
+        if response.status_code == 304:
+            print_colored(f"✓ Last image unchanged since the previous check (seq {response.headers.get('X-Frame-Seq')})", "32")
+            return True
         if response.status_code == 200:
-            data = response.json()
-            if data.get('image_b64'):
+            if response.headers.get("Content-Type", "").startswith("image/jpeg"):
+                img_data = response.content
+            else:
+                # Older servers only answer with base64 JSON
+                img_data = base64.b64decode(response.json().get('image_b64') or b"")
+            if img_data:
                 print_colored("✓ Last image is available on the server", "32")
+                _last_image_etag = response.headers.get("ETag")
                 try:
-                    img_data = base64.b64decode(data['image_b64'])
                     with open("last_image.jpg", "wb") as f:
                         f.write(img_data)
-                    print_colored("✓ Saved last image to 'last_image.jpg'", "32")
+                    print_colored(f"✓ Saved last image to 'last_image.jpg' ({len(img_data)/1024:.1f} KB)", "32")
                 except Exception as e:
                     print_colored(f"✗ Error saving last image: {e}", "31")
                 return True
@@ -137,6 +187,9 @@ async def main():
         
         # Then test WebSocket connection
         await test_websocket_connection()
+
+        # Compare text and binary frame sizes
+        await compare_stream_modes()
         
         # Print summary
         print_colored("\n===== Diagnostic Summary =====", "36")
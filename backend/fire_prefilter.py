@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# fire_prefilter.py
+# Cheap colour and flicker test run before the YOLO models. Frames without fire-coloured
+# pixels or smoke-coloured regions (moving ones in video, smooth hazy ones in still images)
+# skip inference (or get a cheaper pass).
+#
+# Tuning on a labelled folder:
+#   python fire_prefilter.py evaluate datasets/val            # fire/, smoke/ and none/ subfolders
+#   python fire_prefilter.py evaluate datasets/val --sweep    # or images/ + YOLO labels/
+import argparse
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+# "off", "skip" (frames without fire-like content are not inferred) or "downgrade" (they get a cheaper pass)
+PREFILTER_MODE = os.environ.get("PREFILTER_MODE", "off")
+# Share of (downscaled) pixels with fire colours that makes a frame fire-like
+FIRE_RATIO_THRESHOLD = float(os.environ.get("PREFILTER_FIRE_RATIO", 0.002))
+# Share of pixels that are smoke-coloured and changed since the previous frame (video only)
+SMOKE_RATIO_THRESHOLD = float(os.environ.get("PREFILTER_SMOKE_RATIO", 0.01))
+# Still images have no motion: share of smoke-coloured pixels without texture (haze) instead.
+# Deliberately loose; grey skies and walls pass too, so stills with smoke are never skipped
+STILL_SMOKE_RATIO_THRESHOLD = float(os.environ.get("PREFILTER_STILL_SMOKE_RATIO", 0.05))
+# Share of fire-coloured pixels that toggled since the previous frame; only used with require_flicker
+FLICKER_THRESHOLD = float(os.environ.get("PREFILTER_FLICKER", 0.1))
+ANALYSIS_WIDTH = int(os.environ.get("PREFILTER_WIDTH", 160))
+
+# HSV ranges (OpenCV: H 0-180): saturated red/orange/yellow that is bright, and grey smoke
+FIRE_HSV_LOW, FIRE_HSV_HIGH = np.array((0, 70, 150), np.uint8), np.array((35, 255, 255), np.uint8)
+SMOKE_HSV_LOW, SMOKE_HSV_HIGH = np.array((0, 0, 90), np.uint8), np.array((180, 50, 230), np.uint8)
+SMOKE_MOTION_DELTA = 12  # grey-level change that counts as moving smoke
+SMOKE_TEXTURE_MAX = 10  # |Laplacian| below this counts as smooth, as smoke blurs what is behind it
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+class FirePrefilter:
+    """
+    Vectorised per-frame test. For video it keeps the previous downscaled frame, so smoke
+    only counts when it moves and fire colours can be required to flicker. Still images are
+    scored on smooth smoke-coloured areas instead of motion.
+    """
+
+    def __init__(self, fire_ratio=FIRE_RATIO_THRESHOLD, smoke_ratio=SMOKE_RATIO_THRESHOLD,
+                 flicker=FLICKER_THRESHOLD, require_flicker=False, width=ANALYSIS_WIDTH,
+                 still_smoke_ratio=STILL_SMOKE_RATIO_THRESHOLD):
+        self.fire_ratio = fire_ratio
+        self.smoke_ratio = smoke_ratio
+        self.still_smoke_ratio = still_smoke_ratio
+        self.flicker = flicker
+        self.require_flicker = require_flicker
+        self.width = width
+        self._previous_gray = None
+        self._previous_fire = None
+        self.analysed = 0
+        self.negatives = 0
+        self.seconds = 0.0
+
+    def analyse(self, frame, temporal=True):
+        """
+        Scores one BGR frame; temporal=False treats it as a still image (no smoke motion or
+        flicker, and the frame is not kept), so one instance can score concurrent requests.
+        """
+        start = time.perf_counter()
+        height, width = frame.shape[:2]
+        if width > self.width:
+            frame = cv2.resize(frame, (self.width, max(1, round(height * self.width / width))), interpolation=cv2.INTER_AREA)
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        blue, green, red = frame[..., 0], frame[..., 1], frame[..., 2]
+        # Fire: hue/saturation/value range plus the R >= G > B ordering of flames
+        fire = (cv2.inRange(hsv, FIRE_HSV_LOW, FIRE_HSV_HIGH) > 0) & (red >= green) & (green > blue)
+        smoke = cv2.inRange(hsv, SMOKE_HSV_LOW, SMOKE_HSV_HIGH) > 0
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        fire_ratio = float(np.count_nonzero(fire)) / fire.size
+        smoke_ratio = 0.0
+        flicker = None
+        smoke_threshold = self.smoke_ratio
+        if not temporal:
+            smooth = np.abs(cv2.Laplacian(gray, cv2.CV_16S, ksize=3)) < SMOKE_TEXTURE_MAX
+            smoke_ratio = float(np.count_nonzero(smoke & smooth)) / smoke.size
+            smoke_threshold = self.still_smoke_ratio
+        elif self._previous_gray is not None and self._previous_gray.shape == gray.shape:
+            moving = cv2.absdiff(gray, self._previous_gray) > SMOKE_MOTION_DELTA
+            smoke_ratio = float(np.count_nonzero(smoke & moving)) / smoke.size
+            fire_pixels = np.count_nonzero(fire | self._previous_fire)
+            flicker = float(np.count_nonzero(fire ^ self._previous_fire)) / fire_pixels if fire_pixels else 0.0
+        if temporal:
+            self._previous_gray = gray
+            self._previous_fire = fire
+
+        fire_like = fire_ratio >= self.fire_ratio
+        if fire_like and self.require_flicker and flicker is not None:
+            fire_like = flicker >= self.flicker
+        smoke_like = smoke_ratio >= smoke_threshold
+        fire_like = fire_like or smoke_like
+
+        self.analysed += 1
+        if not fire_like:
+            self.negatives += 1
+        self.seconds += time.perf_counter() - start
+        return {
+            "fire_like": fire_like,
+            "fire_ratio": round(fire_ratio, 5),
+            "smoke_ratio": round(smoke_ratio, 5),
+            "smoke_like": smoke_like,
+            "flicker": round(flicker, 4) if flicker is not None else None,
+        }
+
+    def snapshot(self):
+        return {
+            "analysed": self.analysed,
+            "negatives": self.negatives,
+            "negative_ratio": round(self.negatives / self.analysed, 3) if self.analysed else 0.0,
+            "mean_ms": round(self.seconds / self.analysed * 1000, 3) if self.analysed else None,
+        }
+
+
+def labelled_images(folder):
+    """
+    (path, is_positive) pairs from either fire/, smoke/ and none/ (or negative/) subfolders,
+    or a YOLO dataset layout (images/ with labels/*.txt; a non-empty label file is positive).
+    """
+    images_dir = os.path.join(folder, "images")
+    labels_dir = os.path.join(folder, "labels")
+    if os.path.isdir(images_dir) and os.path.isdir(labels_dir):
+        for path in sorted(glob.glob(os.path.join(images_dir, "**", "*"), recursive=True)):
+            if path.lower().endswith(IMAGE_EXTENSIONS):
+                relative = os.path.splitext(os.path.relpath(path, images_dir))[0] + ".txt"
+                label_path = os.path.join(labels_dir, relative)
+                yield path, os.path.exists(label_path) and os.path.getsize(label_path) > 0
+        return
+    for label, positive in (("fire", True), ("smoke", True), ("none", False), ("negative", False)):
+        for path in sorted(glob.glob(os.path.join(folder, label, "**", "*"), recursive=True)):
+            if path.lower().endswith(IMAGE_EXTENSIONS):
+                yield path, positive
+
+
+def evaluate(folder, fire_ratios=(FIRE_RATIO_THRESHOLD,)):
+    """Precision/recall of the prefilter on a labelled folder, one row per fire-ratio threshold."""
+    scored = []
+    seconds = 0.0
+    prefilter = FirePrefilter()
+    for path, positive in labelled_images(folder):
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        start = time.perf_counter()
+        analysis = prefilter.analyse(image, temporal=False)
+        scored.append((analysis["fire_ratio"], analysis["smoke_like"], positive))
+        seconds += time.perf_counter() - start
+    if not scored:
+        raise ValueError(f"No labelled images found in {folder}")
+
+    rows = []
+    for threshold in fire_ratios:
+        passed = [(ratio >= threshold or smoke_like, positive) for ratio, smoke_like, positive in scored]
+        tp = sum(1 for passes, positive in passed if positive and passes)
+        fp = sum(1 for passes, positive in passed if not positive and passes)
+        fn = sum(1 for passes, positive in passed if positive and not passes)
+        tn = len(scored) - tp - fp - fn
+        rows.append({
+            "fire_ratio": threshold,
+            "tp": tp, "fp": fp, "fn": fn, "tn": tn,
+            "precision": round(tp / (tp + fp), 3) if tp + fp else None,
+            "recall": round(tp / (tp + fn), 3) if tp + fn else None,
+            # Share of all images that would skip the YOLO models
+            "skip_rate": round((fn + tn) / len(scored), 3),
+        })
+    return {
+        "images": len(scored),
+        "positives": sum(1 for _, _, positive in scored if positive),
+        "mean_ms": round(seconds / len(scored) * 1000, 3),
+        "rows": rows,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fire/smoke colour prefilter tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    evaluate_parser = subparsers.add_parser("evaluate", help="precision/recall on a labelled folder")
+    evaluate_parser.add_argument("folder")
+    evaluate_parser.add_argument("--fire-ratio", type=float, default=FIRE_RATIO_THRESHOLD)
+    evaluate_parser.add_argument("--sweep", action="store_true", help="report a range of fire-ratio thresholds")
+    args = parser.parse_args()
+
+    thresholds = (0.0, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05) if args.sweep else (args.fire_ratio,)
+    report = evaluate(args.folder, thresholds)
+    print(f"{report['images']} images ({report['positives']} with fire/smoke), prefilter {report['mean_ms']} ms/image\n")
+    print(f"{'fire_ratio':>11}{'precision':>11}{'recall':>9}{'skip rate':>11}{'tp':>6}{'fp':>6}{'fn':>6}{'tn':>6}")
+    for row in report["rows"]:
+        print(f"{row['fire_ratio']:>11}{str(row['precision']):>11}{str(row['recall']):>9}{row['skip_rate']:>11}"
+              f"{row['tp']:>6}{row['fp']:>6}{row['fn']:>6}{row['tn']:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# frame_history.py
+# Bounded per-channel history of recent encoded frames for scrubbing back after an alarm.
+import bisect
+import os
+import time
+import weakref
+from collections import deque
+
+# Limits per channel and across all channels; the oldest frames are evicted first. Every relay
+# worker keeps its own history, so N workers may hold up to N * HISTORY_TOTAL_MAX_BYTES.
+HISTORY_MAX_BYTES = int(os.environ.get("HISTORY_MAX_BYTES", 64 * 1024 * 1024))
+HISTORY_TOTAL_MAX_BYTES = int(os.environ.get("HISTORY_TOTAL_MAX_BYTES", 512 * 1024 * 1024))
+HISTORY_MAX_AGE = float(os.environ.get("HISTORY_MAX_AGE", 60.0))  # seconds
+
+
+class FrameHistory:
+    """
+    Ring buffer of Frame objects ordered by relay sequence number (and therefore by
+    receive time); numbers may have gaps when frames come from a shared store.
+    Memory is accounted as JPEG bytes and capped per channel and globally; over the global
+    cap the oldest frame of any channel goes first, and every append also ages out the
+    frames of idle channels.
+    """
+
+    total_bytes = 0  # shared across all channels
+    _instances = weakref.WeakSet()
+
+    def __init__(self, max_bytes=HISTORY_MAX_BYTES, max_age=HISTORY_MAX_AGE, keep_payloads=1):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # Newest frames that keep their cached payloads and renditions: the ones that may still
+        # sit in a subscriber's send queue, so lagging clients do not rebuild them one by one
+        self.keep_payloads = max(1, keep_payloads)
+        self.frames = deque()
+        self.bytes = 0
+        self.evicted = 0
+        FrameHistory._instances.add(self)
+
+    def append(self, frame):
+        if len(self.frames) >= self.keep_payloads:
+            # Older frames only keep their JPEG; cached WebSocket payloads are rebuilt if ever needed
+            self.frames[-self.keep_payloads].release_payloads()
+        self.frames.append(frame)
+        size = len(frame.jpeg)
+        self.bytes += size
+        FrameHistory.total_bytes += size
+        FrameHistory.evict_all()
+
+    def _pop(self):
+        size = len(self.frames.popleft().jpeg)
+        self.bytes -= size
+        FrameHistory.total_bytes -= size
+        self.evicted += 1
+
+    def evict(self, now=None):
+        """Drops this channel's frames older than max_age or beyond max_bytes."""
+        now = now or time.time()
+        frames = self.frames
+        while frames and (self.bytes > self.max_bytes or now - frames[0].received_time > self.max_age):
+            if len(frames) == 1 and now - frames[0].received_time <= self.max_age:
+                break  # always keep the latest frame
+            self._pop()
+
+    @classmethod
+    def evict_all(cls, now=None, max_total_bytes=None):
+        """Applies every channel's own limits, then drops the oldest frames across channels while over the global cap."""
+        now = now or time.time()
+        max_total_bytes = HISTORY_TOTAL_MAX_BYTES if max_total_bytes is None else max_total_bytes
+        histories = list(cls._instances)
+        for history in histories:
+            history.evict(now)
+        while cls.total_bytes > max_total_bytes:
+            # Channels are few, so a scan of their oldest frames is cheaper than keeping a heap in sync
+            candidates = [history for history in histories if len(history.frames) > 1]
+            if not candidates:
+                break  # only the latest frame of every channel is left
+            min(candidates, key=lambda history: history.frames[0].received_time)._pop()
+
+    def range(self, since=None, until=None, limit=None):
+        """Frames with since <= received_time <= until, oldest first."""
+        self.evict()
+        frames = self.frames
+        start = bisect.bisect_left(frames, since, key=lambda f: f.received_time) if since is not None else 0
+        end = bisect.bisect_right(frames, until, key=lambda f: f.received_time) if until is not None else len(frames)
+        if limit is not None and end - start > limit:
+            start = end - limit  # keep the most recent part of the range
+        return [frames[i] for i in range(start, end)]
+
+    def release_payloads(self, frame):
+        """Drops what a history reader (replay, /frames) built for an older frame; recent frames keep theirs."""
+        if len(self.frames) < self.keep_payloads or frame.seq < self.frames[-self.keep_payloads].seq:
+            frame.release_payloads()
+
+    def get(self, seq):
+        """Frame with the given relay sequence number, or None once it has been evicted."""
+        frames = self.frames
+        index = bisect.bisect_left(frames, seq, key=lambda f: f.seq)
+        if index < len(frames) and frames[index].seq == seq:
+            return frames[index]
+        return None
+
+    def stats(self):
+        return {
+            "frames": len(self.frames),
+            "bytes": self.bytes,
+            "evicted": self.evicted,
+            "oldest_time": self.frames[0].received_time if self.frames else None,
+            "newest_time": self.frames[-1].received_time if self.frames else None,
+        }
@@ -0,0 +1,76 @@
+# frame_protocol.py
+# Binary framing shared by Fire_Detection.py (producer) and ws_server.py (relay).
+import struct
+
+MAGIC = b"FD"
+VERSION = 2
+CONTENT_TYPE = "application/x-fire-frame"
+
+# magic, version, camera id length, sequence number, capture timestamp (epoch seconds),
+# detection count, followed by the utf-8 camera id and then the JPEG payload
+HEADER = struct.Struct("!2sBBQdH")
+
+# Egress header for binary WebSocket clients: relay sequence number, capture timestamp,
+# detection count, followed by the JPEG payload
+STREAM_HEADER = struct.Struct("!QdH")
+# WebSocket subprotocol (or ?format=binary) that selects binary egress
+BINARY_SUBPROTOCOL = "fire-jpeg"
+
+# Producer settings the relay suggests for the observed egress congestion (fraction of
+# frames dropped for viewers): (congestion below, JPEG quality, scale, max publish fps)
+QUALITY_LADDER = (
+    (0.05, 80, 1.0, 30),
+    (0.15, 70, 1.0, 20),
+    (0.35, 60, 0.75, 15),
+    (float("inf"), 50, 0.5, 10),
+)
+
+
+def pack_frame(camera_id, seq, timestamp, jpeg, detections=0):
+    """Builds one ingest message; jpeg may be any bytes-like object (e.g. the cv2.imencode buffer)."""
+    camera = camera_id.encode("utf-8")
+    if len(camera) > 255:
+        raise ValueError("camera_id is longer than 255 bytes")
+    return b"".join((HEADER.pack(MAGIC, VERSION, len(camera), seq, timestamp, detections), camera, jpeg))
+
+
+def unpack_frame(data):
+    """Parses an ingest message into (camera_id, seq, timestamp, detections, jpeg_bytes)."""
+    if len(data) < HEADER.size:
+        raise ValueError("Frame is shorter than the header")
+    magic, version, camera_len, seq, timestamp, detections = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Unsupported frame header (magic={magic!r}, version={version})")
+    offset = HEADER.size + camera_len
+    if len(data) <= offset:
+        raise ValueError("Frame has no image payload")
+    camera_id = bytes(data[HEADER.size:offset]).decode("utf-8")
+    return camera_id, seq, timestamp, detections, data[offset:]
+
+
+def pack_stream_frame(seq, timestamp, detections, jpeg):
+    """Builds one binary WebSocket message for viewers."""
+    return b"".join((STREAM_HEADER.pack(seq, timestamp, detections), jpeg))
+
+
+def unpack_stream_frame(data):
+    """Parses a binary WebSocket message into (seq, timestamp, detections, jpeg_bytes)."""
+    if len(data) <= STREAM_HEADER.size:
+        raise ValueError("Stream frame is shorter than the header")
+    seq, timestamp, detections = STREAM_HEADER.unpack_from(data)
+    return seq, timestamp, detections, data[STREAM_HEADER.size:]
+
+
+def producer_control(viewers, congestion):
+    """Control message returned to the producer; preview is False while nobody is watching."""
+    for threshold, quality, scale, max_fps in QUALITY_LADDER:
+        if congestion < threshold:
+            break
+    return {
+        "viewers": viewers,
+        "congestion": round(congestion, 3),
+        "preview": viewers > 0,
+        "jpeg_quality": quality,
+        "scale": scale,
+        "max_fps": max_fps,
+    }
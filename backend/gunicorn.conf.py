@@ -0,0 +1,10 @@
+# gunicorn.conf.py
+# Read automatically by `gunicorn ... wsgi:app` started in this directory.
+# Threaded workers: video jobs (video_jobs.py) run in threads of the worker that accepted
+# them, and /api/v1/process/jobs/<id>/events streams progress for the whole job. A sync
+# worker would be killed after --timeout while streaming, taking its jobs with it; a gthread
+# worker keeps heart-beating from its main thread however long a request takes.
+import os
+
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# load_test.py
+# Load generator for ws_server.py: replays JPEG frames into the relay from several
+# producers and fans them out to many WebSocket and MJPEG viewers, some of them
+# deliberately slow. Everything runs against localhost; no camera is needed.
+#
+#   uvicorn ws_server:app --port 8010
+#   python load_test.py --producers 2 --fps 30 --ws 100 --mjpeg 50 --slow-fraction 0.2 --duration 30
+import argparse
+import asyncio
+import base64
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+import cv2
+import numpy as np
+import requests
+import websockets
+
+from frame_protocol import pack_frame, unpack_stream_frame, CONTENT_TYPE as FRAME_CONTENT_TYPE
+
+DEFAULT_VIDEO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output.mp4")
+
+
+def load_frames(video_path=DEFAULT_VIDEO, max_frames=300, jpeg_quality=80):
+    """JPEG-encoded frames from a video file, or synthetic frames when the file cannot be read."""
+    frames = []
+    cap = cv2.VideoCapture(video_path)
+    while cap.isOpened() and len(frames) < max_frames:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames.append(cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality])[1].tobytes())
+    cap.release()
+    if not frames:
+        print(f"Could not read frames from {video_path}; using synthetic frames")
+        rng = np.random.default_rng(0)
+        for i in range(30):
+            frame = rng.integers(0, 255, (480, 640, 3), dtype=np.uint8)
+            cv2.putText(frame, f"load test {i}", (20, 240), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 255), 3)
+            frames.append(cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality])[1].tobytes())
+    return frames
+
+
+def percentiles(samples):
+    if not samples:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    values = np.asarray(samples) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 1), "p95_ms": round(float(p95), 1), "p99_ms": round(float(p99), 1)}
+
+
+class ProducerStats:
+    def __init__(self):
+        self.pushed = 0
+        self.failed = 0
+        self.bytes = 0
+        self.request_times = []
+
+
+def produce(base_url, camera_id, frames, fps, ingest, stop_event, stats):
+    """Pushes frames for one camera at a fixed rate until stop_event is set (runs in its own thread)."""
+    session = requests.Session()
+    interval = 1.0 / fps
+    next_time = time.time()
+    index = 0
+    while not stop_event.is_set():
+        jpeg = frames[index % len(frames)]
+        index += 1
+        sent_at = time.time()
+        try:
+            if ingest == "image":
+                response = session.post(f"{base_url}/push_image/{camera_id}", timeout=2,
+                                        json={"image_b64": base64.b64encode(jpeg).decode("utf-8"), "capture_time": sent_at})
+            else:
+                response = session.post(f"{base_url}/push_frame", timeout=2, headers={"Content-Type": FRAME_CONTENT_TYPE},
+                                        data=pack_frame(camera_id, index, sent_at, jpeg))
+            if response.status_code == 200:
+                stats.pushed += 1
+                stats.bytes += len(jpeg)
+            else:
+                stats.failed += 1
+        except requests.exceptions.RequestException:
+            stats.failed += 1
+        stats.request_times.append(time.time() - sent_at)
+        next_time += interval
+        delay = next_time - time.time()
+        if delay > 0:
+            stop_event.wait(delay)
+        else:
+            next_time = time.time()  # fell behind; do not burst to catch up
+    session.close()
+
+
+class ViewerStats:
+    def __init__(self, kind, slow):
+        self.kind = kind
+        self.slow = slow
+        self.received = 0
+        self.missed = 0
+        self.bytes = 0
+        self.latencies = []
+        self.errors = 0
+        self.last_seq = None
+
+    def record(self, seq, capture_time, nbytes):
+        now = time.time()
+        if self.last_seq is not None and seq > self.last_seq + 1:
+            self.missed += seq - self.last_seq - 1
+        self.last_seq = seq
+        self.received += 1
+        self.bytes += nbytes
+        if capture_time:
+            self.latencies.append(now - capture_time)
+
+
+async def ws_viewer(ws_url, stats, delay, deadline):
+    """Binary /ws/video_stream viewer; sleeps `delay` after every frame to simulate a slow client."""
+    try:
+        async with websockets.connect(ws_url, ping_interval=None, max_size=None) as websocket:
+            while time.time() < deadline:
+                try:
+                    message = await asyncio.wait_for(websocket.recv(), timeout=max(0.1, deadline - time.time()))
+                except asyncio.TimeoutError:
+                    break
+                seq, capture_time, _, jpeg = unpack_stream_frame(message)
+                stats.record(seq, capture_time, len(message))
+                if delay:
+                    await asyncio.sleep(delay)
+    except Exception:
+        stats.errors += 1
+
+
+async def mjpeg_viewer(host, port, path, stats, delay, deadline):
+    """/mjpeg_stream viewer over a raw connection; reads the X-Frame-Seq and X-Capture-Time part headers."""
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        await reader.readuntil(b"\r\n\r\n")  # response headers
+        while time.time() < deadline:
+            line = await asyncio.wait_for(reader.readline(), timeout=max(0.1, deadline - time.time()))
+            if not line:
+                break
+            if not line.startswith(b"--"):
+                continue  # chunked-encoding framing or the blank line after a part
+            headers = {}
+            while True:
+                header = (await reader.readline()).strip()
+                if not header:
+                    break
+                name, _, value = header.decode().partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            await reader.readexactly(length)
+            stats.record(int(headers.get("x-frame-seq", 0)), float(headers.get("x-capture-time", 0) or 0), length)
+            if delay:
+                await asyncio.sleep(delay)
+        writer.close()
+    except asyncio.TimeoutError:
+        pass
+    except Exception:
+        stats.errors += 1
+
+
+def summarize(groups, duration):
+    rows = {}
+    for name, viewers in groups.items():
+        received = sum(v.received for v in viewers)
+        missed = sum(v.missed for v in viewers)
+        latencies = [sample for v in viewers for sample in v.latencies]
+        rows[name] = {
+            "clients": len(viewers),
+            "errors": sum(v.errors for v in viewers),
+            "frames": received,
+            "fps_per_client": round(received / duration / len(viewers), 2) if viewers else 0,
+            "mbit_per_s": round(sum(v.bytes for v in viewers) * 8 / duration / 1e6, 2),
+            "drop_rate": round(missed / (received + missed), 4) if received + missed else 0.0,
+            **percentiles(latencies),
+        }
+    return rows
+
+
+async def run(args):
+    base_url = f"http://{args.host}:{args.port}"
+    frames = load_frames(args.video, args.max_frames)
+    print(f"Loaded {len(frames)} frames, {sum(map(len, frames)) / len(frames) / 1024:.1f} KiB average")
+    cameras = [f"{args.camera_prefix}{i}" for i in range(args.producers)]
+
+    stop_event = threading.Event()
+    producer_stats = {camera: ProducerStats() for camera in cameras}
+    threads = [threading.Thread(target=produce, args=(base_url, camera, frames, args.fps, args.ingest, stop_event, producer_stats[camera]), daemon=True)
+               for camera in cameras]
+    for thread in threads:
+        thread.start()
+
+    await asyncio.sleep(args.warmup)
+    deadline = time.time() + args.duration
+    width = f"&width={args.width}" if args.width else ""
+    groups = defaultdict(list)
+    tasks = []
+    for i in range(args.ws + args.mjpeg):
+        kind = "ws" if i < args.ws else "mjpeg"
+        slow = (i % 100) < args.slow_fraction * 100
+        camera = cameras[i % len(cameras)]
+        stats = ViewerStats(kind, slow)
+        groups[f"{kind}{' (slow)' if slow else ''}"].append(stats)
+        delay = args.slow_delay if slow else 0.0
+        if kind == "ws":
+            tasks.append(ws_viewer(f"ws://{args.host}:{args.port}/ws/video_stream/{camera}?format=binary{width}", stats, delay, deadline))
+        else:
+            tasks.append(mjpeg_viewer(args.host, args.port, f"/mjpeg_stream/{camera}?{width.lstrip('&')}", stats, delay, deadline))
+    await asyncio.gather(*tasks)
+    stop_event.set()
+    for thread in threads:
+        thread.join(timeout=3)
+
+    pushed = sum(s.pushed for s in producer_stats.values())
+    report = {
+        "duration_s": args.duration,
+        "ingest": {
+            "producers": args.producers,
+            "target_fps": args.fps,
+            "pushed": pushed,
+            "failed": sum(s.failed for s in producer_stats.values()),
+            "fps": round(pushed / (args.duration + args.warmup), 2),
+            "mbit_per_s": round(sum(s.bytes for s in producer_stats.values()) * 8 / (args.duration + args.warmup) / 1e6, 2),
+            "request": percentiles([t for s in producer_stats.values() for t in s.request_times]),
+        },
+        "viewers": summarize(groups, args.duration),
+    }
+    try:
+        relay = requests.get(f"{base_url}/stats", timeout=2).json()
+        report["relay"] = {key: relay.get(key) for key in ("fps", "egress_fps", "frames_dropped", "active_clients", "bytes_out")}
+    except requests.exceptions.RequestException:
+        pass
+    return report
+
+
+def print_report(report):
+    ingest = report["ingest"]
+    print(f"\nIngest: {ingest['producers']} producer(s), {ingest['pushed']} frames pushed ({ingest['failed']} failed), "
+          f"{ingest['fps']} fps total, {ingest['mbit_per_s']} Mbit/s, push request p50/p95/p99 "
+          f"{ingest['request']['p50_ms']}/{ingest['request']['p95_ms']}/{ingest['request']['p99_ms']} ms")
+    print(f"\n{'viewers':<14}{'clients':>8}{'errors':>8}{'fps/client':>12}{'Mbit/s':>10}{'drop rate':>11}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, row in report["viewers"].items():
+        print(f"{name:<14}{row['clients']:>8}{row['errors']:>8}{row['fps_per_client']:>12}{row['mbit_per_s']:>10}"
+              f"{row['drop_rate']:>11.2%}{str(row['p50_ms']):>9}{str(row['p95_ms']):>9}{str(row['p99_ms']):>9}")
+    if "relay" in report:
+        print(f"\nRelay /stats: {report['relay']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for ws_server.py ingest and fan-out (localhost, no camera)")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--video", default=DEFAULT_VIDEO, help="video whose frames are replayed (default: output.mp4)")
+    parser.add_argument("--max-frames", type=int, default=300)
+    parser.add_argument("--producers", type=int, default=1, help="one camera channel per producer")
+    parser.add_argument("--camera-prefix", default="load-")
+    parser.add_argument("--fps", type=float, default=30.0, help="push rate per producer")
+    parser.add_argument("--ingest", choices=("frame", "image"), default="frame", help="POST /push_frame (binary) or /push_image (JSON)")
+    parser.add_argument("--ws", type=int, default=50, help="binary /ws/video_stream viewers")
+    parser.add_argument("--mjpeg", type=int, default=10, help="/mjpeg_stream viewers")
+    parser.add_argument("--slow-fraction", type=float, default=0.1, help="share of viewers that are slow")
+    parser.add_argument("--slow-delay", type=float, default=0.2, help="seconds a slow viewer waits after each frame")
+    parser.add_argument("--width", type=int, default=None, help="request a rendition (e.g. 320)")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=1.0, help="seconds of ingest before viewers connect")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
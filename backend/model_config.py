@@ -1,8 +1,10 @@
 # model_config.py
 import os
+import queue
 import logging
 import threading
-from ultralytics import YOLO
+import time
+from contextlib import contextmanager
 
 # **پیکربندی لاگینگ**
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -26,13 +28,116 @@ config = {
 # --- ویرایش: ترتیب تشخیص را فقط به مدل جدید محدود کنید ---
 detection_order = [config['DEFAULT_MODEL']]
 
+# Replicas loaded per model name, so concurrent requests (and the two sections of
+# process_fire_detection) run in parallel instead of queueing on one lock. One by default:
+# every replica is another copy of the weights, and on a CPU one replica already uses all cores
+MODEL_REPLICAS = int(os.environ.get("MODEL_REPLICAS", 1))
+# Torch intra-op threads of the process (set once, it is not per thread); by default the cores
+# are split between the replicas so that replicas running together do not oversubscribe them
+MODEL_THREADS_PER_REPLICA = int(os.environ.get("MODEL_THREADS_PER_REPLICA", max(1, (os.cpu_count() or 1) // MODEL_REPLICAS)))
+# Longest a caller waits for a free replica (seconds)
+MODEL_CHECKOUT_TIMEOUT = float(os.environ.get("MODEL_CHECKOUT_TIMEOUT", 30))
+# When set, app.py workers send inference to model_server.py on this Unix socket and load no models
+MODEL_SERVER_SOCKET = os.environ.get("MODEL_SERVER_SOCKET", "")
+
+
+class ModelPoolTimeout(TimeoutError):
+    """No replica of the model became free within the checkout timeout."""
+
+
+class ModelPool:
+    """
+    Replicas of every model, handed out one caller at a time: checkout() blocks until a
+    replica is free (or raises ModelPoolTimeout) and checkin() returns it. torch's
+    intra-op thread count is process-wide, so it is set once, when the first model loads.
+    """
+
+    def __init__(self, replicas=MODEL_REPLICAS, threads=MODEL_THREADS_PER_REPLICA, timeout=MODEL_CHECKOUT_TIMEOUT):
+        self.replicas = max(1, replicas)
+        self.threads = max(1, threads)
+        self.timeout = timeout
+        self._free = {}
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+        self._threads_set = False
+
+    def add(self, model_name, model_path):
+        """Loads the replicas of one model; returns the first (for class names and the like)."""
+        # Imported here: workers that use model_server.py never load torch or ultralytics
+        from ultralytics import YOLO
+
+        if not self._threads_set:
+            import torch
+            torch.set_num_threads(self.threads)
+            self._threads_set = True
+        return self.add_replicas(model_name, [YOLO(model_path, task='detect') for _ in range(self.replicas)])
+
+    def add_replicas(self, model_name, models):
+        """Registers already loaded replicas of one model; returns the first."""
+        free = queue.Queue()
+        for model in models:
+            free.put(model)
+        self._free[model_name] = free
+        self._stats[model_name] = {"checkouts": 0, "timeouts": 0, "wait_seconds": 0.0, "in_use": 0}
+        return free.queue[0]
+
+    def __contains__(self, model_name):
+        return model_name in self._free
+
+    def checkout(self, model_name, timeout=None):
+        if model_name not in self._free:
+            raise KeyError(f"Model '{model_name}' is not loaded")
+        start = time.time()
+        try:
+            model = self._free[model_name].get(timeout=self.timeout if timeout is None else timeout)
+        except queue.Empty:
+            with self._stats_lock:
+                self._stats[model_name]["timeouts"] += 1
+            raise ModelPoolTimeout(f"No free replica of '{model_name}' after {time.time() - start:.1f}s")
+        with self._stats_lock:
+            stats = self._stats[model_name]
+            stats["checkouts"] += 1
+            stats["wait_seconds"] += time.time() - start
+            stats["in_use"] += 1
+        return model
+
+    def checkin(self, model_name, model):
+        with self._stats_lock:
+            self._stats[model_name]["in_use"] -= 1
+        self._free[model_name].put(model)
+
+    @contextmanager
+    def replica(self, model_name, timeout=None):
+        """with pool.replica(name) as model: ... checks a replica out for the block."""
+        model = self.checkout(model_name, timeout)
+        try:
+            yield model
+        finally:
+            self.checkin(model_name, model)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                name: {
+                    "replicas": self.replicas,
+                    "threads_per_replica": self.threads,
+                    "in_use": stats["in_use"],
+                    "checkouts": stats["checkouts"],
+                    "timeouts": stats["timeouts"],
+                    "mean_wait_ms": round(stats["wait_seconds"] / stats["checkouts"] * 1000, 2) if stats["checkouts"] else 0.0,
+                }
+                for name, stats in self._stats.items()
+            }
+
+
 # **بارگیری مدل‌های YOLO در startup**
-yolo_models = {}
-model_lock = threading.Lock()
+yolo_models = {}  # first replica of every model (class names, membership checks)
+model_pool = ModelPool()
+model_lock = threading.Lock()  # guards loading only; inference goes through model_pool
 
 def load_yolo_models():
     """ بارگیری مدل‌های YOLO و ذخیره در دیکشنری yolo_models. """
-    global yolo_models, model_lock
+    global yolo_models, model_pool, model_lock
     for model_name, model_path in config['AVAILABLE_MODELS'].items():
         # --- ویرایش: اطمینان از اینکه مسیر نسبت به دایرکتوری فعلی backend ساخته می‌شود ---
         # از os.path.abspath برای مسیر مطلق یا os.path.join برای مسیر نسبی دقیق استفاده کنید
@@ -44,11 +149,21 @@ def load_yolo_models():
         try:
             with model_lock:
                 # --- ویرایش: اضافه کردن task='detect' برای اطمینان از بارگیری صحیح مدل ---
-                yolo_models[model_name] = YOLO(full_model_path, task='detect') # اضافه کردن task='detect'
-            logging.info(f"Model '{model_name}' loaded successfully from {full_model_path}")
+                yolo_models[model_name] = model_pool.add(model_name, full_model_path) # task='detect' در ModelPool.add
+            logging.info(f"Model '{model_name}' loaded successfully from {full_model_path} "
+                         f"({model_pool.replicas} replicas, {model_pool.threads} threads each)")
         except Exception as e:
             logging.error(f"Error loading model '{model_name}' from {full_model_path}: {e}")
 
+def connect_model_server(socket_path=MODEL_SERVER_SOCKET):
+    """ به جای load_yolo_models: مدل‌ها در model_server.py هستند و model_pool کلاینت آن می‌شود. """
+    global model_pool
+    from model_server import ModelClient
+    client = ModelClient(socket_path)
+    yolo_models.update(client.wait_until_ready())
+    model_pool = client
+    logging.info(f"Using the model server at {socket_path} (models: {', '.join(yolo_models)})")
+
 def get_config():
     """ تابع دسترسی به config. """
     return config
@@ -64,4 +179,8 @@ def get_yolo_models():
 
 def get_model_lock():
     """ تابع دسترسی به model_lock. """
-    return model_lock
\ No newline at end of file
+    return model_lock
+
+def get_model_pool():
+    """ تابع دسترسی به model_pool. """
+    return model_pool
\ No newline at end of file
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# model_server.py
+# One process that owns the YOLO weights and the CPU cores, shared by every gunicorn worker
+# of app.py. Workers started with MODEL_SERVER_SOCKET set never load a model: they write
+# each image into a shared-memory buffer of their own and send a small JSON request over the
+# Unix socket; the reply carries the boxes. Requests from all workers meet in one
+# MicroBatcher, so they are batched together as well.
+#
+#   python model_server.py --socket /tmp/fire_model_server.sock
+#   MODEL_SERVER_SOCKET=/tmp/fire_model_server.sock gunicorn --workers 4 --bind 0.0.0.0:5000 wsgi:app
+#
+# Wire format: 4-byte little-endian length + UTF-8 JSON, both ways.
+#   {"op": "detect", "model": name, "shm": segment, "shape": [h, w, c]} -> {"ok": true, "boxes": [[x1, y1, x2, y2], ...], "conf": [...], "cls": [...]}
+#   {"op": "models"} -> {"ok": true, "models": {name: {"names": {class_id: class_name}}}}
+#   {"op": "stats"} -> {"ok": true, "model_pool": {...}, "micro_batching": {...}}
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeout, wait
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+logger = logging.getLogger("model_server")
+
+MODEL_SERVER_DEFAULT_SOCKET = "/tmp/fire_model_server.sock"
+# How long a worker waits for the model server at startup (seconds)
+MODEL_SERVER_CONNECT_TIMEOUT = float(os.environ.get("MODEL_SERVER_CONNECT_TIMEOUT", 60))
+# Connections (each with its own image buffer) a worker process keeps to the server; callers
+# beyond that wait for a free one
+MODEL_CLIENT_CONNECTIONS = int(os.environ.get("MODEL_CLIENT_CONNECTIONS", 4))
+# Longest a caller waits for a free connection (seconds)
+MODEL_CLIENT_WAIT = float(os.environ.get("MODEL_CLIENT_WAIT", 30))
+# Image buffers start at this size and grow when a larger image comes along
+IMAGE_BUFFER_BYTES = 640 * 640 * 3
+MESSAGE_LENGTH = struct.Struct("<I")
+
+
+class ModelServerError(RuntimeError):
+    """The model server could not be reached or reported an error."""
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode("utf-8")
+    sock.sendall(MESSAGE_LENGTH.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionError("Connection closed")
+        received += count
+    return bytes(buffer)
+
+
+def recv_message(sock):
+    (length,) = MESSAGE_LENGTH.unpack(_recv_exactly(sock, MESSAGE_LENGTH.size))
+    return json.loads(_recv_exactly(sock, length))
+
+
+class RemoteModelInfo:
+    """Stands in for a YOLO model in the worker's yolo_models dict (class names only)."""
+
+    def __init__(self, names):
+        self.names = {int(class_id): name for class_id, name in names.items()}
+
+
+class ModelConnection:
+    """One connection to the server plus the shared-memory buffer its images travel in."""
+
+    def __init__(self, socket_path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(socket_path)
+        except OSError as e:
+            self.sock.close()
+            raise ModelServerError(f"Could not connect to the model server at {socket_path}: {e}")
+        self.shm = None
+        self.broken = False
+
+    def buffer(self, size):
+        if self.shm is None or self.shm.size < size:
+            if self.shm is not None:
+                self.shm.close()
+                self.shm.unlink()
+            self.shm = shared_memory.SharedMemory(create=True, size=max(size, IMAGE_BUFFER_BYTES))
+        return self.shm
+
+    def request(self, message):
+        try:
+            send_message(self.sock, message)
+            reply = recv_message(self.sock)
+        except (OSError, ValueError) as e:
+            self.broken = True  # dropped when checked in; the next request reconnects (e.g. after a server restart)
+            raise ModelServerError(f"Model server request failed: {e}")
+        if not reply.get("ok"):
+            raise ModelServerError(reply.get("error", "unknown error"))
+        return reply
+
+    def close(self):
+        self.sock.close()
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+class ModelClient:
+    """
+    Worker side: a pool of at most `connections` ModelConnections, checked out per request,
+    so concurrent requests of one worker do not wait for each other while the number of
+    sockets and /dev/shm buffers stays bounded however many threads call in. Used by
+    image_processing.process_fire_detection in place of the local ModelPool.
+    """
+
+    def __init__(self, socket_path, connections=MODEL_CLIENT_CONNECTIONS, wait=MODEL_CLIENT_WAIT):
+        self.socket_path = socket_path
+        self.connections = max(1, connections)
+        self.wait = wait
+        self._idle = []
+        self._open = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def _connection(self):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._idle or self._open < self.connections, self.wait):
+                raise ModelServerError(f"No free model server connection after {self.wait:g}s")
+            connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                self._open += 1
+        try:
+            if connection is None:
+                connection = ModelConnection(self.socket_path)
+            yield connection
+        finally:
+            with self._cond:
+                if connection is not None and not connection.broken:
+                    self._idle.append(connection)
+                else:
+                    self._open -= 1
+                    if connection is not None:
+                        connection.close()
+                self._cond.notify()
+
+    def request(self, message):
+        with self._connection() as connection:
+            return connection.request(message)
+
+    def detect(self, model_name, image):
+        """(xyxy, confidences, class_ids) numpy arrays for one image."""
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        with self._connection() as connection:
+            shm = connection.buffer(image.nbytes)
+            np.ndarray(image.shape, dtype=np.uint8, buffer=shm.buf)[:] = image
+            reply = connection.request({"op": "detect", "model": model_name, "shm": shm.name, "shape": list(image.shape)})
+        return (np.asarray(reply["boxes"], dtype=np.float32).reshape(-1, 4),
+                np.asarray(reply["conf"], dtype=np.float32),
+                np.asarray(reply["cls"], dtype=np.float32))
+
+    def models(self):
+        return {name: RemoteModelInfo(info["names"]) for name, info in self.request({"op": "models"})["models"].items()}
+
+    def stats(self):
+        reply = self.request({"op": "stats"})
+        return {"model_pool": reply["model_pool"], "micro_batching": reply["micro_batching"]}
+
+    def wait_until_ready(self, timeout=MODEL_SERVER_CONNECT_TIMEOUT):
+        """Models served by the server, retrying while it starts up."""
+        deadline = time.time() + timeout
+        while True:
+            try:
+                models = self.models()
+            except ModelServerError:
+                if time.time() >= deadline:
+                    raise
+                time.sleep(0.5)
+                continue
+            # Not kept: workers forked after this (gunicorn --preload) must open their own connection
+            self.close()
+            return models
+
+    def close(self):
+        """Closes the idle connections and frees their buffers."""
+        with self._cond:
+            for connection in self._idle:
+                connection.close()
+            self._open -= len(self._idle)
+            self._idle = []
+
+
+class ModelRequestHandler(socketserver.BaseRequestHandler):
+    """One worker connection; its image buffers stay attached until it disconnects."""
+
+    def handle(self):
+        attached = {}
+        try:
+            while True:
+                try:
+                    message = recv_message(self.request)
+                except (ConnectionError, OSError):
+                    break
+                try:
+                    reply = self.server.dispatch(message, attached)
+                except Exception as e:
+                    logger.error(f"Request {message.get('op')!r} failed: {e}")
+                    reply = {"ok": False, "error": str(e)}
+                send_message(self.request, reply)
+        finally:
+            for shm in attached.values():
+                try:
+                    shm.close()
+                except BufferError:
+                    pass  # a result still references the buffer; the mapping goes when it does
+
+
+class ModelServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, model_pool, yolo_models, batcher):
+        self.model_pool = model_pool
+        self.yolo_models = yolo_models
+        self.batcher = batcher
+        super().__init__(socket_path, ModelRequestHandler)
+
+    def dispatch(self, message, attached):
+        op = message.get("op")
+        if op == "detect":
+            name = message["shm"]
+            if name not in attached:
+                # A new name means the worker replaced (and unlinked) its buffer with a larger one
+                for old in attached.values():
+                    try:
+                        old.close()
+                    except BufferError:
+                        pass
+                attached.clear()
+                shm = shared_memory.SharedMemory(name=name)
+                # The worker created the buffer and unlinks it; the tracker must not do it for us
+                resource_tracker.unregister(shm._name, "shared_memory")
+                attached[name] = shm
+            image = np.ndarray(tuple(message["shape"]), dtype=np.uint8, buffer=attached[name].buf)
+            if self.batcher is not None:
+                future = self.batcher.enqueue(message["model"], image)
+                try:
+                    result = self.batcher.result(future)
+                except FutureTimeout:
+                    if not future.cancelled():
+                        # The batch is still reading the worker's buffer, which the worker reuses
+                        # for its next image as soon as it gets a reply
+                        wait([future])
+                    raise
+            else:
+                with self.model_pool.replica(message["model"]) as model:
+                    result = model(image, verbose=False)[0]
+            boxes = result.boxes
+            return {
+                "ok": True,
+                "boxes": boxes.xyxy.cpu().numpy().tolist(),
+                "conf": boxes.conf.cpu().numpy().tolist(),
+                "cls": boxes.cls.cpu().numpy().tolist(),
+            }
+        if op == "models":
+            return {"ok": True, "models": {name: {"names": model.names} for name, model in self.yolo_models.items()}}
+        if op == "stats":
+            return {
+                "ok": True,
+                "model_pool": self.model_pool.stats(),
+                "micro_batching": self.batcher.stats() if self.batcher is not None else None,
+            }
+        raise ValueError(f"Unknown op {op!r}")
+
+
+def serve(socket_path=MODEL_SERVER_DEFAULT_SOCKET):
+    # Imported here: workers import this module for ModelClient and must not load torch
+    from model_config import load_yolo_models, get_model_pool, get_yolo_models
+    from batching import MicroBatcher, MICROBATCH
+
+    load_yolo_models()
+    if not get_yolo_models():
+        raise SystemExit("No models loaded")
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)  # left over from a previous run
+    server = ModelServer(socket_path, get_model_pool(), get_yolo_models(), MicroBatcher(get_model_pool()) if MICROBATCH else None)
+    logger.info(f"Model server listening on {socket_path} (models: {', '.join(get_yolo_models())})")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Inference server shared by the app.py workers")
+    parser.add_argument("--socket", default=os.environ.get("MODEL_SERVER_SOCKET") or MODEL_SERVER_DEFAULT_SOCKET)
+    args = parser.parse_args()
+    serve(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,570 @@
+# relay_channels.py
+# Per-camera relay state used by ws_server.py: frames, new-frame notification and WebSocket subscribers.
+import asyncio
+import base64
+import itertools
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from frame_history import FrameHistory
+from frame_protocol import pack_stream_frame, producer_control
+from relay_metrics import RateMeter, Histogram
+from renditions import scale_jpeg
+from shm_frame_store import SharedFrameStore, Doorbell, DoorbellRinger, store_exists
+
+logger = logging.getLogger("ws_server")
+
+DEFAULT_CHANNEL = "default"
+
+# Per-client send queue length; when full the oldest pending frame is dropped
+SUBSCRIBER_QUEUE_SIZE = int(os.environ.get("SUBSCRIBER_QUEUE_SIZE", 2))
+# Slow-consumer eviction: a client that drops this many frames in a row, or
+# whose single send takes longer than SUBSCRIBER_SEND_TIMEOUT, is disconnected
+SLOW_CONSUMER_MAX_DROPS = int(os.environ.get("SLOW_CONSUMER_MAX_DROPS", 150))
+# Detection messages are small, so /ws/detections clients get a longer queue
+DETECTION_QUEUE_SIZE = int(os.environ.get("DETECTION_QUEUE_SIZE", 32))
+SUBSCRIBER_SEND_TIMEOUT = float(os.environ.get("SUBSCRIBER_SEND_TIMEOUT", 5.0))
+
+# Share frames between uvicorn workers through shm_frame_store (required for --workers > 1)
+RELAY_SHARED_STORE = os.environ.get("RELAY_SHARED_STORE", "0") == "1"
+# Safety-net interval at which each worker checks the shared store; new frames
+# normally arrive through the doorbell (see shm_frame_store)
+SHARED_STORE_POLL_INTERVAL = float(os.environ.get("SHARED_STORE_POLL_INTERVAL", 0.25))
+
+# Egress congestion (share of frames dropped for viewers) is measured over this window (seconds)
+CONGESTION_WINDOW = float(os.environ.get("CONGESTION_WINDOW", 2.0))
+# A /last_image poller counts as a viewer for this long after its last request (seconds)
+POLL_VIEWER_WINDOW = float(os.environ.get("POLL_VIEWER_WINDOW", 5.0))
+
+
+class Frame:
+    """
+    One received JPEG plus metadata; the text and binary WebSocket payloads and any
+    downscaled renditions are built at most once, on first use.
+    """
+
+    __slots__ = ("seq", "jpeg", "camera_id", "source_seq", "capture_time", "detections", "received_at", "received_time", "_b64", "_binary", "_renditions")
+
+    def __init__(self, jpeg, camera_id=None, source_seq=None, capture_time=None, detections=0, image_b64=None):
+        self.seq = 0  # relay-side sequence number, assigned when stored
+        self.received_at = time.monotonic()
+        self.received_time = time.time()  # wall clock, used to index the frame history
+        self.jpeg = jpeg
+        self.camera_id = camera_id
+        self.source_seq = source_seq
+        self.capture_time = capture_time
+        self.detections = detections
+        self._b64 = image_b64
+        self._binary = None
+        self._renditions = None
+
+    def b64(self):
+        if self._b64 is None:
+            self._b64 = base64.b64encode(self.jpeg).decode('utf-8')
+        return self._b64
+
+    def binary(self):
+        if self._binary is None:
+            self._binary = pack_stream_frame(self.seq, self.capture_time or 0.0, self.detections, self.jpeg)
+        return self._binary
+
+    async def rendition(self, width=None):
+        """This frame at the given width (see renditions.py); the first caller builds it in a worker thread, others await it."""
+        if width is None:
+            return self
+        if self._renditions is None:
+            self._renditions = {}
+        task = self._renditions.get(width)
+        if task is None:
+            task = self._renditions[width] = asyncio.ensure_future(asyncio.to_thread(self._build_rendition, width))
+        # Shielded so a client disconnecting mid-build does not cancel it for the others
+        return await asyncio.shield(task)
+
+    def _build_rendition(self, width):
+        jpeg = scale_jpeg(self.jpeg, width)
+        if jpeg is None:
+            return self
+        frame = Frame(jpeg, self.camera_id, self.source_seq, self.capture_time, self.detections)
+        frame.seq = self.seq
+        frame.received_at = self.received_at
+        frame.received_time = self.received_time
+        return frame
+
+    def release_payloads(self):
+        self._b64 = None
+        self._binary = None
+        self._renditions = None
+
+    def info(self):
+        return {
+            "seq": self.seq,
+            "source_seq": self.source_seq,
+            "received_time": self.received_time,
+            "capture_time": self.capture_time,
+            "detections": self.detections,
+            "size": len(self.jpeg),
+        }
+
+
+class DetectionMessage:
+    """Structured detections for one producer frame (boxes, classes, confidences, track ids); serialised once."""
+
+    __slots__ = ("seq", "data", "received_at", "received_time", "_text")
+
+    def __init__(self, data):
+        self.seq = 0  # relay-side sequence number of detection messages, assigned when stored
+        self.data = data
+        self.received_at = time.monotonic()
+        self.received_time = time.time()
+        self._text = None
+
+    def text(self):
+        if self._text is None:
+            self._text = json.dumps(dict(self.data, relay_seq=self.seq, received_time=self.received_time))
+        return self._text
+
+
+class FrameNotifier:
+    """Wakes waiters when a new frame is stored; seq is the relay-side frame sequence number."""
+
+    def __init__(self):
+        self.seq = 0
+        self._event = asyncio.Event()
+
+    def notify(self, seq=None):
+        """Advances to seq (the shared store's number for the frame) or to the next local number."""
+        self.seq = seq if seq is not None and seq > self.seq else self.seq + 1
+        # Swap in a fresh event so every waiter wakes exactly once per frame
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+        return self.seq
+
+    async def wait_newer(self, seq):
+        """Waits until a frame newer than seq exists and returns the newest sequence number."""
+        while self.seq <= seq:
+            await self._event.wait()
+        return self.seq
+
+
+_client_ids = itertools.count(1)
+
+
+class Subscriber:
+    """A WebSocket client with its own bounded send queue and writer task, so it never blocks ingest or other clients."""
+
+    def __init__(self, websocket: WebSocket, channel: "Channel", kind: str, binary: bool = False, width: Optional[int] = None):
+        self.id = next(_client_ids)
+        self.websocket = websocket
+        self.channel = channel
+        self.registry = {
+            "broadcast": channel.broadcast_subscribers,
+            "streaming": channel.streaming_subscribers,
+            "detections": channel.detection_subscribers,
+        }[kind]
+        self.kind = kind
+        self.binary = binary
+        self.width = width  # rendition width, None for the full frame
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=DETECTION_QUEUE_SIZE if kind == "detections" else SUBSCRIBER_QUEUE_SIZE)
+        self.rate = RateMeter()
+        self.bytes_out = 0
+        self.dropped = 0
+        self.consecutive_drops = 0
+        self.closed = False
+        self.task = None
+
+    def start(self):
+        self.registry.append(self)
+        self.task = asyncio.create_task(self._writer())
+
+    def offer(self, frame):
+        """Enqueues a frame (or DetectionMessage) without waiting; drop-oldest when the client is behind."""
+        if self.closed:
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            if self.kind != "detections":
+                self.channel.frames_dropped += 1
+            self.consecutive_drops += 1
+            if self.consecutive_drops >= SLOW_CONSUMER_MAX_DROPS:
+                logger.warning(f"Evicting slow {self.kind} client after {self.consecutive_drops} consecutive dropped frames")
+                self.close(evicted=True)
+                return
+        self.queue.put_nowait(frame)
+
+    async def _writer(self):
+        try:
+            while True:
+                item = await self.queue.get()
+                if self.kind == "detections":
+                    payload = item.text()
+                    await asyncio.wait_for(self.websocket.send_text(payload), SUBSCRIBER_SEND_TIMEOUT)
+                    self.rate.mark()
+                    self.bytes_out += len(payload)
+                    self.consecutive_drops = 0
+                    continue
+                frame = await item.rendition(self.width)
+                if self.binary:
+                    payload = frame.binary()
+                    send = self.websocket.send_bytes(payload)
+                else:
+                    payload = frame.b64()
+                    send = self.websocket.send_text(payload)
+                await asyncio.wait_for(send, SUBSCRIBER_SEND_TIMEOUT)
+                self.rate.mark()
+                self.bytes_out += len(payload)
+                self.consecutive_drops = 0
+                self.channel.record_send(frame, len(payload))
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            logger.warning(f"Evicting slow {self.kind} client: send took longer than {SUBSCRIBER_SEND_TIMEOUT}s")
+            self.close(evicted=True)
+        except WebSocketDisconnect:
+            logger.info(f"{self.kind.capitalize()} client disconnected")
+            self.close()
+        except Exception as e:
+            logger.error(f"Error sending message to {self.kind} client: {e}")
+            self.close()
+
+    def close(self, evicted=False):
+        if self.closed:
+            return
+        self.closed = True
+        if self in self.registry:
+            self.registry.remove(self)
+            logger.debug(f"Removed {self.kind} client. Remaining: {len(self.registry)}")
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+        if evicted:
+            # Closing the socket also ends the endpoint's receive loop
+            asyncio.ensure_future(self._close_socket())
+
+    async def _close_socket(self):
+        try:
+            await self.websocket.close(code=1008)
+        except Exception:
+            pass
+
+    def stats(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "mode": "json" if self.kind == "detections" else "binary" if self.binary else "text",
+            "width": self.width,
+            "fps": round(self.rate.current(), 2),
+            "sent": self.rate.total,
+            "bytes_out": self.bytes_out,
+            "queue_depth": self.queue.qsize(),
+            "dropped": self.dropped,
+        }
+
+
+class MjpegClient:
+    """Egress counters of one /mjpeg_stream client; frames it skipped while lagging count as drops."""
+
+    def __init__(self, channel: "Channel", width: Optional[int] = None):
+        self.id = next(_client_ids)
+        self.channel = channel
+        self.width = width
+        self.rate = RateMeter()
+        self.bytes_out = 0
+        self.dropped = 0
+        self.last_seq = 0
+
+    def record_send(self, frame: Frame, nbytes: int):
+        if self.last_seq:
+            skipped = frame.seq - self.last_seq - 1
+            if skipped > 0:
+                self.dropped += skipped
+                self.channel.frames_dropped += skipped
+        self.last_seq = frame.seq
+        self.rate.mark()
+        self.bytes_out += nbytes
+        self.channel.record_send(frame, nbytes)
+
+    def stats(self):
+        return {
+            "id": self.id,
+            "kind": "mjpeg",
+            "mode": "mjpeg",
+            "width": self.width,
+            "fps": round(self.rate.current(), 2),
+            "sent": self.rate.total,
+            "bytes_out": self.bytes_out,
+            "queue_depth": 0,
+            "dropped": self.dropped,
+        }
+
+
+class Channel:
+    """Relay state of one camera. Publishing touches only this channel's subscribers and counters."""
+
+    def __init__(self, camera_id: str):
+        self.camera_id = camera_id
+        self.latest_frame: Optional[Frame] = None
+        self.notifier = FrameNotifier()
+        # WebSocket subscribers for broadcasting new images (/ws/fire_image)
+        self.broadcast_subscribers: List[Subscriber] = []
+        # WebSocket subscribers for streaming video (/ws/video_stream)
+        self.streaming_subscribers: List[Subscriber] = []
+        self.mjpeg_clients: List[MjpegClient] = []
+        # Detection metadata clients (/ws/detections) and the latest message
+        self.detection_subscribers: List[Subscriber] = []
+        self.latest_detections: Optional[DetectionMessage] = None
+        self.detections_received = RateMeter()
+        # Subscribers hold at most SUBSCRIBER_QUEUE_SIZE queued frames plus the one being sent
+        self.history = FrameHistory(keep_payloads=SUBSCRIBER_QUEUE_SIZE + 1)
+        # وضعیت آخرین دریافت تصویر
+        self.status = {"ok": False, "last_time": None, "seq": None, "capture_time": None}
+        # Metrics
+        self.ingest = RateMeter()
+        self.egress = RateMeter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.frames_dropped = 0
+        self.send_latency = Histogram()  # relay receive -> send complete
+        # Producer control: smoothed egress congestion and the last /last_image poll
+        self.congestion = 0.0
+        self._congestion_mark = (time.monotonic(), 0, 0)
+        self.last_polled = None
+        # Shared-memory store used when several workers serve this channel
+        self.shared_store: Optional[SharedFrameStore] = None
+        self.synced_seq = 0
+        self._sync_task = None
+
+    def attach_shared_store(self):
+        self.shared_store = SharedFrameStore(self.camera_id)
+        # Start one behind so the newest frame already in the store is relayed
+        self.synced_seq = max(0, self.shared_store.latest_seq() - 1)
+        self._sync_task = asyncio.get_running_loop().create_task(self._poll_shared_store())
+
+    def sync_shared_store(self):
+        """Publishes locally the frames that other writers (workers or a same-host producer) put in the shared store."""
+        store = self.shared_store
+        latest = store.latest_seq()
+        if latest <= self.synced_seq:
+            return
+        for seq in range(max(self.synced_seq + 1, latest - store.slots + 1), latest + 1):
+            record = store.read(seq)
+            if record is not None:
+                self._publish_local(self._frame_from_record(record), seq)
+        self.synced_seq = max(self.synced_seq, latest)
+
+    async def _poll_shared_store(self):
+        while True:
+            self.sync_shared_store()
+            # Keeps this worker's audience visible to a same-host producer even without frames
+            self.update_congestion()
+            self.shared_store.report_control(self.viewer_count(), self.congestion)
+            await asyncio.sleep(SHARED_STORE_POLL_INTERVAL)
+
+    @staticmethod
+    def _frame_from_record(record):
+        frame = Frame(record.jpeg, source_seq=record.source_seq, capture_time=record.capture_time, detections=record.detections)
+        frame.received_time = record.received_time
+        frame.received_at -= max(0.0, time.time() - record.received_time)
+        return frame
+
+    def publish(self, frame: Frame):
+        """Records a frame received by this worker, writing it to the shared store first when one is attached."""
+        seq = None
+        if self.shared_store is not None:
+            seq = self.shared_store.write(frame.jpeg, frame.detections, frame.capture_time, frame.received_time, frame.source_seq)
+            if seq is None:
+                logger.warning(f"Frame of {len(frame.jpeg)} bytes does not fit a shared store slot; relayed by this worker only")
+            else:
+                self.synced_seq = max(self.synced_seq, seq)
+                if doorbell_ringer is not None:
+                    doorbell_ringer.ring(self.camera_id)
+        return self._publish_local(frame, seq)
+
+    def _publish_local(self, frame: Frame, seq=None):
+        """Records the newest frame, wakes MJPEG streams and queues it for WebSocket clients without waiting."""
+        frame.camera_id = self.camera_id
+        self.latest_frame = frame
+        frame.seq = self.notifier.notify(seq)
+        self.history.append(frame)
+        self.ingest.mark()
+        self.bytes_in += len(frame.jpeg)
+        now_str = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        self.status["ok"] = True
+        self.status["last_time"] = now_str
+        self.status["seq"] = frame.seq
+        self.status["capture_time"] = frame.capture_time
+        for subscriber in list(self.broadcast_subscribers):
+            subscriber.offer(frame)
+        for subscriber in list(self.streaming_subscribers):
+            subscriber.offer(frame)
+        return now_str
+
+    def publish_detections(self, message: DetectionMessage):
+        """Stores the newest detection message and queues it for /ws/detections clients."""
+        self.detections_received.mark()
+        message.seq = self.detections_received.total
+        self.latest_detections = message
+        # With video publishing off this is the only sign of life from the producer
+        self.status["ok"] = True
+        self.status["last_time"] = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        for subscriber in list(self.detection_subscribers):
+            subscriber.offer(message)
+
+    def record_send(self, frame: Frame, nbytes: int):
+        self.egress.mark()
+        self.bytes_out += nbytes
+        self.send_latency.observe(time.monotonic() - frame.received_at)
+
+    def update_congestion(self):
+        """Folds the share of frames dropped for viewers since the last window into self.congestion."""
+        now = time.monotonic()
+        start, dropped, sent = self._congestion_mark
+        if now - start < CONGESTION_WINDOW:
+            return self.congestion
+        new_dropped = self.frames_dropped - dropped
+        new_sent = self.egress.total - sent
+        sample = new_dropped / (new_dropped + new_sent) if new_dropped + new_sent else 0.0
+        self.congestion = 0.5 * self.congestion + 0.5 * sample
+        self._congestion_mark = (now, self.frames_dropped, self.egress.total)
+        return self.congestion
+
+    def viewer_count(self):
+        recently_polled = self.last_polled is not None and time.monotonic() - self.last_polled < POLL_VIEWER_WINDOW
+        return self.client_count() + (1 if recently_polled else 0)
+
+    def control(self):
+        """Suggested producer settings for this channel's audience, across workers when the shared store is on."""
+        viewers = self.viewer_count()
+        congestion = self.update_congestion()
+        if self.shared_store is not None:
+            self.shared_store.report_control(viewers, congestion)
+            viewers, congestion, _ = self.shared_store.read_control()
+        return producer_control(viewers, congestion)
+
+    def clients(self):
+        return self.broadcast_subscribers + self.streaming_subscribers + self.mjpeg_clients + self.detection_subscribers
+
+    def client_count(self):
+        """Video viewers; detection clients do not need frames."""
+        return len(self.broadcast_subscribers) + len(self.streaming_subscribers) + len(self.mjpeg_clients)
+
+    def stats(self):
+        return {
+            "status": "running" if self.status["ok"] else "idle",
+            "images_received": self.ingest.total,
+            "fps": round(self.ingest.current(), 2),
+            "egress_fps": round(self.egress.current(), 2),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "frames_dropped": self.frames_dropped,
+            "congestion": round(self.congestion, 3),
+            "streaming_clients": len(self.streaming_subscribers),
+            "broadcast_clients": len(self.broadcast_subscribers),
+            "mjpeg_clients": len(self.mjpeg_clients),
+            "detection_clients": len(self.detection_subscribers),
+            "detections_received": self.detections_received.total,
+            # Producer's AdaptiveController settings, from its latest detection message
+            "operating_point": self.operating_point(),
+            "send_latency": self.send_latency.summary_ms(),
+            "clients": [client.stats() for client in self.clients()],
+            "history": self.history.stats(),
+            "last_image_time": self.status["last_time"],
+            "seq": self.status["seq"],
+            "shared_store": self.shared_store.name if self.shared_store is not None else None,
+        }
+
+    def operating_point(self):
+        return self.latest_detections.data.get("operating_point") if self.latest_detections is not None else None
+
+    def write_metrics(self, writer):
+        camera = self.camera_id
+        writer.counter("relay_frames_received_total", "Frames received from producers", self.ingest.total, camera=camera)
+        writer.counter("relay_frames_sent_total", "Frames sent to viewers", self.egress.total, camera=camera)
+        writer.counter("relay_frames_dropped_total", "Frames dropped or skipped for slow viewers", self.frames_dropped, camera=camera)
+        writer.counter("relay_detections_received_total", "Detection messages received from producers", self.detections_received.total, camera=camera)
+        writer.counter("relay_bytes_in_total", "Image bytes received", self.bytes_in, camera=camera)
+        writer.counter("relay_bytes_out_total", "Payload bytes sent to viewers", self.bytes_out, camera=camera)
+        writer.gauge("relay_ingest_fps", "Ingest frames per second", round(self.ingest.current(), 3), camera=camera)
+        writer.gauge("relay_egress_fps", "Egress frames per second, all viewers", round(self.egress.current(), 3), camera=camera)
+        for kind, count in (("broadcast", len(self.broadcast_subscribers)), ("streaming", len(self.streaming_subscribers)), ("mjpeg", len(self.mjpeg_clients)), ("detections", len(self.detection_subscribers))):
+            writer.gauge("relay_clients", "Connected viewers", count, camera=camera, kind=kind)
+        for client in self.clients():
+            stats = client.stats()
+            writer.gauge("relay_client_fps", "Egress frames per second of one viewer", stats["fps"], camera=camera, client=stats["id"], kind=stats["kind"])
+            writer.gauge("relay_client_queue_depth", "Frames waiting in a viewer's send queue", stats["queue_depth"], camera=camera, client=stats["id"], kind=stats["kind"])
+            writer.counter("relay_client_dropped_total", "Frames dropped for one viewer", stats["dropped"], camera=camera, client=stats["id"], kind=stats["kind"])
+        writer.gauge("relay_congestion", "Smoothed share of frames dropped for viewers", round(self.congestion, 3), camera=camera)
+        writer.gauge("relay_history_frames", "Frames held in the history buffer", len(self.history.frames), camera=camera)
+        writer.gauge("relay_history_bytes", "JPEG bytes held in the history buffer", self.history.bytes, camera=camera)
+        operating_point = self.operating_point()
+        if operating_point:
+            writer.gauge("relay_producer_imgsz", "Model input size chosen by the producer's adaptive controller", operating_point["imgsz"], camera=camera)
+            writer.gauge("relay_producer_frame_skip", "Frames skipped between inferences by the adaptive controller", operating_point["frame_skip"], camera=camera)
+            writer.gauge("relay_producer_target_fps", "Inference rate targeted by the adaptive controller", operating_point["target_fps"], camera=camera)
+        writer.histogram("relay_send_latency_seconds", "Time from frame ingest to send completion", self.send_latency, camera=camera)
+
+
+channels: Dict[str, Channel] = {}
+
+doorbell: Optional[Doorbell] = None
+doorbell_ringer: Optional[DoorbellRinger] = None
+
+
+def start_doorbell():
+    """Binds this worker's doorbell so producers and other workers can wake it; no-op without the shared store."""
+    global doorbell, doorbell_ringer
+    if not RELAY_SHARED_STORE or doorbell is not None:
+        return
+    doorbell = Doorbell()
+    doorbell_ringer = DoorbellRinger(exclude=doorbell.path)
+    doorbell.start(asyncio.get_running_loop(), _on_doorbell)
+    logger.info(f"Shared store doorbell listening on {doorbell.path}")
+
+
+def stop_doorbell():
+    global doorbell, doorbell_ringer
+    if doorbell is not None:
+        doorbell.close()
+        doorbell_ringer.close()
+        doorbell = doorbell_ringer = None
+
+
+def _on_doorbell(camera_id):
+    channel = find_channel(camera_id)
+    if channel is not None and channel.shared_store is not None:
+        channel.sync_shared_store()
+
+
+def find_channel(camera_id: str = DEFAULT_CHANNEL) -> Optional[Channel]:
+    """
+    Returns the channel for camera_id, or None while no producer has published to it. With
+    the shared store, a channel created by another worker or a same-host producer is
+    attached on first lookup. Used by viewers, which must not create arbitrary channels;
+    the default channel always exists, so a dashboard may start before Fire_Detection.py.
+    """
+    if camera_id == DEFAULT_CHANNEL:
+        return get_channel(camera_id)
+    channel = channels.get(camera_id)
+    if channel is None and RELAY_SHARED_STORE and store_exists(camera_id):
+        channel = get_channel(camera_id)
+    return channel
+
+
+def get_channel(camera_id: str = DEFAULT_CHANNEL) -> Channel:
+    """
+    Returns the channel for camera_id, creating it on first use. Only producer routes call
+    this: every channel costs a history buffer and, with the shared store, a shared-memory
+    segment, a lock file and a poll task. Must be called from the event loop thread.
+    """
+    channel = channels.get(camera_id)
+    if channel is None:
+        channel = channels[camera_id] = Channel(camera_id)
+        if RELAY_SHARED_STORE:
+            channel.attach_shared_store()
+        logger.info(f"Created channel '{camera_id}' (shared store: {channel.shared_store.name if channel.shared_store else 'off'})")
+    return channel
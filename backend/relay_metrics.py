@@ -0,0 +1,138 @@
+# relay_metrics.py
+# Counters, rate meters and histograms for ws_server.py. All updates happen on the
+# event loop thread, so they are plain attribute updates with no locking.
+import bisect
+import time
+
+START_TIME = time.time()
+
+# Ingest-to-send latency buckets (seconds)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class RateMeter:
+    """Event counter with a per-second rate measured over a short window."""
+
+    __slots__ = ("window", "total", "rate", "_count", "_start")
+
+    def __init__(self, window=1.0):
+        self.window = window
+        self.total = 0
+        self.rate = 0.0
+        self._count = 0
+        self._start = time.monotonic()
+
+    def mark(self, n=1):
+        self.total += n
+        self._count += n
+        now = time.monotonic()
+        elapsed = now - self._start
+        if elapsed >= self.window:
+            self.rate = self._count / elapsed
+            self._count = 0
+            self._start = now
+
+    def current(self):
+        """Rate per second; falls to zero once no event was seen for two windows."""
+        if time.monotonic() - self._start >= 2 * self.window:
+            return 0.0
+        return self.rate
+
+
+class Histogram:
+    """Fixed-bucket histogram (Prometheus layout) with bucket-interpolated quantiles."""
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def summary_ms(self):
+        """p50/p95/p99 and mean in milliseconds for /stats."""
+        def ms(value):
+            return round(value * 1000, 2) if value is not None else None
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.sum / self.count) if self.count else None,
+            "p50_ms": ms(self.quantile(0.50)),
+            "p95_ms": ms(self.quantile(0.95)),
+            "p99_ms": ms(self.quantile(0.99)),
+        }
+
+
+def uptime_seconds():
+    return time.time() - START_TIME
+
+
+def format_uptime(seconds):
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if days:
+        return f"{days}d {hours:02d}:{minutes:02d}:{seconds:02d}"
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+def _label_value(value):
+    """Escapes a label value as the text exposition format requires (backslash, quote, newline)."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_label_value(value)}"' for key, value in labels.items()) + "}"
+
+
+class MetricsWriter:
+    """Builds the Prometheus text exposition format; samples are grouped per metric family."""
+
+    def __init__(self):
+        self._families = {}
+
+    def _family(self, name, kind, help_text):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        return family
+
+    def counter(self, name, help_text, value, **labels):
+        self._family(name, "counter", help_text).append(f"{name}{_labels(labels)} {value}")
+
+    def gauge(self, name, help_text, value, **labels):
+        self._family(name, "gauge", help_text).append(f"{name}{_labels(labels)} {value}")
+
+    def histogram(self, name, help_text, histogram, **labels):
+        family = self._family(name, "histogram", help_text)
+        cumulative = 0
+        for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+            cumulative += bucket_count
+            family.append(f"{name}_bucket{_labels(dict(labels, le=bound))} {cumulative}")
+        family.append(f"{name}_bucket{_labels(dict(labels, le='+Inf'))} {histogram.count}")
+        family.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+        family.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+    def render(self):
+        return "\n".join(line for family in self._families.values() for line in family) + "\n"
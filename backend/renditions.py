@@ -0,0 +1,36 @@
+# renditions.py
+# Downscaled copies of relayed frames for thumbnails and grid tiles. A rendition is built
+# at most once per frame, and only when a client asked for that width (see Frame.rendition).
+import os
+
+import cv2
+import numpy as np
+
+# Widths clients can pick with ?width=; other values are rounded up to the next rendition
+RENDITION_WIDTHS = tuple(sorted(int(w) for w in os.environ.get("RELAY_RENDITIONS", "640,320").split(",") if w.strip()))
+RENDITION_JPEG_QUALITY = int(os.environ.get("RENDITION_JPEG_QUALITY", 75))
+
+
+def rendition_width(value):
+    """Maps a ?width= query value to a rendition width; None means the full frame."""
+    if value in (None, "", "full"):
+        return None
+    try:
+        requested = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"width must be 'full' or one of {', '.join(map(str, RENDITION_WIDTHS))}")
+    for width in RENDITION_WIDTHS:
+        if width >= requested:
+            return width
+    return None  # larger than every rendition
+
+
+def scale_jpeg(jpeg, width):
+    """JPEG downscaled to width, or None when the frame is already that narrow or cannot be decoded."""
+    image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None or image.shape[1] <= width:
+        return None
+    height = max(1, round(image.shape[0] * width / image.shape[1]))
+    resized = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode(".jpg", resized, [int(cv2.IMWRITE_JPEG_QUALITY), RENDITION_JPEG_QUALITY])
+    return buffer.tobytes() if ok else None
@@ -0,0 +1,289 @@
+# shm_frame_store.py
+# Per-channel ring of encoded frames in POSIX shared memory, so several ws_server
+# workers (uvicorn --workers N) on one host see the same frames.
+#
+# Layout: a store header, a small table where relay workers report their viewer count and
+# egress congestion (read by a same-host producer, see Fire_Detection.PublishControl),
+# then `slots` fixed-size slots. Each slot starts with a
+# seqlock counter that is odd while the slot is being written; readers copy the slot
+# and retry when the counter was odd or changed underneath them. Writers are
+# serialised with an flock on a per-channel lock file.
+#
+# Doorbells: every relay worker binds a Unix datagram socket in SHARED_STORE_DOORBELL_DIR.
+# Whoever writes a frame (a worker that got it over HTTP, or Fire_Detection.py writing
+# directly with FRAME_TRANSPORT=shm) sends the camera id to those sockets, so readers
+# wake up immediately instead of polling.
+import fcntl
+import glob
+import hashlib
+import os
+import re
+import socket
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+SHARED_STORE_SLOTS = int(os.environ.get("SHARED_STORE_SLOTS", 8))
+SHARED_STORE_SLOT_BYTES = int(os.environ.get("SHARED_STORE_SLOT_BYTES", 2 * 1024 * 1024))
+SHARED_STORE_LOCK_DIR = os.environ.get("SHARED_STORE_LOCK_DIR", "/tmp")
+SHARED_STORE_DOORBELL_DIR = os.environ.get("SHARED_STORE_DOORBELL_DIR", "/tmp/fire_relay_doorbells")
+
+STORE_MAGIC = b"FRS2"
+# magic, slot count, slot payload size, latest committed sequence number
+STORE_HEADER = struct.Struct("=4sIIQ")
+STORE_SEQ_OFFSET = 12
+# worker pid, viewers, congestion (0-1), report time (epoch seconds)
+CONTROL_ENTRY = struct.Struct("=IIdd")
+CONTROL_OFFSET = 64
+CONTROL_ENTRIES = 16
+# Reports older than this belong to workers that have exited
+CONTROL_STALE_AFTER = 5.0
+STORE_HEADER_SIZE = CONTROL_OFFSET + CONTROL_ENTRIES * CONTROL_ENTRY.size
+# seqlock counter, sequence number, payload length, detection count, capture time,
+# receive time (epoch seconds), producer sequence number
+SLOT_HEADER = struct.Struct("=QQIHxxddQ")
+SLOT_HEADER_SIZE = 64
+COUNTER = struct.Struct("=Q")
+
+READ_RETRIES = 16
+
+
+def segment_name(camera_id):
+    """Shared memory name for a channel; unsafe characters are replaced and a hash keeps names unique."""
+    safe = re.sub(r"[^A-Za-z0-9_-]", "_", camera_id)[:40]
+    digest = hashlib.sha1(camera_id.encode("utf-8")).hexdigest()[:8]
+    return f"fire_relay_{safe}_{digest}"
+
+
+def _untrack(shm):
+    # The segment outlives any single worker; stop the resource tracker from unlinking it
+    # when the process that opened it exits.
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+
+
+def store_exists(camera_id):
+    """Whether some process already created the shared store of a channel."""
+    try:
+        shm = shared_memory.SharedMemory(name=segment_name(camera_id))
+    except FileNotFoundError:
+        return False
+    _untrack(shm)
+    shm.close()
+    return True
+
+
+class FrameRecord:
+    __slots__ = ("seq", "jpeg", "detections", "capture_time", "received_time", "source_seq")
+
+    def __init__(self, seq, jpeg, detections, capture_time, received_time, source_seq):
+        self.seq = seq
+        self.jpeg = jpeg
+        self.detections = detections
+        self.capture_time = capture_time
+        self.received_time = received_time
+        self.source_seq = source_seq
+
+
+class SharedFrameStore:
+    """Create-or-attach ring of frames for one channel."""
+
+    def __init__(self, camera_id, slots=SHARED_STORE_SLOTS, slot_bytes=SHARED_STORE_SLOT_BYTES):
+        self.camera_id = camera_id
+        self.name = segment_name(camera_id)
+        size = STORE_HEADER_SIZE + slots * (SLOT_HEADER_SIZE + slot_bytes)
+        try:
+            self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+            STORE_HEADER.pack_into(self.shm.buf, 0, STORE_MAGIC, slots, slot_bytes, 0)
+        except FileExistsError:
+            self.shm = shared_memory.SharedMemory(name=self.name)
+            slots, slot_bytes = self._wait_for_header()
+        _untrack(self.shm)
+        self.buf = self.shm.buf
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self._lock_fd = os.open(os.path.join(SHARED_STORE_LOCK_DIR, f"{self.name}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        self._control_index = None
+
+    def _wait_for_header(self):
+        # The creating process may not have written the header yet
+        for _ in range(100):
+            magic, slots, slot_bytes, _ = STORE_HEADER.unpack_from(self.shm.buf, 0)
+            if magic == STORE_MAGIC:
+                return slots, slot_bytes
+            if magic.startswith(b"FRS"):
+                raise ValueError(f"Shared memory segment {self.name} has an older layout ({magic!r}); remove /dev/shm/{self.name}")
+            time.sleep(0.001)
+        raise ValueError(f"Shared memory segment {self.name} has no frame store header")
+
+    def _slot_offset(self, seq):
+        return STORE_HEADER_SIZE + (seq % self.slots) * (SLOT_HEADER_SIZE + self.slot_bytes)
+
+    def latest_seq(self):
+        return COUNTER.unpack_from(self.buf, STORE_SEQ_OFFSET)[0]
+
+    def write(self, jpeg, detections=0, capture_time=None, received_time=None, source_seq=None):
+        """
+        Stores one frame and returns its channel-wide sequence number, or None if it does not fit a slot.
+        jpeg may be any contiguous buffer, e.g. the (N, 1) array from cv2.imencode.
+        """
+        jpeg = memoryview(jpeg).cast("B")
+        length = len(jpeg)
+        if length > self.slot_bytes:
+            return None
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            seq = self.latest_seq() + 1
+            offset = self._slot_offset(seq)
+            counter = COUNTER.unpack_from(self.buf, offset)[0]
+            COUNTER.pack_into(self.buf, offset, counter + 1)  # odd: write in progress
+            data_offset = offset + SLOT_HEADER_SIZE
+            self.buf[data_offset:data_offset + length] = jpeg
+            SLOT_HEADER.pack_into(self.buf, offset, counter + 1, seq, length, detections,
+                                  capture_time or 0.0, received_time or time.time(), source_seq or 0)
+            COUNTER.pack_into(self.buf, offset, counter + 2)  # even: slot is consistent
+            COUNTER.pack_into(self.buf, STORE_SEQ_OFFSET, seq)
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        return seq
+
+    def read(self, seq):
+        """Copies frame seq out of its slot; None if it was already overwritten or is still being written."""
+        offset = self._slot_offset(seq)
+        for _ in range(READ_RETRIES):
+            before = COUNTER.unpack_from(self.buf, offset)[0]
+            if before & 1:
+                continue
+            _, slot_seq, length, detections, capture_time, received_time, source_seq = SLOT_HEADER.unpack_from(self.buf, offset)
+            if slot_seq != seq:
+                return None
+            data_offset = offset + SLOT_HEADER_SIZE
+            jpeg = bytes(self.buf[data_offset:data_offset + length])
+            if COUNTER.unpack_from(self.buf, offset)[0] == before:
+                return FrameRecord(seq, jpeg, detections, capture_time or None, received_time, source_seq)
+        return None
+
+    def _control_entries(self):
+        for index in range(CONTROL_ENTRIES):
+            yield index, CONTROL_ENTRY.unpack_from(self.buf, CONTROL_OFFSET + index * CONTROL_ENTRY.size)
+
+    def report_control(self, viewers, congestion):
+        """Records this worker's viewer count and egress congestion for read_control()."""
+        pid = os.getpid()
+        now = time.time()
+        if self._control_index is None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                # Reuse our own entry, otherwise claim an empty or stale one
+                for index, (entry_pid, _, _, updated) in self._control_entries():
+                    if entry_pid == pid:
+                        self._control_index = index
+                        break
+                    if self._control_index is None and (entry_pid == 0 or now - updated > CONTROL_STALE_AFTER):
+                        self._control_index = index
+                if self._control_index is None:
+                    return
+                CONTROL_ENTRY.pack_into(self.buf, CONTROL_OFFSET + self._control_index * CONTROL_ENTRY.size, pid, viewers, congestion, now)
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            return
+        CONTROL_ENTRY.pack_into(self.buf, CONTROL_OFFSET + self._control_index * CONTROL_ENTRY.size, pid, viewers, congestion, now)
+
+    def read_control(self):
+        """(viewers summed over workers, worst congestion, reporting workers) from recent reports."""
+        now = time.time()
+        viewers, congestion, workers = 0, 0.0, 0
+        for _, (entry_pid, entry_viewers, entry_congestion, updated) in self._control_entries():
+            if entry_pid and now - updated <= CONTROL_STALE_AFTER:
+                viewers += entry_viewers
+                congestion = max(congestion, entry_congestion)
+                workers += 1
+        return viewers, congestion, workers
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        os.close(self._lock_fd)
+
+
+class Doorbell:
+    """Relay side: a non-blocking Unix datagram socket that receives camera ids of new frames."""
+
+    def __init__(self, directory=SHARED_STORE_DOORBELL_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"relay-{os.getpid()}.sock")
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sock.setblocking(False)
+        self._loop = None
+
+    def start(self, loop, callback):
+        """Calls callback(camera_id) on the event loop for every ring."""
+        self._loop = loop
+        loop.add_reader(self.sock.fileno(), self._on_readable, callback)
+
+    def _on_readable(self, callback):
+        while True:
+            try:
+                data = self.sock.recv(512)
+            except (BlockingIOError, InterruptedError):
+                return
+            callback(data.decode("utf-8", "replace"))
+
+    def close(self):
+        if self._loop is not None:
+            self._loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class DoorbellRinger:
+    """Writer side: sends a camera id to every relay worker's doorbell (optionally except our own)."""
+
+    REFRESH_INTERVAL = 1.0
+
+    def __init__(self, directory=SHARED_STORE_DOORBELL_DIR, exclude=None):
+        self.directory = directory
+        self.exclude = exclude
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self._targets = []
+        self._refreshed = 0.0
+
+    def targets(self):
+        now = time.monotonic()
+        if now - self._refreshed >= self.REFRESH_INTERVAL:
+            self._targets = [path for path in glob.glob(os.path.join(self.directory, "*.sock")) if path != self.exclude]
+            self._refreshed = now
+        return self._targets
+
+    def ring(self, camera_id):
+        """Returns how many doorbells were reached."""
+        payload = camera_id.encode("utf-8")
+        reached = 0
+        for path in self.targets():
+            try:
+                self.sock.sendto(payload, path)
+                reached += 1
+            except BlockingIOError:
+                reached += 1  # the worker has unread rings queued, it will sync anyway
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Worker is gone; drop its stale socket
+                self._targets = [target for target in self._targets if target != path]
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+        return reached
+
+    def close(self):
+        self.sock.close()
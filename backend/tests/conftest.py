@@ -0,0 +1,6 @@
+# conftest.py
+# The backend modules import each other as top-level modules (python Fire_Detection.py, uvicorn ws_server:app)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,123 @@
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import pytest
+
+from batching import MicroBatcher
+
+
+class FakeModel:
+    """Batched model call: returns one result per image and records the batch sizes."""
+
+    def __init__(self, delay=0.0, release=None):
+        self.delay = delay
+        self.release = release
+        self.batches = []
+
+    def __call__(self, images, verbose=False):
+        if self.release is not None:
+            self.release.wait(5)
+        time.sleep(self.delay)
+        self.batches.append(list(images))
+        return [f"result-{image}" for image in images]
+
+
+class FakePool:
+    """The parts of model_config.ModelPool that MicroBatcher uses."""
+
+    def __init__(self, model, replicas=1):
+        self.model = model
+        self.replicas = replicas
+
+    def __contains__(self, model_name):
+        return model_name == "Model"
+
+    def replica(self, model_name):
+        pool = self
+
+        class Checkout:
+            def __enter__(self):
+                return pool.model
+
+            def __exit__(self, *exc):
+                return False
+
+        return Checkout()
+
+
+def submit_all(batcher, images):
+    results = [None] * len(images)
+
+    def run(i):
+        results[i] = batcher.submit("Model", images[i])
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(images))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_requests_are_gathered_into_batches():
+    model = FakeModel()
+    batcher = MicroBatcher(FakePool(model), max_batch_size=4, max_wait=0.2, timeout=5)
+    assert submit_all(batcher, list(range(8))) == [f"result-{i}" for i in range(8)]
+    assert all(len(batch) <= 4 for batch in model.batches)
+    assert len(model.batches) < 8
+    assert batcher.stats()["requests"] == 8
+
+
+def test_a_lone_request_runs_after_max_wait():
+    batcher = MicroBatcher(FakePool(FakeModel()), max_batch_size=8, max_wait=0.05, timeout=5)
+    started = time.time()
+    assert batcher.submit("Model", 1) == "result-1"
+    assert time.time() - started < 1
+
+
+def test_unknown_models_are_rejected():
+    batcher = MicroBatcher(FakePool(FakeModel()))
+    with pytest.raises(KeyError):
+        batcher.submit("Other", 1)
+
+
+def test_timed_out_queued_request_is_cancelled_and_never_run():
+    release = threading.Event()
+    model = FakeModel(release=release)
+    batcher = MicroBatcher(FakePool(model), max_batch_size=1, max_wait=0, timeout=5)
+    busy = batcher.enqueue("Model", "busy")  # holds the only worker until released
+    while not busy.running():
+        time.sleep(0.001)
+    with pytest.raises(FutureTimeout):
+        batcher.submit("Model", "late", timeout=0.05)
+    release.set()
+    assert batcher.result(busy) == "result-busy"
+    assert batcher.submit("Model", "next") == "result-next"
+    assert ["late"] not in model.batches
+    assert batcher.stats()["cancelled"] == 1
+
+
+def test_timed_out_running_request_is_not_cancelled():
+    release = threading.Event()
+    batcher = MicroBatcher(FakePool(FakeModel(release=release)), max_batch_size=1, max_wait=0, timeout=5)
+    future = batcher.enqueue("Model", "slow")
+    while not future.running():
+        time.sleep(0.001)
+    with pytest.raises(FutureTimeout):
+        batcher.result(future, timeout=0.05)
+    assert not future.cancelled()
+    release.set()
+    assert future.result(5) == "result-slow"
+    assert batcher.stats()["cancelled"] == 0
+
+
+def test_failed_batches_fail_their_requests():
+    class Broken:
+        def __call__(self, images, verbose=False):
+            raise RuntimeError("boom")
+
+    batcher = MicroBatcher(FakePool(Broken()), max_wait=0, timeout=5)
+    with pytest.raises(RuntimeError, match="boom"):
+        batcher.submit("Model", 1)
+    assert batcher.stats()["failed_batches"] == 1
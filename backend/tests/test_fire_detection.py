@@ -0,0 +1,98 @@
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+pytest.importorskip("torch")
+pytest.importorskip("ultralytics")
+pytest.importorskip("requests")
+
+from Fire_Detection import AdaptiveController, MotionGate  # noqa: E402
+
+
+def controller(**kwargs):
+    # interval=0: every third latency sample closes a window
+    options = dict(imgsz=320, max_fps=30, slo=0.1, sizes=[256, 320, 416], max_skip=2, min_fps=10, interval=0, headroom=0.5)
+    options.update(kwargs)
+    return AdaptiveController(**options)
+
+
+def record_window(adaptive, latency):
+    for _ in range(3):
+        adaptive.record(latency)
+
+
+def test_adaptive_steps_down_size_then_skip_then_fps():
+    adaptive = controller()
+    record_window(adaptive, 0.2)
+    assert (adaptive.imgsz, adaptive.skip, adaptive.fps) == (256, 0, 30)
+    record_window(adaptive, 0.2)
+    record_window(adaptive, 0.2)
+    assert (adaptive.imgsz, adaptive.skip, adaptive.fps) == (256, 2, 30)
+    record_window(adaptive, 0.2)
+    assert adaptive.fps == pytest.approx(22.5)
+    for _ in range(10):
+        record_window(adaptive, 0.2)
+    assert adaptive.fps == 10  # floor
+    assert adaptive.operating_point()["latency_ms"] == 200.0
+
+
+def test_adaptive_steps_up_in_reverse_order():
+    adaptive = controller()
+    adaptive.imgsz, adaptive.skip, adaptive.fps = 256, 1, 15
+    record_window(adaptive, 0.01)
+    assert (adaptive.imgsz, adaptive.skip) == (256, 1) and adaptive.fps > 15
+    while adaptive.fps < 30:
+        record_window(adaptive, 0.01)
+    record_window(adaptive, 0.01)
+    assert (adaptive.imgsz, adaptive.skip) == (256, 0)
+    record_window(adaptive, 0.01)
+    record_window(adaptive, 0.01)
+    record_window(adaptive, 0.01)
+    assert adaptive.imgsz == 416  # largest size, nothing left to undo
+
+
+def test_adaptive_holds_inside_the_band():
+    adaptive = controller()
+    record_window(adaptive, 0.07)
+    assert adaptive.adjustments == 0
+
+
+def test_adaptive_frame_skip():
+    adaptive = controller()
+    adaptive.skip = 2
+    assert [adaptive.should_infer() for _ in range(6)] == [False, False, True, False, False, True]
+    assert adaptive.skipped == 4
+
+
+def frame(value):
+    return np.full((120, 160, 3), value, dtype=np.uint8)
+
+
+def test_motion_gate_skips_unchanged_frames():
+    gate = MotionGate(threshold=0.01, pixel_delta=25, force_interval=60)
+    assert gate.should_infer(frame(0))  # first frame is the reference
+    assert not gate.should_infer(frame(10))  # below pixel_delta
+    assert gate.should_infer(frame(200))
+    assert gate.snapshot()["skipped"] == 1
+
+
+def test_motion_gate_threshold_is_a_share_of_pixels():
+    gate = MotionGate(threshold=0.5, pixel_delta=25, force_interval=60)
+    gate.should_infer(frame(0))
+    small_change = frame(0)
+    small_change[:30] = 255  # a quarter of the frame
+    assert not gate.should_infer(small_change)
+    large_change = frame(0)
+    large_change[:90] = 255
+    assert gate.should_infer(large_change)
+
+
+def test_motion_gate_forces_an_inference_after_the_interval():
+    gate = MotionGate(threshold=0.01, pixel_delta=25, force_interval=0.05)
+    gate.should_infer(frame(0))
+    assert not gate.should_infer(frame(0))
+    time.sleep(0.06)
+    assert gate.should_infer(frame(0))
+    assert gate.forced == 1
@@ -0,0 +1,101 @@
+import time
+import weakref
+
+import pytest
+
+from frame_history import FrameHistory
+
+
+class FakeFrame:
+    """The parts of relay_channels.Frame that FrameHistory uses."""
+
+    def __init__(self, seq, size, received_time):
+        self.seq = seq
+        self.jpeg = b"x" * size
+        self.received_time = received_time
+        self.released = False
+
+    def release_payloads(self):
+        self.released = True
+
+
+@pytest.fixture(autouse=True)
+def isolated_histories(monkeypatch):
+    # Limits are shared by every FrameHistory in the process
+    monkeypatch.setattr(FrameHistory, "_instances", weakref.WeakSet())
+    monkeypatch.setattr(FrameHistory, "total_bytes", 0)
+
+
+def fill(history, count, size=10, start=None, step=1.0, first_seq=1):
+    start = time.time() - count * step if start is None else start
+    frames = [FakeFrame(first_seq + i, size, start + i * step) for i in range(count)]
+    for frame in frames:
+        history.append(frame)
+    return frames
+
+
+def test_evicts_beyond_max_bytes_oldest_first():
+    history = FrameHistory(max_bytes=50, max_age=3600)
+    frames = fill(history, 8)
+    assert list(history.frames) == frames[-5:]
+    assert history.bytes == 50
+    assert history.evicted == 3
+
+
+def test_evicts_by_age_but_keeps_the_latest_frame():
+    history = FrameHistory(max_bytes=10_000, max_age=5)
+    frames = fill(history, 10)
+    assert [frame.seq for frame in history.frames] == [frame.seq for frame in frames if time.time() - frame.received_time <= 5]
+    history.evict(now=time.time() + 3)
+    assert len(history.frames) == 1
+    history.evict(now=time.time() + 10)
+    assert len(history.frames) == 0  # even the latest frame goes once it is older than max_age
+
+
+def test_global_cap_drops_the_oldest_frame_of_any_channel():
+    idle = FrameHistory(max_bytes=10_000, max_age=3600)
+    busy = FrameHistory(max_bytes=10_000, max_age=3600)
+    now = time.time()
+    fill(idle, 3, start=now - 100)
+    fill(busy, 3, start=now - 10, first_seq=100)
+    FrameHistory.evict_all(max_total_bytes=40)
+    assert len(idle.frames) == 1  # its oldest frames went first, its latest is kept
+    assert len(busy.frames) == 3
+    assert FrameHistory.total_bytes == 40
+
+
+def test_append_ages_out_idle_channels():
+    idle = FrameHistory(max_bytes=10_000, max_age=5)
+    busy = FrameHistory(max_bytes=10_000, max_age=5)
+    fill(idle, 3, start=time.time() - 4.9, step=0.3)
+    time.sleep(0.3)  # idle's oldest frames age out; its newest is younger than max_age
+    busy.append(FakeFrame(1, 10, time.time()))
+    assert len(idle.frames) == 2
+    assert FrameHistory.total_bytes == 30
+
+
+def test_range_queries_by_receive_time():
+    history = FrameHistory(max_bytes=10_000, max_age=3600)
+    start = time.time() - 100
+    frames = fill(history, 10, start=start)
+    assert history.range() == frames
+    assert history.range(since=start + 2, until=start + 5) == frames[2:6]
+    assert history.range(since=start + 2.5) == frames[3:]
+    assert history.range(until=start - 1) == []
+    assert history.range(since=start + 2, limit=3) == frames[-3:]
+
+
+def test_get_by_seq():
+    history = FrameHistory(max_bytes=30, max_age=3600)
+    frames = fill(history, 5)
+    assert history.get(5) is frames[-1]
+    assert history.get(3) is frames[2]
+    assert history.get(1) is None  # evicted
+
+
+def test_only_recent_frames_keep_their_payloads():
+    history = FrameHistory(max_bytes=10_000, max_age=3600, keep_payloads=3)
+    frames = fill(history, 6)
+    assert [frame.released for frame in frames] == [True, True, True, False, False, False]
+    history.release_payloads(frames[-1])
+    assert not frames[-1].released
@@ -0,0 +1,52 @@
+import struct
+
+import pytest
+
+from frame_protocol import (HEADER, MAGIC, VERSION, pack_frame, pack_stream_frame, unpack_frame,
+                            unpack_stream_frame)
+
+
+def test_frame_round_trip():
+    message = pack_frame("gate", 42, 1700000000.5, b"\xff\xd8jpeg\xff\xd9", detections=3)
+    camera_id, seq, timestamp, detections, jpeg = unpack_frame(message)
+    assert (camera_id, seq, timestamp, detections, bytes(jpeg)) == ("gate", 42, 1700000000.5, 3, b"\xff\xd8jpeg\xff\xd9")
+
+
+def test_frame_round_trip_accepts_buffers_and_utf8_camera_ids():
+    message = pack_frame("دوربین-۱", 1, 0.0, memoryview(bytearray(b"jpeg")))
+    camera_id, _, _, detections, jpeg = unpack_frame(memoryview(message))
+    assert camera_id == "دوربین-۱"
+    assert detections == 0
+    assert bytes(jpeg) == b"jpeg"
+
+
+def test_unpack_rejects_other_versions():
+    message = HEADER.pack(MAGIC, VERSION + 1, 4, 1, 0.0, 0) + b"gate" + b"jpeg"
+    with pytest.raises(ValueError, match="Unsupported frame header"):
+        unpack_frame(message)
+
+
+def test_unpack_rejects_bad_magic():
+    message = HEADER.pack(b"XX", VERSION, 4, 1, 0.0, 0) + b"gate" + b"jpeg"
+    with pytest.raises(ValueError, match="Unsupported frame header"):
+        unpack_frame(message)
+
+
+def test_unpack_rejects_truncated_frames():
+    message = pack_frame("gate", 1, 0.0, b"jpeg")
+    with pytest.raises(ValueError):
+        unpack_frame(message[:HEADER.size - 1])
+    with pytest.raises(ValueError, match="no image payload"):
+        unpack_frame(message[:HEADER.size + len("gate")])
+
+
+def test_pack_rejects_long_camera_ids():
+    with pytest.raises(ValueError):
+        pack_frame("x" * 256, 1, 0.0, b"jpeg")
+
+
+def test_stream_frame_round_trip():
+    seq, timestamp, detections, jpeg = unpack_stream_frame(pack_stream_frame(7, 12.25, 2, b"jpeg"))
+    assert (seq, timestamp, detections, bytes(jpeg)) == (7, 12.25, 2, b"jpeg")
+    with pytest.raises(ValueError):
+        unpack_stream_frame(struct.pack("!QdH", 7, 12.25, 2))
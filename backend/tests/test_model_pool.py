@@ -0,0 +1,44 @@
+import threading
+
+import pytest
+
+from model_config import ModelPool, ModelPoolTimeout
+
+
+def test_checkout_hands_out_each_replica_once():
+    pool = ModelPool(replicas=2, timeout=1)
+    pool.add_replicas("Model", ["replica-a", "replica-b"])
+    first = pool.checkout("Model")
+    second = pool.checkout("Model")
+    assert {first, second} == {"replica-a", "replica-b"}
+    assert pool.stats()["Model"]["in_use"] == 2
+    pool.checkin("Model", first)
+    assert pool.checkout("Model") == first
+
+
+def test_checkout_times_out_when_every_replica_is_busy():
+    pool = ModelPool(replicas=1, timeout=5)
+    pool.add_replicas("Model", ["replica"])
+    with pool.replica("Model"):
+        with pytest.raises(ModelPoolTimeout):
+            pool.checkout("Model", timeout=0.05)
+    assert pool.stats()["Model"]["timeouts"] == 1
+    assert pool.stats()["Model"]["in_use"] == 0
+    assert pool.checkout("Model", timeout=0.05) == "replica"
+
+
+def test_checkout_waits_for_a_checkin():
+    pool = ModelPool(replicas=1, timeout=5)
+    pool.add_replicas("Model", ["replica"])
+    model = pool.checkout("Model")
+    timer = threading.Timer(0.05, pool.checkin, args=("Model", model))
+    timer.start()
+    assert pool.checkout("Model", timeout=2) == "replica"
+    timer.join()
+
+
+def test_unknown_models_are_rejected():
+    pool = ModelPool()
+    assert "Model" not in pool
+    with pytest.raises(KeyError):
+        pool.checkout("Model")
@@ -0,0 +1,100 @@
+import os
+import threading
+import uuid
+
+import pytest
+
+import shm_frame_store
+from shm_frame_store import SharedFrameStore
+
+
+@pytest.fixture
+def make_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(shm_frame_store, "SHARED_STORE_LOCK_DIR", str(tmp_path))
+    stores = []
+
+    def make(camera_id=None, **kwargs):
+        store = SharedFrameStore(camera_id or f"test-{uuid.uuid4().hex[:8]}", **kwargs)
+        stores.append(store)
+        return store
+
+    yield make
+    names = {store.name for store in stores}
+    for store in stores:
+        store.close()
+    for name in names:
+        # Stores are untracked on purpose (they outlive a worker), so the test removes them itself
+        try:
+            os.unlink(f"/dev/shm/{name}")
+        except FileNotFoundError:
+            pass
+
+
+def test_write_then_read(make_store):
+    store = make_store(slots=4, slot_bytes=64)
+    seq = store.write(b"jpeg-1", detections=2, capture_time=10.5, received_time=11.0, source_seq=7)
+    assert seq == 1
+    assert store.latest_seq() == 1
+    record = store.read(seq)
+    assert (record.seq, record.jpeg, record.detections, record.capture_time, record.received_time, record.source_seq) == \
+        (1, b"jpeg-1", 2, 10.5, 11.0, 7)
+
+
+def test_frames_too_large_for_a_slot_are_refused(make_store):
+    store = make_store(slots=2, slot_bytes=8)
+    assert store.write(b"x" * 9) is None
+    assert store.latest_seq() == 0
+
+
+def test_ring_wraps_around(make_store):
+    store = make_store(slots=3, slot_bytes=16)
+    for i in range(1, 8):
+        assert store.write(f"frame-{i}".encode()) == i
+    assert store.read(4) is None  # overwritten by frame 7
+    assert [store.read(seq).jpeg for seq in (5, 6, 7)] == [b"frame-5", b"frame-6", b"frame-7"]
+
+
+def test_second_store_attaches_to_the_same_ring(make_store):
+    writer = make_store(slots=4, slot_bytes=32)
+    reader = make_store(writer.camera_id, slots=99, slot_bytes=1)
+    assert (reader.slots, reader.slot_bytes) == (4, 32)  # layout comes from the header
+    seq = writer.write(b"shared")
+    assert reader.latest_seq() == seq
+    assert reader.read(seq).jpeg == b"shared"
+
+
+def test_read_retries_while_a_slot_is_being_written(make_store):
+    store = make_store(slots=2, slot_bytes=16)
+    seq = store.write(b"stable")
+    offset = store._slot_offset(seq)
+    counter = shm_frame_store.COUNTER.unpack_from(store.buf, offset)[0]
+    shm_frame_store.COUNTER.pack_into(store.buf, offset, counter + 1)  # odd: a writer is inside the slot
+    assert store.read(seq) is None
+    shm_frame_store.COUNTER.pack_into(store.buf, offset, counter + 2)
+    assert store.read(seq).jpeg == b"stable"
+
+
+def test_concurrent_writer_never_yields_torn_frames(make_store):
+    writer = make_store(slots=2, slot_bytes=256)
+    reader = make_store(writer.camera_id)
+    stop = threading.Event()
+
+    def write():
+        i = 0
+        while not stop.is_set():
+            i += 1
+            writer.write(bytes([i % 256]) * (64 + i % 128))
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    try:
+        seen = 0
+        while seen < 500:
+            record = reader.read(reader.latest_seq())
+            if record is None or not record.jpeg:
+                continue
+            assert record.jpeg == record.jpeg[:1] * len(record.jpeg)
+            seen += 1
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,266 @@
+# video_jobs.py
+# Background processing of uploaded videos. POST /api/v1/process/video queues a job and
+# returns its id straight away; a bounded pool of worker threads runs process_video() and
+# keeps the job's status file (<RESULTS_FOLDER>/jobs/<id>.json) up to date. Status, progress
+# and cancellation go through those files, so any gunicorn worker can answer for any job.
+#
+# Jobs run in threads of the gunicorn worker that accepted the upload. That worker must
+# not be a sync worker: a long request (the SSE progress stream) would get it killed at
+# --timeout together with its jobs; backend/gunicorn.conf.py selects threaded workers.
+# VIDEO_JOB_WORKERS is a host-wide limit (flock'ed slot files shared by all processes), and
+# jobs whose process died are reported as failed the next time anyone reads them.
+import fcntl
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+
+from video_processing import process_video, VideoProcessingCancelled
+
+logger = logging.getLogger(__name__)
+
+# Videos processed at the same time on this host, across all gunicorn workers
+VIDEO_JOB_WORKERS = int(os.environ.get("VIDEO_JOB_WORKERS", 1))
+# Jobs waiting for a slot in one worker process; further uploads to it are refused until one starts
+VIDEO_JOB_QUEUE_SIZE = int(os.environ.get("VIDEO_JOB_QUEUE_SIZE", 8))
+# Longest video accepted, in seconds of video (0 = no limit)
+VIDEO_JOB_MAX_DURATION = float(os.environ.get("VIDEO_JOB_MAX_DURATION", 600))
+# How often a running job rewrites its status file and looks for a cancel request (seconds)
+STATUS_WRITE_INTERVAL = 0.5
+# A running job whose status file was not rewritten for this long has stopped (seconds)
+STALE_AFTER = 60.0
+
+FINISHED_STATES = ("done", "failed", "cancelled")
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class JobQueueFull(Exception):
+    """Every worker is busy and the job queue is full."""
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # exists, owned by someone else
+    return True
+
+
+def orphaned(status):
+    """Whether a queued/running job lost the process that was working on it."""
+    if status["status"] in FINISHED_STATES:
+        return False
+    if not _process_alive(status.get("pid", 0)):
+        return True
+    return status["status"] == "running" and time.time() - status.get("updated", 0) > STALE_AFTER
+
+
+class VideoJob:
+    def __init__(self, job_id, video_path, filename, jobs_folder):
+        self.id = job_id
+        self.video_path = video_path
+        self.filename = filename
+        self.status_path = os.path.join(jobs_folder, f"{job_id}.json")
+        self.cancel_path = os.path.join(jobs_folder, f"{job_id}.cancel")
+        self.cancel_event = threading.Event()
+        self.status = "queued"
+        self.message = None
+        self.output_filename = None
+        self.frames_done = 0
+        self.total_frames = None
+        self.fps = None
+        self.eta_seconds = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.pid = os.getpid()
+        self._last_write = 0.0
+
+    def snapshot(self):
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "message": self.message,
+            "frames_done": self.frames_done,
+            "total_frames": self.total_frames,
+            "progress": round(self.frames_done / self.total_frames, 4) if self.total_frames else None,
+            "fps": round(self.fps, 2) if self.fps is not None else None,
+            "eta_seconds": round(self.eta_seconds, 1) if self.eta_seconds is not None else None,
+            "output_filename": self.output_filename,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "pid": self.pid,
+            "updated": time.time(),
+        }
+
+    def save(self):
+        temp_path = f"{self.status_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temp_path, self.status_path)  # readers never see a half-written file
+        self._last_write = time.time()
+
+    def cancel_requested(self):
+        if not self.cancel_event.is_set() and os.path.exists(self.cancel_path):
+            self.cancel_event.set()  # asked through another worker
+        return self.cancel_event.is_set()
+
+    def progress(self, frames_done, total_frames):
+        """progress_callback of process_video()."""
+        now = time.time()
+        self.frames_done = frames_done
+        self.total_frames = total_frames or None
+        elapsed = now - self.started
+        if elapsed > 0:
+            self.fps = frames_done / elapsed
+            if self.total_frames and self.fps > 0:
+                self.eta_seconds = max(0.0, (self.total_frames - frames_done) / self.fps)
+        if now - self._last_write >= STATUS_WRITE_INTERVAL:
+            self.save()
+            self.cancel_requested()
+
+
+class VideoJobManager:
+    """Job queue plus VIDEO_JOB_WORKERS worker threads, started with the first job."""
+
+    def __init__(self, results_folder, workers=VIDEO_JOB_WORKERS, queue_size=VIDEO_JOB_QUEUE_SIZE, max_duration=VIDEO_JOB_MAX_DURATION):
+        self.results_folder = results_folder
+        self.jobs_folder = os.path.join(results_folder, "jobs")
+        self.workers = max(1, workers)
+        self.max_duration = max_duration
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._jobs = {}  # queued and running jobs of this process
+        self._lock = threading.Lock()
+        self._threads = []
+        self._recover()
+
+    def _recover(self):
+        """Marks the jobs of processes that are gone (worker killed or restarted) as failed."""
+        if not os.path.isdir(self.jobs_folder):
+            return
+        for name in os.listdir(self.jobs_folder):
+            if name.endswith(".json"):
+                self.status(name[:-len(".json")])
+
+    def _acquire_slot(self, job):
+        """Blocks until one of the VIDEO_JOB_WORKERS host-wide slots is free; None if the job was cancelled meanwhile."""
+        while True:
+            for i in range(self.workers):
+                slot = open(os.path.join(self.jobs_folder, f"slot-{i}.lock"), "w")
+                try:
+                    fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return slot  # released by closing it, or by the kernel if this process dies
+                except BlockingIOError:
+                    slot.close()
+            if job.cancel_requested():
+                return None
+            time.sleep(1.0)
+
+    def submit(self, video_path, filename):
+        os.makedirs(self.jobs_folder, exist_ok=True)
+        job = VideoJob(uuid.uuid4().hex, video_path, filename, self.jobs_folder)
+        job.save()
+        with self._lock:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                os.remove(job.status_path)
+                raise JobQueueFull(f"{self._queue.maxsize} videos are already waiting")
+            self._jobs[job.id] = job
+            if not self._threads:
+                for i in range(self.workers):
+                    thread = threading.Thread(target=self._worker, name=f"video-job-{i}", daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+        logger.info(f"Queued video job {job.id} ({filename})")
+        return job
+
+    def status(self, job_id):
+        """Latest status dict of a job, or None for an unknown id."""
+        if not JOB_ID_PATTERN.match(job_id):
+            return None
+        status_path = os.path.join(self.jobs_folder, f"{job_id}.json")
+        try:
+            with open(status_path) as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if orphaned(status):
+            status.update(status="failed", message="The worker process running this job exited", finished=time.time(), eta_seconds=None)
+            temp_path = f"{status_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(status, f)
+            os.replace(temp_path, status_path)
+        return status
+
+    def cancel(self, job_id):
+        status = self.status(job_id)
+        if status is None or status["status"] in FINISHED_STATES:
+            return status
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            job.cancel_event.set()
+        else:
+            # Owned by another worker process; it picks the marker up within STATUS_WRITE_INTERVAL
+            open(os.path.join(self.jobs_folder, f"{job_id}.cancel"), "w").close()
+        status["cancel_requested"] = True
+        return status
+
+    def output_path(self, status):
+        return os.path.join(self.results_folder, status["output_filename"])
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            except Exception as e:
+                logger.exception(f"Video job {job.id} failed: {e}")
+                job.status, job.message = "failed", str(e)
+            job.finished = time.time()
+            job.save()
+            if os.path.exists(job.cancel_path):
+                os.remove(job.cancel_path)
+            with self._lock:
+                self._jobs.pop(job.id, None)
+
+    def _run(self, job):
+        if job.cancel_requested():
+            job.status, job.message = "cancelled", "Cancelled before it started"
+            if os.path.exists(job.video_path):
+                os.remove(job.video_path)
+            return
+        slot = self._acquire_slot(job)
+        if slot is None:
+            job.status, job.message = "cancelled", "Cancelled before it started"
+            if os.path.exists(job.video_path):
+                os.remove(job.video_path)
+            return
+        job.status = "running"
+        job.started = time.time()
+        job.save()
+        try:
+            message, output_filename, status_code, _ = process_video(
+                job.video_path, self.results_folder, max_duration=self.max_duration,
+                progress_callback=job.progress, cancel_event=job.cancel_event)
+        except VideoProcessingCancelled as e:
+            job.status, job.message = "cancelled", str(e)
+            return
+        finally:
+            slot.close()
+        job.message = message
+        if status_code == 200 and output_filename:
+            job.status, job.output_filename = "done", output_filename
+            job.eta_seconds = 0.0
+        else:
+            job.status = "failed"
+        logger.info(f"Video job {job.id} {job.status}: {message}")
@@ -1,14 +1,19 @@
 # ws_server.py
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import logging
 import base64
 import os
 from datetime import datetime
-from typing import List
+from typing import Optional
 import asyncio
 import io
+import time
+from frame_protocol import unpack_frame, BINARY_SUBPROTOCOL
+from relay_channels import Frame, DetectionMessage, Subscriber, MjpegClient, DEFAULT_CHANNEL, channels, find_channel, get_channel, start_doorbell, stop_doorbell
+from relay_metrics import MetricsWriter, uptime_seconds, format_uptime
+from renditions import rendition_width
 
 app = FastAPI()
 
@@ -24,62 +29,49 @@ app.add_middleware(
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("ws_server")
 
-# وضعیت آخرین دریافت تصویر
-last_image_status = {"ok": False, "last_time": None}
-last_image_b64 = None  # ذخیره آخرین تصویر
-last_image_bytes = None  # ذخیره تصویر به صورت باینری برای استریم
+@app.on_event("startup")
+async def startup():
+    # Same-host producers (FRAME_TRANSPORT=shm) and other workers ring this doorbell
+    start_doorbell()
 
-# List to keep track of active WebSocket connections for broadcasting new images
-active_broadcast_connections: List[WebSocket] = []
-# List to keep track of active WebSocket connections for streaming video
-active_streaming_connections: List[WebSocket] = []
+@app.on_event("shutdown")
+async def shutdown():
+    stop_doorbell()
+
+# Longest a /last_image?after_seq= long-poll may be held open (seconds)
+LONG_POLL_MAX_TIMEOUT = float(os.environ.get("LONG_POLL_MAX_TIMEOUT", 30.0))
 
 # MJPEG boundary for streaming
 BOUNDARY = "frame"
-MULTIPART_FRAME_HEADER = f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: "
+# Part headers also carry the relay sequence number and capture time (used by load_test.py)
+MULTIPART_FRAME_HEADER = f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
 
-async def broadcast_image(image_b64: str):
-    """Sends the image data to all connected WebSocket clients (broadcast and streaming)."""
-    disconnected_broadcast = []
-    disconnected_streaming = []
+async def accept_websocket(websocket: WebSocket):
+    """Accepts the socket; returns True when the client asked for binary frames (?format=binary or the fire-jpeg subprotocol)."""
+    offered = BINARY_SUBPROTOCOL in websocket.scope.get("subprotocols", [])
+    await websocket.accept(subprotocol=BINARY_SUBPROTOCOL if offered else None)
+    return offered or websocket.query_params.get("format") == "binary"
 
-    # Broadcast to broadcast connections
-    logger.info(f"Broadcasting image to {len(active_broadcast_connections)} broadcast clients.")
-    for connection in active_broadcast_connections:
-        try:
-            await connection.send_text(image_b64)
-        except WebSocketDisconnect:
-            disconnected_broadcast.append(connection)
-            logger.info("Broadcast client disconnected")
-        except Exception as e:
-            logger.error(f"Error sending message to broadcast client: {e}")
-            disconnected_broadcast.append(connection)
+def unknown_camera(camera_id: str):
+    return JSONResponse({"error": f"Unknown camera '{camera_id}'"}, status_code=404)
 
-    # Stream to streaming connections
-    logger.info(f"Streaming image to {len(active_streaming_connections)} streaming clients.")
-    for connection in active_streaming_connections:
-        try:
-            await connection.send_text(image_b64)
-        except WebSocketDisconnect:
-            disconnected_streaming.append(connection)
-            logger.info("Streaming client disconnected")
-        except Exception as e:
-            logger.error(f"Error sending message to streaming client: {e}")
-            disconnected_streaming.append(connection)
-
-    # Remove disconnected connections
-    for connection in disconnected_broadcast:
-        if connection in active_broadcast_connections:
-            active_broadcast_connections.remove(connection)
-            logger.debug("Removed disconnected broadcast client.")
-    for connection in disconnected_streaming:
-        if connection in active_streaming_connections:
-            active_streaming_connections.remove(connection)
-            logger.debug("Removed disconnected streaming client.")
+async def reject_unknown_camera(websocket: WebSocket, camera_id: str):
+    # Closing before accept answers the handshake with 403
+    logger.info(f"Rejected WebSocket {websocket.url.path}: unknown camera '{camera_id}'")
+    await websocket.close(code=1008)
+
+def websocket_width(websocket: WebSocket):
+    """Rendition width from ?width= (e.g. 640 or 320); invalid values fall back to the full frame."""
+    try:
+        return rendition_width(websocket.query_params.get("width"))
+    except ValueError as e:
+        logger.warning(f"Ignoring ?width= on {websocket.url.path}: {e}")
+        return None
 
 @app.post("/push_image")
-async def push_image(request: Request):
-    global last_image_b64, last_image_bytes, last_image_status
+@app.post("/push_image/{camera_id}")
+async def push_image(request: Request, camera_id: str = DEFAULT_CHANNEL):
+    channel = get_channel(camera_id)
     try:
         data = await request.json()
         image_b64 = data.get("image_b64")
@@ -89,61 +81,177 @@ async def push_image(request: Request):
 
         # Decode the image for MJPEG streaming
         try:
-            last_image_bytes = base64.b64decode(image_b64)
+            image_bytes = base64.b64decode(image_b64)
         except Exception as e:
             logger.error(f"Error decoding base64 image: {e}")
-            
+            return JSONResponse({"status": "error", "detail": "Invalid image_b64"}, status_code=400)
+
         # Decode and save image (optional, consider if needed for debugging)
-        # img_data = base64.b64decode(image_b64)
-        now_dt = datetime.now()
-        now_str = now_dt.strftime("%Y%m%d_%H%M%S_%f")
         # img_path = os.path.join("/tmp", f"fire_frame_{now_str}.jpg")
         # with open(img_path, "wb") as f:
-        #     f.write(img_data)
-        logger.info(f"Image received via /push_image at {now_str}")
-
-        last_image_b64 = image_b64  # ذخیره آخرین تصویر
-        last_image_status["ok"] = True
-        last_image_status["last_time"] = now_str
+        #     f.write(image_bytes)
 
-        # Broadcast the new image to all connected WebSocket clients
-        await broadcast_image(image_b64)
+        # Store and broadcast the new image to all connected WebSocket clients
+        # Optional capture timestamp (epoch seconds), echoed to binary and MJPEG viewers for latency measurement
+        capture_time = float(data["capture_time"]) if data.get("capture_time") is not None else None
+        now_str = channel.publish(Frame(image_bytes, capture_time=capture_time, image_b64=image_b64))
+        logger.info(f"Image received via /push_image for camera '{camera_id}' at {now_str}")
 
-        return {"status": "ok"}
+        return {"status": "ok", "control": channel.control()}
     except Exception as e:
         logger.error(f"Error in /push_image: {e}", exc_info=True)
-        last_image_status["ok"] = False
+        channel.status["ok"] = False
         return JSONResponse({"status": "error", "detail": str(e)}, status_code=500)
 
+@app.post("/push_frame")
+async def push_frame(request: Request):
+    """Binary ingest: frame_protocol header + raw JPEG body, sent over a keep-alive connection."""
+    try:
+        body = await request.body()
+        try:
+            camera_id, seq, capture_time, detections, image_bytes = unpack_frame(body)
+        except ValueError as e:
+            logger.error(f"Invalid frame in /push_frame: {e}")
+            return JSONResponse({"status": "error", "detail": str(e)}, status_code=400)
+
+        frame = Frame(image_bytes, source_seq=seq, capture_time=capture_time, detections=detections)
+        channel = get_channel(camera_id)
+        now_str = channel.publish(frame)
+        logger.debug(f"Frame {seq} from camera '{camera_id}' received via /push_frame at {now_str}")
+
+        # Backpressure: tells the producer how many viewers there are and what to send next
+        return {"status": "ok", "seq": seq, "control": channel.control()}
+    except Exception as e:
+        logger.error(f"Error in /push_frame: {e}", exc_info=True)
+        return JSONResponse({"status": "error", "detail": str(e)}, status_code=500)
+
+@app.post("/push_detections")
+@app.post("/push_detections/{camera_id}")
+async def push_detections(request: Request, camera_id: str = DEFAULT_CHANNEL):
+    """
+    Detection metadata for one producer frame, sent by Fire_Detection.py next to (or instead of) the video:
+    {"seq", "capture_time", "width", "height", "detections": [{"box": [x1, y1, x2, y2], "class_id", "class", "confidence", "track_id"}]}
+    """
+    try:
+        data = await request.json()
+    except ValueError:
+        return JSONResponse({"status": "error", "detail": "Body is not JSON"}, status_code=400)
+    if not isinstance(data, dict) or not isinstance(data.get("detections"), list):
+        return JSONResponse({"status": "error", "detail": "Expected an object with a 'detections' list"}, status_code=400)
+    data["camera_id"] = camera_id
+    get_channel(camera_id).publish_detections(DetectionMessage(data))
+    return {"status": "ok"}
+
+@app.get("/detections")
+@app.get("/detections/{camera_id}")
+async def latest_detections(camera_id: str = DEFAULT_CHANNEL):
+    """Latest detection message of a camera (for alerting without decoding images)"""
+    channel = find_channel(camera_id)
+    if channel is None:
+        return unknown_camera(camera_id)
+    message = channel.latest_detections
+    if message is None:
+        return JSONResponse({"error": "No detections received yet"}, status_code=404)
+    return Response(message.text(), media_type="application/json")
+
+@app.get("/control")
+@app.get("/control/{camera_id}")
+async def producer_control(camera_id: str = DEFAULT_CHANNEL):
+    """Producer settings for a camera; polled by Fire_Detection.py while it is not sending previews."""
+    channel = find_channel(camera_id)
+    if channel is None:
+        return unknown_camera(camera_id)
+    return channel.control()
+
 @app.get("/fire_status")
-def fire_status():
+@app.get("/fire_status/{camera_id}")
+async def fire_status(camera_id: str = DEFAULT_CHANNEL):
     # وضعیت را برای فرانت ارسال می‌کند
-    logger.debug(f"GET /fire_status requested. Status: {last_image_status}")
-    if last_image_status["ok"]:
-        return {"status": "good", "last_time": last_image_status["last_time"]}
+    channel = find_channel(camera_id)
+    if channel is None:
+        return unknown_camera(camera_id)
+    status = channel.status
+    logger.debug(f"GET /fire_status requested for camera '{camera_id}'. Status: {status}")
+    if status["ok"]:
+        return {"status": "good", "last_time": status["last_time"]}
     else:
         return {"status": "waiting"}
 
+def frame_etag(frame, width=None, format="json"):
+    # Sequence number plus receive time, so numbers reused after a relay restart get a new tag;
+    # both are stored in the shared store, so every worker derives the same tag for a frame.
+    # The format is part of the tag: the JSON and JPEG bodies of one frame are different entities.
+    return f'"{frame.seq}-{int(frame.received_time * 1000)}-{width or "full"}-{format}"'
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
 @app.get("/last_image")
-def last_image():
-    logger.debug("GET /last_image requested.")
+@app.get("/last_image/{camera_id}")
+async def last_image(request: Request, camera_id: str = DEFAULT_CHANNEL, format: str = "json",
+                     after_seq: Optional[int] = None, timeout: float = 10.0, width: Optional[str] = None):
+    """
+    Latest frame as base64 JSON, or the raw JPEG with ?format=jpeg (?width= selects a rendition).
+    Responses carry an ETag keyed on the frame sequence number and If-None-Match answers 304.
+    With ?after_seq=N the request waits up to ?timeout= seconds for a newer frame and answers
+    304 when none arrives. An after_seq ahead of the relay (e.g. after a restart) answers at once.
+    """
+    logger.debug(f"GET /last_image requested for camera '{camera_id}'.")
+    try:
+        width = rendition_width(width)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
     try:
-        if last_image_b64:
-            logger.debug("Returning last image.")
-            return JSONResponse({"image_b64": last_image_b64})
-        else:
+        channel = find_channel(camera_id)
+        if channel is None:
+            return unknown_camera(camera_id)
+        channel.last_polled = time.monotonic()
+        if after_seq is not None and after_seq > channel.notifier.seq:
+            # The client's seq is from before a relay restart; it would never be passed, so
+            # answer with the current frame (or wait for the first one)
+            after_seq = None if channel.latest_frame is not None else channel.notifier.seq
+        if after_seq is not None and channel.notifier.seq <= after_seq:
+            try:
+                await asyncio.wait_for(channel.notifier.wait_newer(after_seq), max(0.0, min(timeout, LONG_POLL_MAX_TIMEOUT)))
+            except asyncio.TimeoutError:
+                pass
+        latest_frame = channel.latest_frame
+        if latest_frame is None:
             logger.warning("No last image available for GET /last_image.")
             return JSONResponse({"error": "No image available"}, status_code=404)
+        etag = frame_etag(latest_frame, width, "jpeg" if format == "jpeg" else "json")
+        headers = {"ETag": etag, "X-Frame-Seq": str(latest_frame.seq), "Cache-Control": "no-cache"}
+        if (after_seq is not None and latest_frame.seq <= after_seq) or etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        logger.debug("Returning last image.")
+        latest_frame = await latest_frame.rendition(width)
+        if format == "jpeg":
+            return Response(latest_frame.jpeg, media_type="image/jpeg", headers=headers)
+        return JSONResponse({
+            "image_b64": latest_frame.b64(),
+            "seq": latest_frame.seq,
+            "capture_time": latest_frame.capture_time,
+            "detections": latest_frame.detections,
+        }, headers=headers)
     except Exception as e:
         logger.error(f"Error in /last_image: {e}", exc_info=True)
         return JSONResponse({"error": str(e)}, status_code=500)
 
 @app.websocket("/ws/fire_image")
-async def websocket_broadcast_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for broadcasting new images."""
-    await websocket.accept()
-    active_broadcast_connections.append(websocket)
-    logger.info("Client connected to broadcast WebSocket /ws/fire_image")
+@app.websocket("/ws/fire_image/{camera_id}")
+async def websocket_broadcast_endpoint(websocket: WebSocket, camera_id: str = DEFAULT_CHANNEL):
+    """WebSocket endpoint for broadcasting new images (base64 text, or binary with ?format=binary)."""
+    channel = find_channel(camera_id)
+    if channel is None:
+        await reject_unknown_camera(websocket, camera_id)
+        return
+    binary = await accept_websocket(websocket)
+    subscriber = Subscriber(websocket, channel, "broadcast", binary, websocket_width(websocket))
+    subscriber.start()
+    logger.info(f"Client connected to broadcast WebSocket /ws/fire_image for camera '{camera_id}'")
     try:
         # Keep the connection alive, waiting for broadcasts
         while True:
@@ -153,32 +261,31 @@ async def websocket_broadcast_endpoint(websocket: WebSocket):
     except WebSocketDisconnect:
         logger.info("Client disconnected from broadcast WebSocket /ws/fire_image")
     except Exception as e:
-        logger.error(f"Broadcast WebSocket error: {e}", exc_info=True)
+        if not subscriber.closed:
+            logger.error(f"Broadcast WebSocket error: {e}", exc_info=True)
     finally:
-        if websocket in active_broadcast_connections:
-            active_broadcast_connections.remove(websocket)
-            logger.debug("Removed client from active_broadcast_connections.")
+        subscriber.close()
 
 @app.websocket("/ws/video_stream")
-async def websocket_stream_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for real-time video streaming."""
-    await websocket.accept()
-    active_streaming_connections.append(websocket)
-    logger.info(f"Client connected to streaming WebSocket /ws/video_stream. Total streaming clients: {len(active_streaming_connections)}")
+@app.websocket("/ws/video_stream/{camera_id}")
+async def websocket_stream_endpoint(websocket: WebSocket, camera_id: str = DEFAULT_CHANNEL):
+    """WebSocket endpoint for real-time video streaming (base64 text, or binary with ?format=binary)."""
+    channel = find_channel(camera_id)
+    if channel is None:
+        await reject_unknown_camera(websocket, camera_id)
+        return
+    binary = await accept_websocket(websocket)
+    subscriber = Subscriber(websocket, channel, "streaming", binary, websocket_width(websocket))
+    subscriber.start()
+    logger.info(f"Client connected to streaming WebSocket /ws/video_stream for camera '{camera_id}'. Total streaming clients: {len(channel.streaming_subscribers)}")
 
     # Send the last known image immediately if available
-    if last_image_b64:
-        try:
-            logger.debug("Sending initial last image to new streaming client.")
-            await websocket.send_text(last_image_b64)
-        except Exception as e:
-            logger.error(f"Error sending initial image to streaming client: {e}", exc_info=True)
-            if websocket in active_streaming_connections:
-                 active_streaming_connections.remove(websocket)
-            return
+    if channel.latest_frame is not None:
+        logger.debug("Queueing initial last image for new streaming client.")
+        subscriber.offer(channel.latest_frame)
 
     try:
-        # Keep the connection alive, waiting for broadcasts via broadcast_image
+        # Keep the connection alive; frames are delivered by the subscriber's writer task
         while True:
             # We don't expect messages from the client here, just keep alive
             await websocket.receive_text()
@@ -186,51 +293,216 @@ async def websocket_stream_endpoint(websocket: WebSocket):
     except WebSocketDisconnect:
         logger.info("Client disconnected from streaming WebSocket /ws/video_stream")
     except Exception as e:
-        logger.error(f"Streaming WebSocket error: {e}", exc_info=True)
+        if not subscriber.closed:
+            logger.error(f"Streaming WebSocket error: {e}", exc_info=True)
     finally:
-        if websocket in active_streaming_connections:
-            active_streaming_connections.remove(websocket)
-            logger.debug(f"Removed client from active_streaming_connections. Remaining: {len(active_streaming_connections)}")
+        subscriber.close()
+
+@app.websocket("/ws/detections")
+@app.websocket("/ws/detections/{camera_id}")
+async def websocket_detections_endpoint(websocket: WebSocket, camera_id: str = DEFAULT_CHANNEL):
+    """WebSocket endpoint for detection metadata: one JSON text message per processed frame."""
+    channel = find_channel(camera_id)
+    if channel is None:
+        await reject_unknown_camera(websocket, camera_id)
+        return
+    await websocket.accept()
+    subscriber = Subscriber(websocket, channel, "detections")
+    subscriber.start()
+    logger.info(f"Client connected to detections WebSocket for camera '{camera_id}'. Total detection clients: {len(channel.detection_subscribers)}")
+    if channel.latest_detections is not None:
+        subscriber.offer(channel.latest_detections)
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        logger.info("Client disconnected from detections WebSocket")
+    except Exception as e:
+        if not subscriber.closed:
+            logger.error(f"Detections WebSocket error: {e}", exc_info=True)
+    finally:
+        subscriber.close()
 
 # MJPEG Streaming - used for real-time video directly in browser
-async def mjpeg_generator():
-    """Generate MJPEG Stream for real-time video"""
-    while True:
-        if last_image_bytes:
-            # Send multipart JPEG frame
-            frame_len = len(last_image_bytes)
-            frame_header = f"{MULTIPART_FRAME_HEADER}{frame_len}\r\n\r\n"
-            frame_data = last_image_bytes
-            frame_end = b"\r\n"
-            
-            yield frame_header.encode('utf-8')
-            yield frame_data
-            yield frame_end
-        
-        # Continue sending frames with a small delay
-        await asyncio.sleep(0.03)  # Approx 30 FPS
+async def mjpeg_generator(channel, max_fps: Optional[float] = None, width: Optional[int] = None):
+    """
+    Generate MJPEG Stream for real-time video. Each frame is sent once, as soon as it
+    arrives; a client that lags behind skips straight to the newest frame.
+    """
+    min_interval = 1.0 / max_fps if max_fps else 0.0
+    client = MjpegClient(channel, width)
+    channel.mjpeg_clients.append(client)
+    last_sent_seq = 0
+    try:
+        while True:
+            last_sent_seq = await channel.notifier.wait_newer(last_sent_seq)
+            frame = await channel.latest_frame.rendition(width)
+            sent_at = asyncio.get_running_loop().time()
+
+            # Send multipart JPEG frame as a single chunk
+            frame_header = (f"{MULTIPART_FRAME_HEADER}X-Frame-Seq: {frame.seq}\r\nX-Capture-Time: {frame.capture_time or 0.0}\r\n"
+                            f"Content-Length: {len(frame.jpeg)}\r\n\r\n")
+            chunk = b"".join((frame_header.encode('utf-8'), frame.jpeg, b"\r\n"))
+            yield chunk
+            client.record_send(frame, len(chunk))
+
+            # Optional per-client FPS cap
+            if min_interval:
+                remaining = min_interval - (asyncio.get_running_loop().time() - sent_at)
+                if remaining > 0:
+                    await asyncio.sleep(remaining)
+    finally:
+        channel.mjpeg_clients.remove(client)
 
 @app.get("/mjpeg_stream")
-async def mjpeg_stream():
-    """Endpoint for MJPEG streaming - can be directly used as img src in browser"""
+@app.get("/mjpeg_stream/{camera_id}")
+async def mjpeg_stream(camera_id: str = DEFAULT_CHANNEL, max_fps: Optional[float] = None, width: Optional[str] = None):
+    """
+    Endpoint for MJPEG streaming - can be directly used as img src in browser
+    (?max_fps= caps the rate per client, ?width=320 or 640 selects a downscaled rendition)
+    """
+    try:
+        width = rendition_width(width)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    channel = find_channel(camera_id)
+    if channel is None:
+        return unknown_camera(camera_id)
     return StreamingResponse(
-        mjpeg_generator(),
+        mjpeg_generator(channel, max_fps, width),
         media_type=f"multipart/x-mixed-replace; boundary={BOUNDARY}"
     )
 
+def resolve_time(value: Optional[float]):
+    """Absolute epoch seconds; negative values are relative to now (e.g. since=-10 means ten seconds ago)."""
+    if value is not None and value < 0:
+        return time.time() + value
+    return value
+
+@app.get("/frames")
+@app.get("/frames/{camera_id}")
+async def list_frames(camera_id: str = DEFAULT_CHANNEL, since: Optional[float] = None, until: Optional[float] = None, limit: int = 1000):
+    """Index of the buffered frames of a channel in [since, until] (epoch seconds, negative = seconds ago)"""
+    channel = find_channel(camera_id)
+    if channel is None:
+        return unknown_camera(camera_id)
+    history = channel.history
+    frames = history.range(resolve_time(since), resolve_time(until), limit)
+    return {"camera_id": camera_id, "history": history.stats(), "frames": [frame.info() for frame in frames]}
+
+@app.get("/frames/{camera_id}/{seq}")
+async def get_frame(camera_id: str, seq: int, width: Optional[str] = None):
+    """Raw JPEG of one buffered frame (?width= selects a rendition)"""
+    try:
+        width = rendition_width(width)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    channel = find_channel(camera_id)
+    if channel is None:
+        return unknown_camera(camera_id)
+    frame = channel.history.get(seq)
+    if frame is None:
+        return JSONResponse({"error": f"Frame {seq} is not in the history of camera '{camera_id}'"}, status_code=404)
+    if width is not None:
+        rendition = await frame.rendition(width)
+        channel.history.release_payloads(frame)
+        frame = rendition
+    return Response(frame.jpeg, media_type="image/jpeg", headers={
+        "X-Frame-Seq": str(frame.seq),
+        "X-Received-Time": str(frame.received_time),
+    })
+
+@app.websocket("/ws/replay")
+@app.websocket("/ws/replay/{camera_id}")
+async def websocket_replay_endpoint(websocket: WebSocket, camera_id: str = DEFAULT_CHANNEL):
+    """
+    Streams buffered frames in [since, until] with their original spacing divided by
+    ?speed= (default 4x, 0 = as fast as possible), then closes. Same text/binary modes as /ws/video_stream.
+    """
+    channel = find_channel(camera_id)
+    if channel is None:
+        await reject_unknown_camera(websocket, camera_id)
+        return
+    binary = await accept_websocket(websocket)
+    width = websocket_width(websocket)
+    params = websocket.query_params
+    try:
+        since = resolve_time(float(params["since"])) if "since" in params else None
+        until = resolve_time(float(params["until"])) if "until" in params else None
+        speed = float(params.get("speed", 4.0))
+    except ValueError:
+        await websocket.close(code=1003)
+        return
+    frames = channel.history.range(since, until)
+    logger.info(f"Replaying {len(frames)} frames of camera '{camera_id}' at {speed}x")
+    try:
+        previous_time = None
+        for frame in frames:
+            if speed > 0 and previous_time is not None:
+                await asyncio.sleep(max(0.0, frame.received_time - previous_time) / speed)
+            previous_time = frame.received_time
+            payload_frame = await frame.rendition(width)
+            if binary:
+                await websocket.send_bytes(payload_frame.binary())
+            else:
+                await websocket.send_text(payload_frame.b64())
+            channel.history.release_payloads(frame)  # keep history memory at JPEG size
+        await websocket.close()
+    except WebSocketDisconnect:
+        logger.info("Client disconnected from replay WebSocket")
+    except Exception as e:
+        logger.error(f"Replay WebSocket error: {e}", exc_info=True)
+
 @app.get("/ping")
 def ping():
     """Endpoint to check if the server is running"""
     return {"status": "OK", "message": "Server is running", "timestamp": datetime.now().isoformat()}
 
 @app.get("/stats")
-def get_stats():
-    """Get server statistics"""
+async def get_stats():
+    """Get server statistics (totals plus a per-channel breakdown)"""
+    channel_stats = {camera_id: channel.stats() for camera_id, channel in channels.items()}
+    streaming_clients = sum(c["streaming_clients"] for c in channel_stats.values())
+    broadcast_clients = sum(c["broadcast_clients"] for c in channel_stats.values())
+    mjpeg_clients = sum(c["mjpeg_clients"] for c in channel_stats.values())
+    detection_clients = sum(c["detection_clients"] for c in channel_stats.values())
+    last_times = [c["last_image_time"] for c in channel_stats.values() if c["last_image_time"]]
+    uptime = uptime_seconds()
     return {
-        "status": "running" if last_image_status["ok"] else "idle",
-        "images_received": sum(1 for _ in range(1)) if last_image_bytes else 0,
-        "active_clients": len(active_streaming_connections) + len(active_broadcast_connections),
-        "streaming_clients": len(active_streaming_connections),
-        "broadcast_clients": len(active_broadcast_connections),
-        "last_image_time": last_image_status["last_time"]
-    }
\ No newline at end of file
+        "status": "running" if any(c["status"] == "running" for c in channel_stats.values()) else "idle",
+        "uptime_seconds": round(uptime, 1),
+        "uptime_formatted": format_uptime(uptime),
+        "images_received": sum(c["images_received"] for c in channel_stats.values()),
+        "fps": round(sum(c["fps"] for c in channel_stats.values()), 2),
+        "egress_fps": round(sum(c["egress_fps"] for c in channel_stats.values()), 2),
+        "bytes_in": sum(c["bytes_in"] for c in channel_stats.values()),
+        "bytes_out": sum(c["bytes_out"] for c in channel_stats.values()),
+        "frames_dropped": sum(c["frames_dropped"] for c in channel_stats.values()),
+        "active_clients": streaming_clients + broadcast_clients + mjpeg_clients + detection_clients,
+        "streaming_clients": streaming_clients,
+        "broadcast_clients": broadcast_clients,
+        "mjpeg_clients": mjpeg_clients,
+        "detection_clients": detection_clients,
+        "detections_received": sum(c["detections_received"] for c in channel_stats.values()),
+        "last_image_time": max(last_times) if last_times else None,
+        "worker_pid": os.getpid(),
+        "channels": channel_stats,
+    }
+
+@app.get("/stats/{camera_id}")
+async def get_channel_stats(camera_id: str):
+    """Get statistics of one camera channel"""
+    channel = find_channel(camera_id)
+    if channel is None:
+        return unknown_camera(camera_id)
+    return channel.stats()
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of the relay counters, gauges and latency histograms"""
+    writer = MetricsWriter()
+    writer.gauge("relay_uptime_seconds", "Seconds since the relay started", round(uptime_seconds(), 1))
+    writer.gauge("relay_channels", "Known camera channels", len(channels))
+    for channel in list(channels.values()):
+        channel.write_metrics(writer)
+    return PlainTextResponse(writer.render(), media_type="text/plain; version=0.0.4")